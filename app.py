@@ -37,4 +37,5 @@ app.register_blueprint(geojsonapi)
 
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
-    app.run(host='0.0.0.0', port=port)
\ No newline at end of file
+    #: Every streamed job and every observer of its events needs its own request thread
+    app.run(host='0.0.0.0', port=port, threaded=True)
\ No newline at end of file
@@ -0,0 +1,346 @@
+#  -*- coding: utf-8 -*-
+"""
+    OSM Deviation Finder - Benchmarks
+    ~~~~~~~~~~~~~~~~~~~~
+
+    Simple benchmarks to compare the alternative implementations (engines) of the OSM Deviation Finder library.
+    The benchmarks run against the tables of an existing deviation map, eg. one of the sample datasets
+    (see Sample Data) imported and harmonized with the web interface.
+
+    Usage:
+        python benchmark.py "dbname=odf host=localhost user=odf password=odf" 1a2b3c4d junctionmatching
+        python benchmark.py "dbname=odf host=localhost user=odf password=odf" 1a2b3c4d 5e6f7a8b sampling
+
+    :copyright: (c) 2015 by Martin Hochenwarter
+    :license:  MIT
+"""
+
+__author__ = 'Martin Hochenwarter'
+__version__ = '0.1'
+
+import time
+import json
+import argparse
+import psycopg2
+try:
+    import numpy as np
+except ImportError:
+    np = None
+from osmdeviationfinder import OSMDeviationfinder, HarmonizeOptions, LinematchOptions, LineArrays, \
+    candidate_predicates, candidate_sql, max_potential_matches
+
+
+def timed(function, *args, **kwargs):
+    """Calls a function (and exhausts it, if it is a generator) and returns the result and the elapsed seconds"""
+    start = time.time()
+    result = function(*args, **kwargs)
+    if hasattr(result, 'next'):
+        result = list(result)
+    return result, time.time() - start
+
+
+def prepare_junctions(odf, dbconnectioninfo, options):
+    """Opens a new connection for the deviation finder and generates the junctions of the (presplitted, if
+    existing) ref- and osm-tables of the map. Returns the names of both tables.
+    """
+    odf.connection = psycopg2.connect(dbconnectioninfo)
+    odf.cursor = odf.connection.cursor()
+    reftable, osmtable = options.reftable, options.osmtable
+    if odf.has_columns(reftable+'_presplitted', ['id']):
+        reftable += '_presplitted'
+    if odf.has_columns(osmtable+'_presplitted', ['id']):
+        osmtable += '_presplitted'
+    odf.generate_junctions(reftable)
+    odf.generate_junctions(osmtable)
+    return reftable, osmtable
+
+
+def bench_junctionmatching(dbconnectioninfo, map_id, repeat=3):
+    """Compares the sql junction matching with the in-process assignment engine.
+    Junctions are generated for the (presplitted, if existing) ref- and osm-tables of the map, then both engines
+    are timed and the number of matched junctions and their agreement is reported.
+    """
+    options = HarmonizeOptions(map_id)
+    odf = OSMDeviationfinder(dbconnectioninfo)
+    results = {}
+    for engine in ('sql', 'python'):
+        times = []
+        for i in xrange(repeat):
+            reftable, osmtable = prepare_junctions(odf, dbconnectioninfo, options)
+            args = (options.basetable, reftable, osmtable, str(options.searchradius),
+                    str(options.azimuthdifftolerance), str(options.max_azdiff), str(options.max_distancediff),
+                    str(options.max_roads_countdiff))
+            if engine == 'sql':
+                elapsed = timed(odf.junction_matching, *args)[1]
+            else:
+                elapsed = timed(odf.junction_matching_inprocess, *args)[1]
+            times.append(elapsed)
+            odf.cursor.execute('SELECT DISTINCT junction_id FROM '+reftable+'_points WHERE matched;')
+            results[engine] = set(r[0] for r in odf.cursor.fetchall())
+            odf.connection.rollback()
+            odf.connection.close()
+        print '%-8s best of %d: %8.3fs, %d matched reference junctions' % (engine, repeat, min(times),
+                                                                           len(results[engine]))
+    common = len(results['sql'] & results['python'])
+    print 'Matched reference junctions found by both engines: %d' % common
+
+
+def bench_cutpoints(dbconnectioninfo, map_id, repeat=3):
+    """Compares the sql cutpoint creation with the vectorized numpy engine.
+    Junctions are generated and matched with the sql engine, then the cutpoints of both tables are created by
+    both engines and the number of cutpoints and their agreement (same source point and line) is reported.
+    """
+    options = HarmonizeOptions(map_id)
+    odf = OSMDeviationfinder(dbconnectioninfo)
+    results = {}
+    for engine in ('sql', 'numpy'):
+        times = []
+        for i in xrange(repeat):
+            reftable, osmtable = prepare_junctions(odf, dbconnectioninfo, options)
+            odf.junction_matching(options.basetable, reftable, osmtable, str(options.searchradius),
+                                  str(options.azimuthdifftolerance), str(options.max_azdiff),
+                                  str(options.max_distancediff), str(options.max_roads_countdiff))
+            if engine == 'sql':
+                cutpoint_creation = odf.cutpoint_creation
+            else:
+                cutpoint_creation = odf.cutpoint_creation_numpy
+            elapsed = 0.0
+            for table1, table2 in ((reftable, osmtable), (osmtable, reftable)):
+                elapsed += timed(cutpoint_creation, table1, table2, str(options.searchradius),
+                                 str(options.azimuthdifftolerance), str(options.maxcheckpointanglediff))[1]
+            times.append(elapsed)
+            results[engine] = set()
+            for table in (reftable, osmtable):
+                odf.cursor.execute('SELECT sourcepointid, parentline_id FROM '+table+'_cutpoints;')
+                results[engine].update((table,) + r for r in odf.cursor.fetchall())
+            odf.connection.rollback()
+            odf.connection.close()
+        print '%-8s best of %d: %8.3fs, %d cutpoints' % (engine, repeat, min(times), len(results[engine]))
+    common = len(results['sql'] & results['numpy'])
+    print 'Cutpoints created by both engines: %d' % common
+
+
+def bench_candidates(dbconnectioninfo, map_id, repeat=3):
+    """Measures the candidate generation of the linematching for the harmonized tables of the map: the time, the
+    histogram of the candidates per reference feature and the ratio of the pairs pruned by each predicate.
+    """
+    options = LinematchOptions(map_id)
+    odf = OSMDeviationfinder(dbconnectioninfo)
+    times = []
+    for i in xrange(repeat):
+        connection = psycopg2.connect(dbconnectioninfo)
+        cursor = connection.cursor()
+        stats = odf.candidate_generation(options.reftable, options.osmtable, str(options.searchradius),
+                                         str(options.minmatchingfeatlen), str(options.maxlengthdiffratio),
+                                         str(options.maxanglediff), options.maxpotentialmatches, cursor,
+                                         stats=(i == 0))
+        if i == 0:
+            first = stats
+        times.append(stats['seconds'])
+        connection.rollback()
+        connection.close()
+    print 'best of %d: %8.3fs, %d candidates for %d reference features' % (repeat, min(times), first['candidates'],
+                                                                         first['features'])
+    print 'candidates per reference feature:'
+    for n in sorted(first['histogram']):
+        print '%6d: %d' % (n, first['histogram'][n])
+    print 'remaining pairs and pruning ratio per predicate:'
+    for (name, remaining), (pruned_name, ratio) in zip(first['remaining'][1:], first['pruned']):
+        print '%-20s %12d %6.1f%%' % (name, remaining, ratio*100)
+
+
+def evaluated_rows(plan, table):
+    """Returns the number of rows of a table (or of its versions), which were evaluated by the filters of the scans
+    of a query plan (EXPLAIN ANALYZE in json format): the returned and the removed rows of all loops
+    """
+    rows = 0
+    if plan.get('Relation Name', '').startswith(table):
+        rows += (plan.get('Actual Rows', 0) + plan.get('Rows Removed by Filter', 0) +
+                 plan.get('Rows Removed by Index Recheck', 0)) * plan.get('Actual Loops', 1)
+    for child in plan.get('Plans', []):
+        rows += evaluated_rows(child, table)
+    return rows
+
+
+def bench_candidatepredicates(dbconnectioninfo, map_id, repeat=3):
+    """Compares the candidate generation with the computed predicates and with the indexed range predicates on
+    canon_direction and loglength (see candidate_predicates): the time, the number of osm lines evaluated by the
+    filters of the scans and the number of candidates, which has to be the same. The difference grows with the
+    density of the network, use a dense (eg. urban) map.
+    """
+    options = LinematchOptions(map_id)
+    limit = min(int(options.maxpotentialmatches), max_potential_matches)
+    results = {}
+    for indexed in (False, True):
+        predicates = candidate_predicates(str(options.searchradius), str(options.minmatchingfeatlen),
+                                          str(options.maxlengthdiffratio), str(options.maxanglediff), indexed)
+        query = candidate_sql(options.reftable, options.osmtable, predicates, limit)
+        connection = psycopg2.connect(dbconnectioninfo)
+        cursor = connection.cursor()
+        times = []
+        for i in xrange(repeat):
+            start = time.time()
+            cursor.execute(query+';')
+            results[indexed] = set(cursor.fetchall())
+            times.append(time.time() - start)
+        cursor.execute('EXPLAIN (ANALYZE, FORMAT JSON) '+query+';')
+        plan = cursor.fetchone()[0]
+        if isinstance(plan, basestring):
+            plan = json.loads(plan)
+        evaluated = evaluated_rows(plan[0]['Plan'], options.osmtable)
+        connection.rollback()
+        connection.close()
+        print '%-9s best of %d: %8.3fs, %d evaluated osm lines, %d candidates' % (
+            'indexed' if indexed else 'computed', repeat, min(times), evaluated, len(results[indexed]))
+    print 'Candidates found by both predicates: %d' % len(results[False] & results[True])
+
+
+def bench_posdev(dbconnectioninfo, map_id, repeat=3):
+    """Compares the sql calculation of the positional differences of the linematching with the numpy engine.
+    The candidates are generated once per run, then the differences of both directions are calculated by both
+    engines (the numpy time includes loading the lines) and the number of pairs and the max. absolute difference
+    between the engines is reported.
+    """
+    options = LinematchOptions(map_id)
+    odf = OSMDeviationfinder(dbconnectioninfo)
+    seglen = str(options.posdiffsegmentlength)
+    results = {}
+    for engine in ('sql', 'numpy'):
+        times = []
+        for i in xrange(repeat):
+            connection = psycopg2.connect(dbconnectioninfo)
+            cursor = connection.cursor()
+            odf.candidate_generation(options.reftable, options.osmtable, str(options.searchradius),
+                                     str(options.minmatchingfeatlen), str(options.maxlengthdiffratio),
+                                     str(options.maxanglediff), options.maxpotentialmatches, cursor)
+            start = time.time()
+            if engine == 'sql':
+                for reverse in (False, True):
+                    odf.positional_deviation(options.reftable, options.osmtable, reverse, seglen, cursor)
+            else:
+                lines1 = LineArrays.from_table(cursor, options.reftable,
+                                               't.id IN (SELECT t1_id FROM potentialmatches)')
+                lines2 = LineArrays.from_table(cursor, options.osmtable,
+                                               't.id IN (SELECT t2_id FROM potentialmatches)')
+                for reverse in (False, True):
+                    odf.positional_deviation_numpy(lines1, lines2, reverse, seglen, cursor)
+            times.append(time.time() - start)
+            results[engine] = {}
+            cursor.execute('SELECT t1_id, t2_id, diff FROM posdev_t1;')
+            results[engine].update(((1, t1, t2), diff) for t1, t2, diff in cursor.fetchall())
+            cursor.execute('SELECT t1_id, t2_id, diff FROM posdev_t2;')
+            results[engine].update(((2, t1, t2), diff) for t1, t2, diff in cursor.fetchall())
+            connection.rollback()
+            connection.close()
+        print '%-8s best of %d: %8.3fs, %d differences' % (engine, repeat, min(times), len(results[engine]))
+    common = set(results['sql']) & set(results['numpy'])
+    maxdiff = max([abs(float(results['sql'][k]) - results['numpy'][k]) for k in common] or [0.0])
+    print 'Differences calculated by both engines: %d, max. absolute difference: %g' % (len(common), maxdiff)
+
+
+def bench_posdevscaling(dbconnectioninfo, map_id, repeat=3, processes=4):
+    """Measures the scaling of the parallel positional differences engine from 1 to the given number of processes.
+    The candidates are generated and the lines are loaded into shared memory once, then the differences of both
+    directions are calculated with every number of processes and the speedup to a single process is reported.
+    """
+    options = LinematchOptions(map_id)
+    odf = OSMDeviationfinder(dbconnectioninfo)
+    seglen = str(options.posdiffsegmentlength)
+    connection = psycopg2.connect(dbconnectioninfo)
+    cursor = connection.cursor()
+    odf.candidate_generation(options.reftable, options.osmtable, str(options.searchradius),
+                             str(options.minmatchingfeatlen), str(options.maxlengthdiffratio),
+                             str(options.maxanglediff), options.maxpotentialmatches, cursor)
+    lines1 = LineArrays.from_table(cursor, options.reftable, 't.id IN (SELECT t1_id FROM potentialmatches)').share()
+    lines2 = LineArrays.from_table(cursor, options.osmtable, 't.id IN (SELECT t2_id FROM potentialmatches)').share()
+    single = None
+    for p in xrange(1, processes+1):
+        times = []
+        for i in xrange(repeat):
+            start = time.time()
+            for reverse in (False, True):
+                odf.positional_deviation_numpy(lines1, lines2, reverse, seglen, cursor, processes=p)
+            times.append(time.time() - start)
+            cursor.execute('DROP TABLE posdev_t1; DROP TABLE posdev_t2;')
+        if single is None:
+            single = min(times)
+        print '%2d processes best of %d: %8.3fs, speedup %5.2f' % (p, repeat, min(times), single/min(times))
+    connection.rollback()
+    connection.close()
+
+
+def bench_sampling(dbconnectioninfo, map_ids, repeat=3, maxpoints=(8, 16, 32, 64), dense=10):
+    """Compares the runtime and the accuracy of fixed and adaptive sampling (see LineArrays.sample) of the positional
+    differences, eg. on the maps of both sample areas. The candidates of each map are generated and the lines are
+    loaded once, the mean positional difference of every candidate pair (the mean of both directions) is calculated
+    with fixed sampling at posdiffsegmentlength and with adaptive sampling capped at each number of maxpoints. The
+    errors are measured against fixed sampling at a dense times smaller interval.
+    """
+    if np is None:
+        raise ImportError('The sampling benchmark needs numpy, install it first')
+    for map_id in map_ids:
+        options = LinematchOptions(map_id)
+        odf = OSMDeviationfinder(dbconnectioninfo)
+        interval = float(options.posdiffsegmentlength)
+        connection = psycopg2.connect(dbconnectioninfo)
+        cursor = connection.cursor()
+        odf.candidate_generation(options.reftable, options.osmtable, str(options.searchradius),
+                                 str(options.minmatchingfeatlen), str(options.maxlengthdiffratio),
+                                 str(options.maxanglediff), options.maxpotentialmatches, cursor)
+        lines1 = LineArrays.from_table(cursor, options.reftable, 't.id IN (SELECT t1_id FROM potentialmatches)')
+        lines2 = LineArrays.from_table(cursor, options.osmtable, 't.id IN (SELECT t2_id FROM potentialmatches)')
+        cursor.execute('SELECT t1_id, t2_id FROM potentialmatches WHERE t2_id IS NOT NULL;')
+        pairs = np.array([(lines1.index[t1], lines2.index[t2]) for t1, t2 in cursor.fetchall()
+                          if t1 in lines1.index and t2 in lines2.index], dtype=np.int64).reshape(-1, 2)
+        connection.rollback()
+        connection.close()
+
+        def posdev(sample):
+            points1, offsets1 = sample(lines1)
+            points2, offsets2 = sample(lines2)
+            diffs = (lines2.mean_distances(points1, offsets1, pairs[:, 0], pairs[:, 1]) +
+                     lines1.mean_distances(points2, offsets2, pairs[:, 1], pairs[:, 0]))/2.0
+            return diffs, len(points1)+len(points2)
+
+        exact, points = posdev(lambda lines: lines.segmentize(interval/dense))
+        print '%s: %d pairs, reference: fixed sampling at %g with %d points' % (map_id, len(pairs), interval/dense,
+                                                                                 points)
+        samplers = [('fixed', lambda lines: lines.segmentize(interval))]
+        samplers += [('adaptive %d' % m, lambda lines, m=m: lines.sample(interval, m)) for m in maxpoints]
+        for name, sample in samplers:
+            times = []
+            for i in xrange(repeat):
+                (diffs, points), seconds = timed(posdev, sample)
+                times.append(seconds)
+            errors = np.abs(diffs - exact)
+            relative = errors / np.where(exact > 0, exact, 1.0)
+            print '  %-12s best of %d: %8.3fs, %9d points, mean abs. error %.3g, max %.3g, mean rel. error %.2f%%' % (
+                name, repeat, min(times), points, errors.mean() if len(errors) else 0.0,
+                errors.max() if len(errors) else 0.0, 100*relative.mean() if len(relative) else 0.0)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmarks for the OSM Deviation Finder engines')
+    parser.add_argument('dbconnectioninfo', help='the connection string for the database')
+    parser.add_argument('map_id', nargs='+', help='the id of an existing deviation map, sampling compares several')
+    parser.add_argument('benchmark', choices=['junctionmatching', 'cutpoints', 'candidates',
+                                              'candidatepredicates', 'posdev', 'posdevscaling', 'sampling'])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--processes', type=int, default=4, help='the max. number of processes of posdevscaling')
+    args = parser.parse_args()
+    if len(args.map_id) > 1 and args.benchmark != 'sampling':
+        parser.error('only the sampling benchmark compares several maps')
+    map_id = args.map_id[0]
+    if args.benchmark == 'junctionmatching':
+        bench_junctionmatching(args.dbconnectioninfo, map_id, args.repeat)
+    elif args.benchmark == 'cutpoints':
+        bench_cutpoints(args.dbconnectioninfo, map_id, args.repeat)
+    elif args.benchmark == 'candidates':
+        bench_candidates(args.dbconnectioninfo, map_id, args.repeat)
+    elif args.benchmark == 'candidatepredicates':
+        bench_candidatepredicates(args.dbconnectioninfo, map_id, args.repeat)
+    elif args.benchmark == 'posdev':
+        bench_posdev(args.dbconnectioninfo, map_id, args.repeat)
+    elif args.benchmark == 'posdevscaling':
+        bench_posdevscaling(args.dbconnectioninfo, map_id, args.repeat, args.processes)
+    elif args.benchmark == 'sampling':
+        bench_sampling(args.dbconnectioninfo, args.map_id, args.repeat)
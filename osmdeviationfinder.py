@@ -16,11 +16,28 @@ __author__ = 'Martin Hochenwarter'
 __version__ = '0.1'
 
 import psycopg2
+import psycopg2.extensions
 import urllib2
 import os.path
+import copy
+import json
+import hashlib
+import math
+import time
+import Queue
+import ctypes
+import threading
+import multiprocessing
+from cStringIO import StringIO
 from osgeo import ogr
 
-#: If DEBUG is set to True, intermediate tables will not be temporary!
+#: numpy is optional, it's only needed by the vectorized engines
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+#: If DEBUG is set to True, debug output is printed and the tables of the tiles are kept after stitching
 DEBUG = True
 ogr.UseExceptions()
 
@@ -32,6 +49,651 @@ ref_suffix = '_ref'
 osm_suffix = '_osm'
 splitted_suffix = '_splitted'
 linematched_suffix = '_result'
+topology_table = 'odf_topology'
+stage_runs_table = 'odf_stage_runs'
+table_versions_table = 'odf_table_versions'
+intermediates_table = 'odf_intermediates'
+task_table = 'odf_tasks'
+match_cache_table = 'odf_match_cache'
+#: work_mem of the harmonization stages per profile, the key None holds the value for stages without an own entry,
+#: stages without a value use the setting of the database server
+work_mem_profiles = {
+    'default': {},
+    'low': {None: '16MB'},
+    'high': {None: '64MB', 'junction_matching': '256MB', 'cutpoint_creation': '256MB',
+             'linesplit_with_cutpoints': '256MB'},
+}
+#: The hard cap of the potential matches per reference feature, maxpotentialmatches is limited to it
+max_potential_matches = 50
+#: The columns of the split tables with a btree index, they serve the range predicates of the candidate generation
+split_indexes = ['canon_direction', 'loglength']
+
+
+def candidate_predicates(searchradius, minmatchingfeatlen, maxlengthdiffratio, maxanglediff, indexed=False):
+    """Returns the predicates of the candidate generation for a pair of lines t1, t2 as a list of (name, sql) tuples
+    in the order they are applied. Every predicate is parenthesized, so they can be combined with AND.
+
+    If indexed is True, the predicates are range predicates on the columns canon_direction and loglength of the
+    split tables (see split_indexes), which an index can serve: the length ratio of two lines is below the limit,
+    if the difference of their log-lengths is below its logarithm, and the orientation independent difference of
+    two directions is below the limit, if their canonical directions (folded into [0, pi)) are within the limit,
+    wrapping around at pi.
+
+    :param searchradius: the max. distance between the lines
+    :param minmatchingfeatlen: one of the lines has to be longer
+    :param maxlengthdiffratio: the max. ratio between the lengths of the lines
+    :param maxanglediff: the max. difference of the directions of the lines (orientation independent)
+    :param indexed: use the range predicates on canon_direction and loglength
+    """
+    if indexed:
+        minloglength = 'ln(greatest('+minmatchingfeatlen+', 1e-300))'
+        logratio = 'ln('+maxlengthdiffratio+')'
+        return [('searchradius', 'ST_DWithin(t1.geom, t2.geom, '+searchradius+')'),
+                ('minmatchingfeatlen', '(t1.loglength > '+minloglength+' OR t2.loglength > '+minloglength+')'),
+                ('maxlengthdiffratio', '(t2.loglength > t1.loglength - '+logratio+' '
+                                       'AND t2.loglength < t1.loglength + '+logratio+')'),
+                ('maxanglediff', '((t2.canon_direction > t1.canon_direction - '+maxanglediff+' '
+                                 'AND t2.canon_direction < t1.canon_direction + '+maxanglediff+') '
+                                 'OR t2.canon_direction > t1.canon_direction - '+maxanglediff+' + '+pi+' '
+                                 'OR t2.canon_direction < t1.canon_direction + '+maxanglediff+' - '+pi+')')]
+    return [('searchradius', 'ST_DWithin(t1.geom, t2.geom, '+searchradius+')'),
+            ('minmatchingfeatlen', '(st_length(t1.geom) > '+minmatchingfeatlen+' '
+                                   'OR st_length(t2.geom) > '+minmatchingfeatlen+')'),
+            #: Lines without length have no ratio, they are no candidates
+            ('maxlengthdiffratio', '(greatest(st_length(t1.geom), st_length(t2.geom))/'
+                                   'NULLIF(least(st_length(t1.geom), st_length(t2.geom)), 0) < '
+                                   + maxlengthdiffratio+')'),
+            ('maxanglediff', '(abs((abs(t1.direction - t2.direction)+'+maxanglediff+') % '+pi+' - '
+                             + maxanglediff+') < '+maxanglediff+')')]
+
+
+def candidate_sql(table1, table2, predicates, limit):
+    """Returns the query of the candidate generation: the ids of up to limit nearest lines of table2 (t2_id), which
+    satisfy all predicates, for every line of table1 (t1_id)
+
+    :param table1: the reference table
+    :param table2: the osm table
+    :param predicates: the predicates returned by candidate_predicates
+    :param limit: the max. number of candidates per line of table1
+    """
+    return ('SELECT t1.id as t1_id, '
+            'unnest(ARRAY(SELECT t2.id '
+            'FROM '+table2+' t2 '
+            'WHERE '+' AND '.join(sql for name, sql in predicates)+' '
+            'ORDER BY t1.geom <-> t2.geom LIMIT '+str(limit)+')) as t2_id '
+            'FROM '+table1+' t1')
+
+
+def sample_points_sql(table, segmentlength, maxpoints=None):
+    """Returns the subquery of the points (geom, id) along the lines of a table, at which the positional differences
+    are measured. Fixed sampling keeps the vertices and divides the segments longer than segmentlength (like
+    LineArrays.segmentize), adaptive sampling places ceil(length/segmentlength)+1 points, but not more than maxpoints,
+    at equal distances along each line. The curvature-aware placement of LineArrays.sample is left to the numpy
+    engines.
+
+    :param table: the table with the line features
+    :param segmentlength: the interval of the points along the lines
+    :param maxpoints: the max. number of points per line of adaptive sampling, None for fixed sampling
+    """
+    if maxpoints is None:
+        return '(SELECT (st_dumppoints(st_segmentize(t.geom,'+segmentlength+'))).geom, t.id FROM '+table+' t)'
+    return ('(SELECT ST_LineInterpolatePoint(s.geom, generate_series(0, s.n-1)::double precision/(s.n-1)) as geom, '
+            's.id FROM (SELECT t.id, t.geom, '
+            'greatest(2, least('+str(maxpoints)+', ceil(st_length(t.geom)/'+segmentlength+')::integer+1)) as n '
+            'FROM '+table+' t) s)')
+
+
+def canon_direction_sql(geom):
+    """Returns the sql expression for the direction of a line (the azimuth from its start- to its endpoint) folded
+    into [0, pi), so lines with opposite orientation have the same canonical direction.
+
+    :param geom: sql expression of the line geometry
+    """
+    azimuth = 'ST_AZIMUTH(st_startpoint('+geom+'), st_endpoint('+geom+'))'
+    return '('+azimuth+' - '+pi+'*floor('+azimuth+'/'+pi+'))'
+
+
+def loglength_sql(geom):
+    """Returns the sql expression for the natural logarithm of the length of a line, NULL for lines without length
+
+    :param geom: sql expression of the line geometry
+    """
+    return 'ln(NULLIF(st_length('+geom+'), 0))'
+
+
+def startazimuth_sql(geom):
+    """Returns the sql expression for the azimuth of the first segment of a line, seen from its startpoint.
+
+    :param geom: sql expression of the line geometry
+    """
+    return 'ST_AZIMUTH(st_startpoint('+geom+'), st_pointn('+geom+', 2))'
+
+
+def endazimuth_sql(geom):
+    """Returns the sql expression for the azimuth of the last segment of a line, seen from its endpoint.
+
+    :param geom: sql expression of the line geometry
+    """
+    return 'ST_AZIMUTH(st_endpoint('+geom+'), st_pointn('+geom+', ST_NPoints('+geom+')-1))'
+
+
+def copy_value(value):
+    """Returns a value as a field of the COPY text format, None is NULL and backslashes, tabs and newlines of strings
+    are escaped
+    """
+    if value is None:
+        return '\\N'
+    if isinstance(value, float):
+        return repr(value)
+    if isinstance(value, unicode):
+        value = value.encode('utf-8')
+    if isinstance(value, str):
+        return value.replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+    return str(value)
+
+
+def copy_rows(cursor, table, columns, rows):
+    """Bulk loads rows into a table using COPY, which is a lot faster than single inserts.
+    Geometries have to be given as (e)wkt strings, None values are loaded as NULL.
+
+    :param cursor: the psycopg2 cursor used for the copy
+    :param table: the table the rows are loaded into
+    :param columns: a list of the column names of the rows
+    :param rows: an iterable of row tuples
+    """
+    buf = StringIO()
+    for row in rows:
+        buf.write('\t'.join(copy_value(v) for v in row))
+        buf.write('\n')
+    buf.seek(0)
+    cursor.copy_from(buf, table, columns=columns)
+
+
+def normalize_name(name):
+    """Returns a name for the comparison with other names: lower case, without leading, trailing and repeated
+    whitespace. Names are decoded from utf-8, so the distances count characters, as the levenshtein of postgres.
+    """
+    if isinstance(name, str):
+        name = name.decode('utf-8', 'replace')
+    return u' '.join(name.lower().split())
+
+
+def levenshtein(a, b):
+    """Returns the levenshtein distance (the min. number of inserted, deleted and substituted characters) between
+    two strings
+    """
+    if a == b:
+        return 0
+    if len(a) < len(b):
+        a, b = b, a
+    previous = range(len(b)+1)
+    for i, ca in enumerate(a):
+        current = [i+1]
+        for j, cb in enumerate(b):
+            current.append(min(previous[j+1]+1, current[j]+1, previous[j]+(ca != cb)))
+        previous = current
+    return previous[-1]
+
+
+def name_distances(pairs, cache=None):
+    """Returns a list with the levenshtein distance of the normalized names (see normalize_name) of each pair. The
+    distance of each distinct pair of normalized names is calculated once.
+
+    :param pairs: an iterable of (name1, name2) tuples
+    :param cache: a dictionary with the distances per pair of normalized names, which is updated
+    """
+    if cache is None:
+        cache = {}
+    distances = []
+    for name1, name2 in pairs:
+        key = (normalize_name(name1), normalize_name(name2))
+        if key not in cache:
+            cache[key] = levenshtein(*key)
+        distances.append(cache[key])
+    return distances
+
+
+def azimuth_diff(az1, az2, tolerance, period=2*math.pi):
+    """Python version of the azimuth difference used in the queries: abs((abs(az1-az2)+tolerance) % period - tolerance)
+    """
+    return abs((abs(az1-az2)+tolerance) % period - tolerance)
+
+
+def min_cost_assignment(costs):
+    """Solves the assignment problem for a square cost matrix (list of lists) with the hungarian method in O(n^3).
+    Returns a list with the assigned column for each row.
+    """
+    n = len(costs)
+    u = [0.0] * (n+1)
+    v = [0.0] * (n+1)
+    p = [0] * (n+1)
+    way = [0] * (n+1)
+    for i in xrange(1, n+1):
+        p[0] = i
+        j0 = 0
+        minv = [float('inf')] * (n+1)
+        used = [False] * (n+1)
+        while True:
+            used[j0] = True
+            i0 = p[j0]
+            delta = float('inf')
+            j1 = 0
+            for j in xrange(1, n+1):
+                if not used[j]:
+                    cur = costs[i0-1][j-1] - u[i0] - v[j]
+                    if cur < minv[j]:
+                        minv[j] = cur
+                        way[j] = j0
+                    if minv[j] < delta:
+                        delta = minv[j]
+                        j1 = j
+            for j in xrange(n+1):
+                if used[j]:
+                    u[p[j]] += delta
+                    v[j] -= delta
+                else:
+                    minv[j] -= delta
+            j0 = j1
+            if p[j0] == 0:
+                break
+        while True:
+            j1 = way[j0]
+            p[j0] = p[j1]
+            j0 = j1
+            if j0 == 0:
+                break
+    assignment = [0] * n
+    for j in xrange(1, n+1):
+        assignment[p[j]-1] = j-1
+    return assignment
+
+
+def azimuths(a, b):
+    """Numpy version of ST_Azimuth for arrays of start- and endpoints (n x 2), nan where both points are equal"""
+    dx = b[:, 0] - a[:, 0]
+    dy = b[:, 1] - a[:, 1]
+    az = np.arctan2(dx, dy) % (2*math.pi)
+    az[(dx == 0) & (dy == 0)] = np.nan
+    return az
+
+
+class LineArrays(object):
+    """Holds the line features of a table as contiguous numpy arrays: the coordinates of all vertices (n x 2),
+    the offsets of the first vertex of each line, the length of each line and the fraction of each vertex along
+    its line (like st_linelocatepoint). Lines with less than two vertices are skipped.
+
+    :param ids: the ids of the lines
+    :param coords: a list of coordinate lists, one for each line
+    """
+    def __init__(self, ids, coords):
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.index = dict((lid, i) for i, lid in enumerate(ids))
+        counts = np.array([len(c) for c in coords], dtype=np.int64)
+        self.offsets = np.zeros(len(coords)+1, dtype=np.int64)
+        self.offsets[1:] = np.cumsum(counts)
+        self.coords = np.array([xy[:2] for c in coords for xy in c], dtype=np.float64).reshape(-1, 2)
+
+        #: Length of each segment (the last vertex of a line starts no segment), cumulated per line
+        seglengths = np.zeros(len(self.coords))
+        seglengths[:-1] = np.hypot(*(self.coords[1:] - self.coords[:-1]).T)
+        seglengths[self.offsets[1:]-1] = 0.0
+        cumulated = np.cumsum(seglengths) - seglengths
+        linestart = np.repeat(cumulated[self.offsets[:-1]], counts)
+        vertexdist = cumulated - linestart
+        self.lengths = vertexdist[self.offsets[1:]-1]
+        lengths = np.repeat(self.lengths, counts)
+        self.vertexfrac = np.where(lengths > 0, vertexdist / np.where(lengths > 0, lengths, 1.0), 0.0)
+        #: Monotonic key of each vertex (line index + fraction) to locate fractions with searchsorted
+        self.vertexkeys = np.repeat(np.arange(len(coords), dtype=np.float64), counts) + self.vertexfrac
+
+    @classmethod
+    def from_table(cls, cursor, table, where=None):
+        """Loads the line features of a table, optionally restricted by a where clause
+
+        :param cursor: the psycopg2 cursor used to fetch the lines
+        :param table: the table with the line features
+        :param where: an optional sql condition for the features of the table (alias t)
+        """
+        query = 'SELECT t.id, ST_AsBinary(t.geom) FROM '+table+' t WHERE t.geom IS NOT NULL'
+        if where:
+            query += ' and ('+where+')'
+        cursor.execute(query+' ORDER BY t.id;')
+        ids = []
+        coords = []
+        for lid, wkb in cursor.fetchall():
+            points = ogr.CreateGeometryFromWkb(str(wkb)).GetPoints() or []
+            if len(points) > 1:
+                ids.append(lid)
+                coords.append(points)
+        return cls(ids, coords)
+
+    def segments(self, lines):
+        """Returns for the given line indices an array which maps each segment to its position in lines and an array
+        with the index of the first vertex of each segment. The segments of a line are consecutive.
+        """
+        nseg = self.offsets[lines+1] - self.offsets[lines] - 1
+        owner = np.repeat(np.arange(len(lines)), nseg)
+        first = np.repeat(self.offsets[lines] - (np.cumsum(nseg) - nseg), nseg) + np.arange(nseg.sum())
+        return nseg, owner, first
+
+    def project(self, points, lines, chunksize=1000000):
+        """Projects each point onto the line with the same position in lines (like st_closestpoint and
+        st_linelocatepoint). The segments of all pairs are processed in vectorized batches of about chunksize.
+        Returns the distances, the fractions along the lines and the closest points.
+
+        :param points: the coordinates of the points (n x 2)
+        :param lines: the line index (not id) for each point
+        """
+        lines = np.asarray(lines, dtype=np.int64)
+        distances = np.empty(len(lines))
+        fractions = np.empty(len(lines))
+        closest = np.empty((len(lines), 2))
+        nsegtotal = np.cumsum(self.offsets[lines+1] - self.offsets[lines] - 1)
+        start = 0
+        while start < len(lines):
+            base = nsegtotal[start-1] if start else 0
+            stop = max(start+1, int(np.searchsorted(nsegtotal, base+chunksize, side='right')))
+            nseg, owner, first = self.segments(lines[start:stop])
+            a = self.coords[first]
+            ab = self.coords[first+1] - a
+            p = points[start:stop][owner]
+            l2 = (ab**2).sum(axis=1)
+            t = np.clip(np.where(l2 > 0, ((p-a)*ab).sum(axis=1) / np.where(l2 > 0, l2, 1.0), 0.0), 0.0, 1.0)
+            c = a + t[:, np.newaxis]*ab
+            d = np.hypot(*(p-c).T)
+            #: First segment with the min. distance of each pair
+            groupstart = np.cumsum(nseg) - nseg
+            mins = np.minimum.reduceat(d, groupstart)
+            candidates = np.flatnonzero(d == np.repeat(mins, nseg))
+            best = candidates[np.unique(owner[candidates], return_index=True)[1]]
+            distances[start:stop] = d[best]
+            closest[start:stop] = c[best]
+            f0 = self.vertexfrac[first[best]]
+            fractions[start:stop] = f0 + t[best]*(self.vertexfrac[first[best]+1] - f0)
+            start = stop
+        return distances, fractions, closest
+
+    def segmentize(self, maxlength):
+        """Numpy version of st_dumppoints(st_segmentize(geom, maxlength)) for all lines: every segment longer than
+        maxlength is divided into ceil(length/maxlength) equal parts. Returns the points (n x 2) ordered by line and
+        the offsets of the first point of each line.
+
+        :param maxlength: the max. length of the segments
+        """
+        nlines = len(self.offsets)-1
+        nseg, owner, first = self.segments(np.arange(nlines))
+        a = self.coords[first]
+        ab = self.coords[first+1] - a
+        pieces = np.maximum(1, np.ceil(np.hypot(*ab.T) / maxlength)).astype(np.int64)
+        segment = np.repeat(np.arange(len(first)), pieces)
+        k = np.arange(pieces.sum()) - np.repeat(np.cumsum(pieces) - pieces, pieces)
+        points = a[segment] + (k / pieces[segment].astype(np.float64))[:, np.newaxis]*ab[segment]
+        #: The points of each line are followed by its last vertex
+        perline = np.bincount(owner, weights=pieces, minlength=nlines).astype(np.int64) + 1
+        offsets = np.zeros(nlines+1, dtype=np.int64)
+        offsets[1:] = np.cumsum(perline)
+        position = np.arange(len(points)) + np.repeat(np.arange(nlines), perline-1)
+        result = np.empty((offsets[-1], 2))
+        result[position] = points
+        result[offsets[1:]-1] = self.coords[self.offsets[1:]-1]
+        return result, offsets
+
+    def sample(self, interval, maxpoints, curvature=0.5):
+        """Adaptive alternative to segmentize: each line gets ceil(length/interval)+1 points, but not more than
+        maxpoints (and at least two), so the number of points of long lines is capped. The points are placed at
+        equal steps of a mix of the length and the turning of the line: a share of curvature of the points of a
+        line is distributed by the turning angles at its vertices (half to each adjacent segment), so the points
+        concentrate at bends and straight sections get few points. Returns the points (n x 2) ordered by line and
+        the offsets of the first point of each line, like segmentize.
+
+        :param interval: the max. interval of the points along the lines
+        :param maxpoints: the max. number of points per line
+        :param curvature: the share of the points placed by the turning angles, 0 places them by length only
+        """
+        nlines = len(self.offsets)-1
+        nseg, owner, first = self.segments(np.arange(nlines))
+        groupstart = np.cumsum(nseg) - nseg
+        ab = self.coords[first+1] - self.coords[first]
+        seglengths = np.hypot(*ab.T)
+        heading = np.arctan2(ab[:, 1], ab[:, 0])
+
+        #: Turning angle at the start vertex of each segment, which follows a segment of the same line
+        turn = np.zeros(len(first))
+        inner = np.flatnonzero(owner[1:] == owner[:-1]) + 1
+        valid = (seglengths[inner] > 0) & (seglengths[inner-1] > 0)
+        turn[inner] = np.where(valid, np.abs((heading[inner] - heading[inner-1] + np.pi) % (2*np.pi) - np.pi), 0.0)
+        segturn = turn/2.0
+        segturn[inner-1] += turn[inner]/2.0
+
+        #: Weight of each segment (its share of the points of its line) and the cumulated weight at its start
+        linelengths = np.bincount(owner, weights=seglengths, minlength=nlines)
+        lineturns = np.bincount(owner, weights=segturn, minlength=nlines)
+        share = np.where(lineturns > 0, float(curvature), 0.0)[owner]
+        weights = ((1.0-share)*seglengths/np.where(linelengths > 0, linelengths, 1.0)[owner] +
+                   share*segturn/np.where(lineturns > 0, lineturns, 1.0)[owner])
+        cumulated = np.cumsum(weights) - weights
+        start = np.minimum(cumulated - np.repeat(cumulated[groupstart], nseg), 1.0)
+        segkeys = owner + start
+
+        counts = np.clip(np.ceil(linelengths/interval).astype(np.int64)+1, 2, max(2, int(maxpoints)))
+        offsets = np.zeros(nlines+1, dtype=np.int64)
+        offsets[1:] = np.cumsum(counts)
+        line = np.repeat(np.arange(nlines), counts)
+        w = (np.arange(offsets[-1]) - offsets[line]) / (counts[line]-1).astype(np.float64)
+        k = np.searchsorted(segkeys, line + w, side='right') - 1
+        k = np.clip(k, groupstart[line], groupstart[line]+nseg[line]-1)
+        t = np.clip(np.where(weights[k] > 0, (w - start[k]) / np.where(weights[k] > 0, weights[k], 1.0), 0.0),
+                    0.0, 1.0)
+        points = self.coords[first[k]] + t[:, np.newaxis]*ab[k]
+        points[offsets[:-1]] = self.coords[self.offsets[:-1]]
+        points[offsets[1:]-1] = self.coords[self.offsets[1:]-1]
+        return points, offsets
+
+    def share(self):
+        """Moves the arrays of the lines into shared memory (see shared_array), so the worker processes of a pool
+        read them without copying. Returns the lines.
+        """
+        for name in ('ids', 'offsets', 'coords', 'lengths', 'vertexfrac', 'vertexkeys'):
+            setattr(self, name, shared_array(getattr(self, name)))
+        return self
+
+    def mean_distances(self, points, offsets, sources, targets, limits=None, chunksize=1000000, roundsize=16):
+        """Returns for each pair the mean distance of the points of the source to the target line of this object
+        (like sum(ST_Distance(point, line))/count(point)). The pairs are processed in batches of about chunksize
+        points.
+
+        If limits are given, the points of each pair are processed in rounds of roundsize points. The sum of the
+        distances of the processed points divided by the count of all points of the source is a lower bound of the
+        mean, a pair is abandoned as soon as this bound exceeds its limit and gets the mean nan.
+
+        :param points: the points of the sources, ordered by source (eg. returned by segmentize)
+        :param offsets: the offsets of the first point of each source
+        :param sources: the source index for each pair
+        :param targets: the line index (not id) of the target line for each pair
+        :param limits: the max. mean distance for each pair, None to calculate all means
+        """
+        sources = np.asarray(sources, dtype=np.int64)
+        targets = np.asarray(targets, dtype=np.int64)
+        counts = offsets[sources+1] - offsets[sources]
+        if limits is None:
+            maxsums = np.repeat(np.inf, len(sources))
+            roundsize = int(counts.max()) if len(counts) else 1
+        else:
+            maxsums = np.asarray(limits, dtype=np.float64) * counts
+        sums = np.zeros(len(sources))
+        processed = np.zeros(len(sources), dtype=np.int64)
+        alive = np.arange(len(sources))
+        while len(alive):
+            n = np.minimum(counts[alive] - processed[alive], roundsize)
+            total = np.cumsum(n)
+            start = 0
+            while start < len(alive):
+                base = total[start-1] if start else 0
+                stop = max(start+1, int(np.searchsorted(total, base+chunksize, side='right')))
+                pairs = alive[start:stop]
+                m = n[start:stop]
+                pair = np.repeat(np.arange(stop-start), m)
+                index = (np.repeat(offsets[sources[pairs]] + processed[pairs] - (np.cumsum(m) - m), m) +
+                         np.arange(m.sum()))
+                distances = self.project(points[index], targets[pairs][pair])[0]
+                sums[pairs] += np.bincount(pair, weights=distances, minlength=stop-start)
+                start = stop
+            processed[alive] += n
+            alive = alive[(processed[alive] < counts[alive]) & (sums[alive] <= maxsums[alive])]
+        means = sums / counts
+        means[sums > maxsums] = np.nan
+        return means
+
+    def interpolate(self, lines, fractions):
+        """Numpy version of st_lineinterpolatepoint for the given line indices and fractions"""
+        lines = np.asarray(lines, dtype=np.int64)
+        fractions = np.asarray(fractions, dtype=np.float64)
+        k = np.searchsorted(self.vertexkeys, lines + fractions, side='right') - 1
+        k = np.clip(k, self.offsets[lines], self.offsets[lines+1]-2)
+        f0 = self.vertexfrac[k]
+        df = self.vertexfrac[k+1] - f0
+        t = np.clip(np.where(df > 0, (fractions-f0) / np.where(df > 0, df, 1.0), 0.0), 0.0, 1.0)
+        return self.coords[k] + t[:, np.newaxis]*(self.coords[k+1] - self.coords[k])
+
+
+def shared_array(array):
+    """Returns a copy of a numpy array in shared memory (a multiprocessing RawArray). Worker processes forked after
+    its creation read and write the same memory, nothing is copied or pickled.
+    """
+    array = np.ascontiguousarray(array)
+    if array.size == 0:
+        return array.copy()
+    shared = np.frombuffer(multiprocessing.RawArray(ctypes.c_char, array.nbytes), dtype=array.dtype)
+    shared = shared.reshape(array.shape)
+    shared[...] = array
+    return shared
+
+
+#: The shared arrays of the parallel_mean_distances call of a worker process, set by _init_mean_distances_worker
+_shared_state = {}
+
+
+def _init_mean_distances_worker(state):
+    """Initializes a worker process of parallel_mean_distances with the shared arrays of its call. The pool is
+    forked, so the arrays are inherited, not pickled, and every call (eg. of concurrent threads) has its own pool.
+    """
+    global _shared_state
+    _shared_state = state
+
+
+def _mean_distances_range(bounds):
+    """Calculates the mean distances of a range of pairs in a worker process of parallel_mean_distances"""
+    start, stop = bounds
+    state = _shared_state
+    limits = state['limits'][start:stop] if state['limits'] is not None else None
+    state['means'][start:stop] = state['targets'].mean_distances(state['points'], state['offsets'],
+                                                                 state['sources'][start:stop],
+                                                                 state['lines'][start:stop], limits)
+
+
+def parallel_mean_distances(targets, points, offsets, sources, lines, limits=None, owners=None, processes=None):
+    """Parallel version of LineArrays.mean_distances. The lines, the points, the pairs and the results are held in
+    shared memory (see shared_array), the pairs are sorted by their owners (the reference features) and partitioned
+    into ranges of about the same number of points, which never split the pairs of an owner. The ranges are
+    calculated by a pool of worker processes, which write the means of their pairs into the shared results.
+
+    :param targets: the LineArrays of the target lines, see LineArrays.share
+    :param points: the points of the sources, see LineArrays.mean_distances
+    :param offsets: the offsets of the first point of each source
+    :param sources: the source index for each pair
+    :param lines: the line index (not id) of the target line for each pair
+    :param limits: the max. mean distance for each pair, None to calculate all means
+    :param owners: the owner of each pair, the pairs of an owner are calculated by the same process
+    :param processes: the number of worker processes, None for the number of cpus
+    """
+    if not processes:
+        processes = multiprocessing.cpu_count()
+    if owners is None:
+        owners = np.arange(len(sources))
+    order = np.argsort(owners, kind='mergesort')
+    owners = owners[order]
+    sources = shared_array(np.asarray(sources, dtype=np.int64)[order])
+    counts = offsets[sources+1] - offsets[sources]
+    total = np.cumsum(counts)
+    if len(total) == 0:
+        return np.empty(0)
+
+    #: Cut at the first pair of an owner after every 1/(4*processes) of the points
+    nranges = 4*processes
+    cuts = np.searchsorted(total, total[-1]*np.arange(1, nranges)/float(nranges))
+    firsts = np.flatnonzero(np.concatenate(([True], owners[1:] != owners[:-1])))
+    after = np.searchsorted(firsts, cuts)
+    cuts = np.where(after < len(firsts), firsts[np.minimum(after, len(firsts)-1)], len(sources))
+    bounds = sorted(set([0, len(sources)] + cuts.tolist()))
+    ranges = zip(bounds[:-1], bounds[1:])
+
+    state = {'targets': targets, 'points': shared_array(points), 'offsets': shared_array(offsets),
+             'sources': sources, 'lines': shared_array(np.asarray(lines, dtype=np.int64)[order]),
+             'limits': shared_array(np.asarray(limits, dtype=np.float64)[order]) if limits is not None else None,
+             'means': shared_array(np.empty(len(sources)))}
+    pool = multiprocessing.Pool(processes, initializer=_init_mean_distances_worker, initargs=(state,))
+    try:
+        pool.map(_mean_distances_range, ranges, chunksize=1)
+        means = np.empty(len(sources))
+        means[order] = state['means']
+    finally:
+        pool.close()
+        pool.join()
+    return means
+
+
+def match_cache_bounds(linematch_options):
+    """Returns the limits of a linematching, which remove pairs before their matching parameters are complete (see
+    cached_matches): the max. azimuth difference, the max. absolute and relative mean positional difference. A tuning
+    run removes no pairs, its limits are None.
+    """
+    o = linematch_options
+    if o.tuning:
+        return {'maxazimuthdiff': None, 'maxabsolutmeanposdev': None, 'maxmeanposdevtolength': None}
+    return {'maxazimuthdiff': float(o.maxazimuthdiff), 'maxabsolutmeanposdev': float(o.maxabsolutmeanposdev),
+            'maxmeanposdevtolength': float(o.maxmeanposdevtolength)+float(o.minmeanposdevtolength)}
+
+
+def outside_limits_sql(linematch_options, alias='matchingparameters'):
+    """Returns the sql condition for the matching parameters (a row of matchingparameters or of a table with the same
+    columns) outside the limits of a linematching
+
+    :param linematch_options: the LinematchOptions of the linematching
+    :param alias: the name or alias of the table with the matching parameters
+    """
+    o = linematch_options
+    return (alias+'.lengthdiff>'+str(o.maxlengthdiffratio)+' or '+alias+'.directiondiff>'+str(o.maxazimuthdiff)+' '
+            'or '+alias+'.meanposdev/'+alias+'.meanlength>'+str(o.maxmeanposdevtolength)+'+'
+            + str(o.minmeanposdevtolength)+' or '+alias+'.meanposdev>'+str(o.maxabsolutmeanposdev))
+
+
+def fit_sql(linematch_options, alias='matchingparameters'):
+    """Returns the sql expression of the deviation of a pair: the weighted mean of the matching parameters, the azimuth
+    difference and the mean positional difference normalized to their limits
+
+    :param linematch_options: the LinematchOptions of the linematching
+    :param alias: the name or alias of the table with the matching parameters
+    """
+    o = linematch_options
+    weights = [float(w) for w in (o.lengthdiffweight, o.directiondiffweight, o.meanposdevweight, o.hausdorffweight)]
+    return ('(('+alias+'.lengthdiff*'+str(weights[0])+'+'+alias+'.directiondiff/'+str(o.maxazimuthdiff)+'*'
+            + str(weights[1])+'+('+alias+'.meanposdev/('+alias+'.meanlength*'+str(o.maxmeanposdevtolength)+'))*'
+            + str(weights[2])+'+'+alias+'.hausdorff*'+str(weights[3])+')/'+str(sum(weights))+')')
+
+
+def candidate_summary(stats):
+    """Returns a progress message with the statistics of the candidate generation, see candidate_generation
+
+    :param stats: the dictionary returned by candidate_generation
+    """
+    histogram = stats['histogram']
+    message = ('Found %d potential matches for %d reference features in %.2fs (max. %d per feature, %d features '
+               'without and %d at the cap)' % (stats['candidates'], stats['features'], stats['seconds'],
+                                               max(histogram) if histogram else 0, histogram.get(0, 0),
+                                               histogram.get(stats['limit'], 0)))
+    if 'pruned' in stats:
+        message += ', pruned by ' + ', '.join('%s %.1f%%' % (name, ratio*100) for name, ratio in stats['pruned'])
+    return message
 
 
 class HarmonizeOptions(object):
@@ -55,11 +717,27 @@ class HarmonizeOptions(object):
     :param max_azdiff: the max. allowed difference between the mean value of all azimuth angles between two
     matched junctions
     :param max_distancediff: the max. allowed distance between two matched junctions
+    :param junctionmatchingengine: 'sql' to match junctions with sql queries in the database, 'python' to fetch the
+    junctions once and match them in-process with a global one-to-one assignment, see junction_matching_inprocess
+    :param cutpointengine: 'sql' to create cutpoints with sql queries in the database, 'numpy' to create them
+    in-process with numpy, see cutpoint_creation_numpy
+    :param tiles: if greater than 1, the extent of the datasets is divided into tiles x tiles tiles, which are
+    harmonized in parallel, see harmonize_datasets_tiled
+    :param workers: the number of local workers (each with its own database connection) harmonizing the tiles in
+    parallel, 0 leaves the tiles to external worker processes, see worker.py and run_tasks
+    :param retention: what happens with the intermediate tables after the harmonization: 'keep' keeps them, so
+    repeated runs can skip unchanged stages, 'failed' keeps them only if the harmonization failed (to resume it),
+    'drop' always drops them, see drop_intermediates
+    :param statement_timeout: the max. duration of a single query of a harmonization stage in seconds, 0 disables
+    the limit
+    :param work_mem_profile: the name of the work_mem profile of the harmonization stages, see work_mem_profiles
     """
     def __init__(self, map_id, streetnamecol='name', harmonize=False, keepcolumns_t1={}, keepcolumns_t2={}, cleanref=False,
                  cleanrefradius=0.0000001, cleanosm=False, cleanosmradius=0.0000001, presplitref=False, presplitosm=False,
                  searchradius=0.0005, azimuthdifftolerance=0.785398163, maxcheckpointanglediff=0.5,
-                 max_roads_countdiff=3.0, max_azdiff=3.15, max_distancediff=0.0002):
+                 max_roads_countdiff=3.0, max_azdiff=3.15, max_distancediff=0.0002, junctionmatchingengine='sql',
+                 cutpointengine='sql', tiles=1, workers=4, retention='keep', statement_timeout=0,
+                 work_mem_profile='default'):
         self.basetable = table_prefix + map_id
         self.harmonize = harmonize
         self.reftable = self.basetable + ref_suffix
@@ -80,6 +758,13 @@ class HarmonizeOptions(object):
         self.max_roads_countdiff = max_roads_countdiff
         self.max_azdiff = max_azdiff
         self.max_distancediff = max_distancediff
+        self.junctionmatchingengine = junctionmatchingengine
+        self.cutpointengine = cutpointengine
+        self.tiles = tiles
+        self.workers = workers
+        self.retention = retention
+        self.statement_timeout = statement_timeout
+        self.work_mem_profile = work_mem_profile
 
 
 class LinematchOptions(object):
@@ -96,6 +781,10 @@ class LinematchOptions(object):
     partner to the ref-feature; a smaller number gives a better mean positional deviation value, but takes longer
     to calculate, a bigger number is faster, but more inexact
     :param hausdorffsegmentlength: the same as posdiffsegmentlength but for the hausdorff-distance
+    :param posdevsampling: 'fixed' to measure the positional differences at the vertices and every
+    posdiffsegmentlength along the lines, 'adaptive' to cap the number of points per line at posdevmaxpoints, see
+    LineArrays.sample and sample_points_sql
+    :param posdevmaxpoints: the max. number of points per line of adaptive sampling
     :param maxazimuthdiff: the max. allowed difference of azimuth angles (orientation independent) of two features
     :param maxmeanposdevtolength: the max. allowed ratio between the mean positional difference to mean length ratio
     between two potential matching partners which are beeing matched
@@ -104,12 +793,34 @@ class LinematchOptions(object):
     partners which are beeing matched
     :param maxdeviation: the max. allowed deviation (sum of meanposdev, azimuthdiff, lengthdiff,... divided by the
     number of factors) for the matching process
+    :param candidatestats: if True, the pruning ratio of every candidate predicate is measured, which needs an
+    additional spatial join, see candidate_generation
+    :param posdevengine: 'sql' to calculate the positional differences with sql queries in the database, 'numpy' to
+    calculate them in-process with numpy, see positional_deviation_numpy, 'parallel' to calculate them with numpy in
+    a pool of processes, see parallel_mean_distances
+    :param processes: the number of processes of the parallel engine, 0 for the number of cpus
+    :param matchcache: if True, the matching parameters are cached per map and reused by runs with the same split
+    tables, candidate and sampling parameters and limits not looser than the cached ones, see cached_matches
+    :param tuning: if True, the matching parameters of all candidates are calculated regardless of the limits and
+    cached, so the limits and weights can be tuned on the cache, see evaluate_matching. Tuning runs are never tiled
+    :param lengthdiffweight: the weight of the length difference ratio in the deviation of a pair
+    :param directiondiffweight: the weight of the azimuth difference (relative to maxazimuthdiff)
+    :param meanposdevweight: the weight of the mean positional difference (relative to maxmeanposdevtolength)
+    :param hausdorffweight: the weight of the Hausdorff distance
+    :param tiles: if greater than 1, the extent of the datasets is divided into tiles x tiles tiles, which are
+    matched in parallel, see linematch_datasets_tiled
+    :param workers: the number of local workers matching the tiles in parallel, 0 leaves the tiles to external
+    worker processes, see worker.py and run_tasks
     """
     def __init__(self, map_id, keepcolumns_t1={}, keepcolumns_t2={}, searchradius=0.0005, maxlengthdiffratio=2.0,
                  minmatchingfeatlen=0.0001, maxanglediff=0.32, maxpotentialmatches=10,
-                 posdiffsegmentlength=0.001, hausdorffsegmentlength=0.005, maxazimuthdiff=1.0472,
+                 posdiffsegmentlength=0.001, hausdorffsegmentlength=0.005, posdevsampling='fixed',
+                 posdevmaxpoints=32, maxazimuthdiff=1.0472,
                  maxmeanposdevtolength=0.6, minmeanposdevtolength=0.0001, maxabsolutmeanposdev=0.0005,
-                 maxdeviation=0.5):
+                 maxdeviation=0.5, candidatestats=False, posdevengine='sql', processes=0, matchcache=True,
+                 tuning=False,
+                 lengthdiffweight=2.0, directiondiffweight=1.0, meanposdevweight=4.0, hausdorffweight=2.0, tiles=1,
+                 workers=4):
         self.basetable = table_prefix + map_id
         self.reftable = self.basetable + ref_suffix + splitted_suffix
         self.osmtable = self.basetable +osm_suffix + splitted_suffix
@@ -123,11 +834,24 @@ class LinematchOptions(object):
         self.maxpotentialmatches = maxpotentialmatches
         self.posdiffsegmentlength = posdiffsegmentlength
         self.hausdorffsegmentlength = hausdorffsegmentlength
+        self.posdevsampling = posdevsampling
+        self.posdevmaxpoints = posdevmaxpoints
         self.maxazimuthdiff = maxazimuthdiff
         self.maxmeanposdevtolength = maxmeanposdevtolength
         self.minmeanposdevtolength = minmeanposdevtolength
         self.maxabsolutmeanposdev = maxabsolutmeanposdev
         self.maxdeviation = maxdeviation
+        self.candidatestats = candidatestats
+        self.posdevengine = posdevengine
+        self.processes = processes
+        self.matchcache = matchcache
+        self.tuning = tuning
+        self.lengthdiffweight = lengthdiffweight
+        self.directiondiffweight = directiondiffweight
+        self.meanposdevweight = meanposdevweight
+        self.hausdorffweight = hausdorffweight
+        self.tiles = tiles
+        self.workers = workers
 
 class ResultOptions(object):
     """A class to hold all necessary options for the result generation process.
@@ -188,6 +912,127 @@ class ResultOptions(object):
         self.gridcellsize = gridcellsize
 
 
+class RunHandle(object):
+    """A handle to cancel a running pipeline. The connections used by the run are attached to the handle, cancel
+    stops their running queries with pg_cancel_backend and the pipeline stops before the next stage.
+    :param dbconnectioninfo: the connection info, used to open the connection which cancels the queries
+    """
+    def __init__(self, dbconnectioninfo):
+        self.dbconnectioninfo = dbconnectioninfo
+        #: The backend pids of the attached connections
+        self.connections = {}
+        self.event = threading.Event()
+        self.lock = threading.Lock()
+
+    def attach(self, connection):
+        """Attaches a connection to the handle, its queries are cancelled by cancel"""
+        cursor = connection.cursor()
+        cursor.execute('SELECT pg_backend_pid();')
+        with self.lock:
+            self.connections[connection] = cursor.fetchone()[0]
+
+    def detach(self, connection):
+        """Detaches a connection from the handle, before it is closed or replaced. The backend pid of a closed
+        connection may be reused by another session, which cancel must not stop."""
+        with self.lock:
+            self.connections.pop(connection, None)
+
+    def cancelled(self):
+        """Returns True, if the run was cancelled"""
+        return self.event.is_set()
+
+    def cancel(self):
+        """Cancels the run and the running queries of all attached connections"""
+        self.event.set()
+        with self.lock:
+            pids = [pid for connection, pid in self.connections.items() if not connection.closed]
+        if not pids:
+            return
+        connection = psycopg2.connect(self.dbconnectioninfo)
+        connection.autocommit = True
+        cursor = connection.cursor()
+        for pid in pids:
+            cursor.execute('SELECT pg_cancel_backend(%s);', (pid,))
+        connection.close()
+
+
+class StageAborted(Exception):
+    """Raised if a stage was cancelled or one of its queries exceeded the statement timeout of the stage.
+    :param stage: the aborted stage
+    :param query: the running query, None if the stage was cancelled between two queries
+    :param reason: 'cancelled' or 'timeout'
+    """
+    def __init__(self, stage, query, reason):
+        self.stage = stage
+        self.query = query
+        self.reason = reason
+        if reason == 'cancelled':
+            message = 'Stage "'+stage.message+'" was cancelled'
+        else:
+            message = ('Stage "'+stage.message+'" exceeded the statement timeout of '
+                       + str(stage.statement_timeout)+'s')
+        if query:
+            message += ' in query: '+' '.join(query.split())[:300]
+        Exception.__init__(self, message)
+
+
+class ProgressEvent(str):
+    """A progress message with structured data about the progress of a run. It is a string (the message), so
+    consumers which only expect progress messages keep working.
+    :param message: the progress message
+    :param stage: the name of the current stage or step (eg. the method of a Stage), None if unknown
+    :param step: the number of the current step, starting with 1
+    :param steps: the number of steps of the run, None if unknown
+    :param rows: the number of rows written by the last finished step, None if unknown
+    :param elapsed: the seconds since the start of the run
+    :param done: True, if the event reports the end of the step
+    """
+    def __new__(cls, message, stage=None, step=None, steps=None, rows=None, elapsed=None, done=False):
+        event = str.__new__(cls, message)
+        event.stage = stage
+        event.step = step
+        event.steps = steps
+        #: Cursors report -1 for statements without a row count
+        event.rows = rows if rows is None or rows >= 0 else None
+        event.elapsed = elapsed
+        event.done = done
+        return event
+
+    def to_dict(self):
+        """Returns the event as a dictionary, eg. to serialize it as json"""
+        return {'message': str(self), 'stage': self.stage, 'step': self.step, 'steps': self.steps,
+                'rows': self.rows, 'elapsed': self.elapsed, 'done': self.done}
+
+
+class Stage(object):
+    """A stage of a processing pipeline, see OSMDeviationfinder.run_stages.
+    :param message: the progress message yielded when the stage starts
+    :param method: the name of the OSMDeviationfinder method, which is called with args
+    :param args: the arguments of the method
+    :param inputs: the tables read by the stage
+    :param outputs: the tables created or modified by the stage
+    :param statement_timeout: the max. duration of a single query of the stage in seconds, 0 disables the limit
+    :param work_mem: the work_mem setting of the stage (eg. '64MB'), None for the setting of the database server
+    """
+    def __init__(self, message, method, args, inputs, outputs, statement_timeout=0, work_mem=None):
+        self.message = message
+        self.method = method
+        self.args = args
+        self.inputs = set(inputs)
+        self.outputs = set(outputs)
+        self.statement_timeout = statement_timeout
+        self.work_mem = work_mem
+
+    def key(self):
+        """Identifies the stage across runs: the method and the tables written by it"""
+        return self.method+':'+','.join(sorted(self.outputs))
+
+    def options_hash(self):
+        """Returns a hash of the method and its arguments, dictionaries are hashed with sorted keys"""
+        args = [sorted(a.items()) if isinstance(a, dict) else a for a in self.args]
+        return hashlib.md5(repr((self.method, args))).hexdigest()
+
+
 class OSMDeviationfinder(object):
     """The osmdeviationfinder object implements all necessary methods for geodata import,
     osm-data download, geometry cleaning, data harmonization, linematching and result generation.
@@ -216,6 +1061,12 @@ class OSMDeviationfinder(object):
         self.osm_data = None
         self.connection = None
         self.cursor = None
+        #: The handle of the current run, see RunHandle
+        self.handle = None
+        #: The publications of the running stage, see run_stage
+        self.publications = None
+        #: The start time of the current run, see progress
+        self.started = None
 
     def layer_to_db(self, source_layer, db_table, overwrite=True):
         """A simple method to import geodata from an open ogr-layer into a postgresql/postgis database.
@@ -405,6 +1256,184 @@ class OSMDeviationfinder(object):
             if DEBUG:
                 print 'Shape OK'
 
+    def topology_signature(self, table):
+        """Returns a signature of the content of a line table (number of features and a hash of their ids and
+        geometries), which is used to decide if the stored topology of the table is still valid.
+
+        :param table: the table with the line features
+        """
+        query = ('SELECT count(*)::text || \':\' || coalesce(sum(hashtext(id::text || md5(ST_AsBinary(geom))))::text, '
+                 '\'0\') FROM '+table+';')
+        self.cursor.execute(query)
+        return self.cursor.fetchone()[0]
+
+    def create_topology_registry(self):
+        """Creates the registry with the signatures of the tables with a stored topology, if it doesn't exist yet"""
+        query = ('CREATE TABLE IF NOT EXISTS '+topology_table+' '
+                 '(tablename varchar PRIMARY KEY, signature varchar, created timestamp DEFAULT now());')
+        self.cursor.execute(query)
+
+    def ensure_topology(self, table, parent=None):
+        """Makes sure the topology tables of a line table exist and belong to the current content of the table.
+        The topology consists of the tables <table>_nodes (distinct start- and endpoints with their degree),
+        <table>_edges (start- and endnode and the azimuth of the first and last segment of each line) and
+        <table>_crossings (intersections between pairs of lines). The signature of the table content is stored in
+        the topology registry, so repeated runs with the same data skip the topology building entirely.
+
+        If the table was created by splitting the lines of a parent table (old_id refers to the parent) and the
+        topology of the parent is valid, the crossings are derived from the crossings of the parent instead of
+        intersecting all lines again.
+
+        :param table: the table with the line features
+        :param parent: the table, the line features of table were split from
+        :return: False if the stored topology was reused, True if it was (re)built
+        """
+        cursor = self.cursor
+        self.create_topology_registry()
+
+        signature = self.topology_signature(table)
+        query = 'SELECT signature FROM '+topology_table+' WHERE tablename = %s;'
+        cursor.execute(query, (table,))
+        row = cursor.fetchone()
+        if row is not None and row[0] == signature and self.has_columns(table+'_crossings', ['l1id']):
+            return False
+
+        derive = False
+        if parent is not None and self.has_columns(table, ['old_id']):
+            cursor.execute(query, (parent,))
+            row = cursor.fetchone()
+            derive = row is not None and row[0] == self.topology_signature(parent)
+
+        self.build_nodes_edges(table)
+        if derive:
+            self.derive_crossings(table, parent)
+        else:
+            self.build_crossings(table)
+
+        query = 'DELETE FROM '+topology_table+' WHERE tablename = %s;'
+        cursor.execute(query, (table,))
+        query = 'INSERT INTO '+topology_table+' (tablename, signature) VALUES (%s, %s);'
+        cursor.execute(query, (table, signature))
+        return True
+
+    def build_nodes_edges(self, table):
+        """Creates the node and edge tables of the topology of a line table, see ensure_topology
+
+        :param table: the table with the line features
+        """
+        cursor = self.cursor
+
+        query = 'DROP TABLE IF EXISTS '+table+'_nodes;'
+        cursor.execute(query)
+        query = 'DROP TABLE IF EXISTS '+table+'_edges;'
+        cursor.execute(query)
+
+        query = 'CREATE TABLE '+table+'_nodes (id bigserial PRIMARY KEY, degree integer);'
+        cursor.execute(query)
+        query = ('SELECT addGeometryColumn (\''+table+'_nodes\',\'geom\','
+                 '(SELECT ST_SRID(geom) AS srid FROM '+table+' WHERE geom IS NOT NULL LIMIT 1),\'POINT\',2);')
+        cursor.execute(query)
+
+        #: Distinct start- and endpoints and the number of line ends meeting there
+        query = ('INSERT INTO '+table+'_nodes (degree, geom) '
+                 '(SELECT count(*), p.geom FROM (SELECT st_startpoint(t.geom) AS geom FROM '+table+' t UNION ALL '
+                 'SELECT st_endpoint(t.geom) AS geom FROM '+table+' t) AS p '
+                 'WHERE p.geom IS NOT NULL GROUP BY p.geom);')
+        cursor.execute(query)
+        query = 'CREATE INDEX '+table+'_nodes_geom_idx ON '+table+'_nodes USING GIST (geom);'
+        cursor.execute(query)
+
+        #: The split stages store the azimuths of the first and last segment of every line, tables which weren't
+        #: produced by a split stage (eg. only cleaned or raw data) get them calculated from the line itself
+        if self.has_columns(table, ['startazimuth', 'endazimuth']):
+            az_str = 't.startazimuth, t.endazimuth '
+        else:
+            az_str = startazimuth_sql('t.geom')+', '+endazimuth_sql('t.geom')+' '
+
+        query = ('CREATE TABLE '+table+'_edges '
+                 '(id integer PRIMARY KEY, source bigint, target bigint, startazimuth numeric, endazimuth numeric);')
+        cursor.execute(query)
+        query = ('INSERT INTO '+table+'_edges (id, source, target, startazimuth, endazimuth) '
+                 '(SELECT t.id, sn.id, tn.id, '+az_str+'FROM '+table+' t '
+                 'LEFT JOIN '+table+'_nodes sn ON (sn.geom = st_startpoint(t.geom)) '
+                 'LEFT JOIN '+table+'_nodes tn ON (tn.geom = st_endpoint(t.geom)));')
+        cursor.execute(query)
+
+    def create_crossings_table(self, table):
+        """(Re)creates the empty crossings table of the topology of a line table
+
+        :param table: the table with the line features
+        """
+        cursor = self.cursor
+        query = 'DROP TABLE IF EXISTS '+table+'_crossings;'
+        cursor.execute(query)
+        query = 'CREATE TABLE '+table+'_crossings (l1id integer, l2id integer);'
+        cursor.execute(query)
+        query = ('SELECT addGeometryColumn (\''+table+'_crossings\',\'geom\','
+                 '(SELECT ST_SRID(geom) AS srid FROM '+table+' WHERE geom IS NOT NULL LIMIT 1),\'GEOMETRY\',2);')
+        cursor.execute(query)
+
+    def build_crossings(self, table):
+        """Intersects all lines of a table with each other and stores the intersections in the crossings table
+
+        :param table: the table with the line features
+        """
+        self.create_crossings_table(table)
+        query = ('INSERT INTO '+table+'_crossings (l1id, l2id, geom) '
+                 '(SELECT t1.id, t2.id, ST_Intersection(t1.geom, t2.geom) '
+                 'FROM '+table+' AS t1, '+table+' AS t2 '
+                 'WHERE t1.id <> t2.id and ST_Intersects(t1.geom, t2.geom));')
+        self.cursor.execute(query)
+        query = 'CREATE INDEX '+table+'_crossings_l1id_idx ON '+table+'_crossings (l1id);'
+        self.cursor.execute(query)
+
+    def derive_crossings(self, table, parent):
+        """Derives the crossings of a table, whose lines were split from the lines of the parent table, from the
+        crossings of the parent. Two parts can only intersect, if their parent lines intersect or if they are parts
+        of the same parent line, so only these pairs are intersected.
+
+        :param table: the table with the splitted line features (old_id refers to the parent)
+        :param parent: the table with the original line features and a valid topology
+        """
+        cursor = self.cursor
+        self.create_crossings_table(table)
+
+        query = 'DROP INDEX IF EXISTS '+table+'_old_id_idx;'
+        cursor.execute(query)
+        query = 'CREATE INDEX '+table+'_old_id_idx ON '+table+' USING btree(old_id);'
+        cursor.execute(query)
+
+        query = ('INSERT INTO '+table+'_crossings (l1id, l2id, geom) '
+                 '(SELECT t1.id, t2.id, ST_Intersection(t1.geom, t2.geom) '
+                 'FROM (SELECT c1.id AS l1id, c2.id AS l2id FROM '+parent+'_crossings pc '
+                 'JOIN '+table+' c1 ON (c1.old_id = pc.l1id) JOIN '+table+' c2 ON (c2.old_id = pc.l2id) UNION ALL '
+                 'SELECT c1.id AS l1id, c2.id AS l2id FROM '+table+' c1 '
+                 'JOIN '+table+' c2 ON (c1.old_id = c2.old_id and c1.id <> c2.id)) AS pairs '
+                 'JOIN '+table+' t1 ON (t1.id = pairs.l1id) JOIN '+table+' t2 ON (t2.id = pairs.l2id) '
+                 'WHERE ST_Intersects(t1.geom, t2.geom));')
+        cursor.execute(query)
+        query = 'CREATE INDEX '+table+'_crossings_l1id_idx ON '+table+'_crossings (l1id);'
+        cursor.execute(query)
+
+    def create_cut_locations(self, table):
+        """Creates the temporary table interloc_<table> with the intersection points of the lines of a table as
+        fraction of the line (without start- and endpoints), read from the crossings of the topology.
+
+        :param table: the table with the line features, its topology has to exist
+        """
+        cursor = self.cursor
+        query = ('CREATE TEMP TABLE interloc_'+table+' ON COMMIT DROP AS '
+                 '(SELECT * '
+                 'FROM ((SELECT l1id, l2id, st_linelocatepoint(foo.line, foo.g) AS locus '
+                 'FROM (SELECT c.l1id, c.l2id, (st_dump(c.geom)).geom AS g, l.geom AS line '
+                 'FROM '+table+'_crossings c JOIN '+table+' l ON (l.id = c.l1id) '
+                 'WHERE st_geometrytype(c.geom)=\'ST_Point\' or st_geometrytype(c.geom)=\'ST_MultiPoint\') AS foo)) AS bar '
+                 'WHERE locus<>0 and locus<>1);')
+        cursor.execute(query)
+
+        query = ('CREATE INDEX interloc_'+table+'_id_idx on interloc_'+table+'(l1id);')
+        cursor.execute(query)
+
     def clean_dataset(self, table, threshold, namecol='name', keepcolumns={}):
         """Simple method to clean/correct the geometries of a postgis table.
         Open start- and endpoint of a linefeature, which is within the threshold distance to a line or a junction of
@@ -427,12 +1456,8 @@ class OSMDeviationfinder(object):
 
         #: Build strings for columns to that should be included in the cleaned table
         kc_str1 = ''
-        kc_str2 = ''
-        kc_str3 = ''
         for k in keepcolumns:
             kc_str1 += ', ' + k + ' ' + keepcolumns.get(k)
-            kc_str2 += ', ' + k
-            kc_str3 += ', l.' + k
 
 
         #: Recreate table and index if already existing
@@ -445,59 +1470,18 @@ class OSMDeviationfinder(object):
         query = ('CREATE index '+table+'_id_idx on '+table+' using btree(id);')
         cursor.execute(query)
 
-        query = ('CREATE TABLE '+table+'_corrected (id bigserial PRIMARY KEY, old_id integer, sub_id integer, '
-                 'name varchar'+kc_str1+');')
-        cursor.execute(query)
-
-        query = ('SELECT addGeometryColumn(\''+table+'_corrected\',\'geom\',(SELECT ST_SRID(geom) as srid '
-                 'FROM '+table+' WHERE geom IS NOT NULL LIMIT 1), (SELECT geometrytype(geom) '
-                 'FROM '+table+' limit 1), 2);')
-        cursor.execute(query)
-
-        query = ('CREATE INDEX '+table+'_corrected_geom_idx ON '+table+'_corrected USING GIST (geom);')
-        cursor.execute(query)
-
-        #: Create table with intersections of features to generate a list participating lines
-        # and later a list of junctions
-        query = ('CREATE temp table intergeom_'+table+' on commit DROP as '
-                 '(SELECT ST_Intersection(a.geom, b.geom) as g, ST_Startpoint(a.geom) as sp, ST_Endpoint(a.geom) as ep,'
-                 ' a.id as l1id, b.id as l2id, a.geom as line, Count(Distinct a.id) as roads_count '
-                 'FROM '+table+' as a, '+table+' as b '
-                 'WHERE a.id <> b.id and ST_Intersects(a.geom, b.geom) '
-                 'GROUP BY g, l1id, l2id, line, sp, ep);')
-        cursor.execute(query)
-
-        #: Extract a list of IDs of participating lines and the intersection as fraction of line1 and create index
-        query = ('CREATE temp table interloc_'+table+' on commit DROP as '
-                 '(SELECT * FROM ((SELECT l1id, l2id, st_linelocatepoint(intergp.line, intergp.g) as locus '
-                 'FROM (SELECT l1id, l2id, (st_dump(g)).geom as g, line '
-                 'FROM intergeom_'+table +
-                 ' WHERE st_geometrytype(g)=\'ST_Point\' or st_geometrytype(g)=\'ST_MultiPoint\') as intergp)) as subq '
-                 'WHERE locus<>0 and locus<>1);')
-        cursor.execute(query)
-
-        query = ('CREATE index interloc_'+table+'_id_idx on interloc_'+table+'(l1id);')
-        cursor.execute(query)
+        self.create_intermediate_table(table+'_corrected', 'id bigserial PRIMARY KEY, old_id integer, '
+                                       'sub_id integer, name varchar'+kc_str1, table, None)
 
-        #: Insert all splitted parts of the intersecting features into the corrected table
-        query = ('INSERT into '+table+'_corrected (old_id, sub_id, geom, name '+kc_str2+') (with cut_locations as '
-                 '(SELECT l1id as lid, locus FROM interloc_'+table+' UNION ALL SELECT i.l1id as lid, 0 as locus '
-                 'FROM interloc_'+table+' i left join '+table+' b on (i.l1id = b.id) UNION ALL '
-                 'SELECT i.l1id as lid, 1 as locus FROM interloc_'+table+' i '
-                 'left join '+table+' b on (i.l1id = b.id) order by lid, locus ), loc_with_idx as '
-                 '(SELECT lid, locus, row_number() over (partition by lid order by locus) as idx FROM cut_locations) '
-                 'SELECT l.id, loc1.idx as sub_id, st_linesubstring(l.geom, loc1.locus, loc2.locus) as geom, '
-                 'l.'+namecol+' as name '+kc_str3+' FROM loc_with_idx loc1 join loc_with_idx loc2 using (lid) '
-                 'join '+table+' l on (l.id = loc1.lid) where loc2.idx = loc1.idx+1 '
-                 'and geometryType(st_linesubstring(l.geom, loc1.locus, loc2.locus)) = \'LINESTRING\');')
-        cursor.execute(query)
+        #: Intersection points of the features as fraction of the participating lines, read from the topology
+        self.ensure_topology(table)
+        self.create_cut_locations(table)
 
-        #: Insert all non-intersecting line features to the corrected features table
-        query = ('INSERT into '+table+'_corrected (old_id, sub_id, geom, name '+kc_str2+')'
-                 '(with used as (SELECT distinct old_id FROM '+table+'_corrected) '
-                 'SELECT id, 1 as sub_id, geom, '+namecol+' '+kc_str2+' FROM '+table +
-                 ' WHERE id not in (SELECT * FROM used));')
-        cursor.execute(query)
+        #: Insert all splitted parts of the intersecting features and all non-intersecting line features into the
+        # corrected table
+        self.split_lines(table, 'interloc_'+table, table+'_corrected', namecol, keepcolumns, azimuths=False)
+        #: The corrections join the corrected table with itself, so it is indexed and analyzed after loading
+        self.finish_table(table+'_corrected')
 
         #: Delete all features with a length below threshold (protruding parts) from table
         query = ('DELETE FROM '+table+'_corrected USING '
@@ -505,24 +1489,14 @@ class OSMDeviationfinder(object):
                  'WHERE '+table+'_corrected.id = deletelist.id;')
         cursor.execute(query)
 
-        #: Generate a table of junctions with unique junction geometry and number of participating lines
-        query = ('CREATE temp table '+table+'points on commit DROP as '
-                 '(SELECT distinct (st_dump(points.geom)).geom, count(points.id) as pcount '
-                 'FROM (SELECT st_startpoint(t.geom) as geom, t.id FROM '+table+' t union all '
-                 'SELECT st_endpoint(t.geom) as geom, t.id FROM '+table+' t ) AS points '
-                 'WHERE st_geometrytype(points.geom)=\'ST_Point\' or st_geometrytype(points.geom)=\'ST_MultiPoint\' '
-                 'GROUP BY points.geom);')
-        cursor.execute(query)
-
-        query = ('CREATE INDEX '+table+'_points_geom_idx ON '+table+'points USING GIST (geom);')
-        cursor.execute(query)
-
+        #: The nodes of the topology are the junctions with unique junction geometry and number of participating
+        # lines (degree)
         #: Update the startpoint of a line feature in the corrected table to the geometry of a junction,
         # if it is within the threshold to that junction and not already intersecting
         query = ('UPDATE '+table+'_corrected SET geom = subq.geom FROM '
-                 '(SELECT st_setpoint(ref1.geom, 0, p.geom) as geom, ref1.id FROM '+table+'_corrected ref1, '+table+'points p '
+                 '(SELECT st_setpoint(ref1.geom, 0, p.geom) as geom, ref1.id FROM '+table+'_corrected ref1, '+table+'_nodes p '
                  'WHERE ST_DWithin(st_startpoint(ref1.geom), p.geom,'+threshold+') '
-                 'AND NOT st_equals(st_startpoint(ref1.geom), p.geom) and p.pcount>1) as subq '
+                 'AND NOT st_equals(st_startpoint(ref1.geom), p.geom) and p.degree>1) as subq '
                  'WHERE '+table+'_corrected.id = subq.id;')
         cursor.execute(query)
 
@@ -530,9 +1504,9 @@ class OSMDeviationfinder(object):
         # if it is within the threshold to that junction and not already intersecting
         query = ('UPDATE '+table+'_corrected SET geom = subq.geom FROM '
                  '(SELECT st_setpoint(ref1.geom, ST_NPoints(ref1.geom)-1, p.geom) as geom, ref1.id '
-                 'FROM '+table+'_corrected ref1, '+table+'points p '
+                 'FROM '+table+'_corrected ref1, '+table+'_nodes p '
                  'WHERE ST_DWithin(st_endpoint(ref1.geom), p.geom,'+threshold+') '
-                 'AND NOT st_equals(st_endpoint(ref1.geom), p.geom) and p.pcount>1) as subq '
+                 'AND NOT st_equals(st_endpoint(ref1.geom), p.geom) and p.degree>1) as subq '
                  'WHERE '+table+'_corrected.id = subq.id;')
         cursor.execute(query)
 
@@ -560,101 +1534,41 @@ class OSMDeviationfinder(object):
         #connection.commit()
         #connection.close()
 
-    def presplit_dataset(self, table, outtable, keepcolumns={}, streetname_column='name'):
+    def presplit_dataset(self, table, outtable, keepcolumns={}, streetname_column='name', intermediate=True):
         """Split line features of the given table on intersections.
         :param table: the table that should be splitted
+        :param intermediate: if True, the output table is an intermediate table, see create_intermediate_table
         """
-        #: Build strings for columns that should be included in presplitted table
-        kc_str1 = ''
-        kc_str2 = ''
-        kc_str3 = ''
-        for k in keepcolumns:
-            kc_str1 += ', ' + k + ' ' + keepcolumns.get(k)
-            kc_str2 += ', ' + k
-            kc_str3 += ', l.' + k
-
         #connection = psycopg2.connect(self.dbconnectioninfo_psycopg)
         cursor = self.cursor #connection.cursor()
-        query = ('DROP TABLE IF EXISTS '+outtable+';')
-        cursor.execute(query)
-
         query = ('DROP INDEX IF EXISTS '+table+'_id_idx;')
         cursor.execute(query)
 
         query = ('CREATE INDEX '+table+'_id_idx on '+table+' USING btree(id);')
         cursor.execute(query)
 
-        query = ('CREATE TABLE '+outtable+
-                 ' (id bigserial PRIMARY KEY, old_id integer, sub_id integer, '
-                 ' name varchar, direction numeric '+kc_str1+');')
-        cursor.execute(query)
-
-        query = ('SELECT addGeometryColumn(\''+outtable+'\',\'geom\','
-                 '(SELECT ST_SRID(geom) AS srid FROM '+table+' WHERE geom IS NOT NULL LIMIT 1), '
-                 '(SELECT geometrytype(geom) FROM '+table+' limit 1), 2);')
-        cursor.execute(query)
-
-        query = ('CREATE INDEX '+outtable+'_geom_idx ON '+outtable+'  USING GIST (geom);')
-        cursor.execute(query)
-
-
-        #: Create table with intersections of features to generate a list participating lines
-        query = ('CREATE TEMP TABLE intergeom_'+table+' ON COMMIT DROP AS '
-                 '(SELECT ST_Intersection(t1.geom, t2.geom) AS g, '
-                 'ST_Startpoint(t1.geom) AS sp, '
-                 'ST_Endpoint(t1.geom) AS ep, t1.id AS l1id, t2.id AS l2id, t1.geom AS line, '
-                 'Count(Distinct t1.id) AS roads_count '
-                 'FROM '+table+' AS t1, '+table+' AS t2 '
-                 'WHERE t1.id <> t2.id and ST_Intersects(t1.geom, t2.geom) '
-                 'GROUP BY g, l1id, l2id, line, sp, ep);')
-        cursor.execute(query)
-
-        #: Extract a list of IDs of participating lines and the intersection as fraction of line1 and create index
-        query = ('CREATE TEMP TABLE interloc_'+table+' ON COMMIT DROP AS '
-                 '(SELECT * '
-                 'FROM ((SELECT l1id, l2id, st_linelocatepoint(foo.line, foo.g) AS locus '
-                 'FROM (SELECT l1id, l2id, (st_dump(g)).geom AS g, line '
-                 'FROM intergeom_'+table+
-                 ' WHERE st_geometrytype(g)=\'ST_Point\' or st_geometrytype(g)=\'ST_MultiPoint\') AS foo)) AS bar '
-                 'WHERE locus<>0 and locus<>1);')
-        cursor.execute(query)
-
-        query = ('CREATE INDEX interloc_'+table+'_id_idx on interloc_'+table+'(l1id);')
-        cursor.execute(query)
-
-        #: Insert all splitted parts of the intersecting features into the corrected table
-        query = ('INSERT INTO '+outtable+' '
-                 '(old_id, sub_id, geom, name, direction '+kc_str2+') '
-                 '(WITH cut_locations AS '
-                 '(SELECT l1id AS lid, locus FROM interloc_'+table+' UNION ALL '
-                 'SELECT i.l1id AS lid, 0 AS locus '
-                 'FROM interloc_'+table+' i left join '+table+' b on (i.l1id = b.id) UNION ALL '
-                 'SELECT i.l1id AS lid, 1 AS locus '
-                 'FROM interloc_'+table+' i left join '+table+' b on (i.l1id = b.id) '
-                 'order BY lid, locus), '
-                 'loc_WITH_idx AS ('
-                 'SELECT lid, locus, row_number() over (partition BY lid order BY locus) AS idx '
-                 'FROM cut_locations) '
-                 'SELECT l.id, loc1.idx AS sub_id, '
-                 'st_linesubstring(l.geom, loc1.locus, loc2.locus) AS geom, l.'+streetname_column+' AS name, '
-                 'ST_AZIMUTH(st_startpoint(st_linesubstring(l.geom, loc1.locus, loc2.locus)),'
-                 'st_endpoint(st_linesubstring(l.geom, loc1.locus, loc2.locus))) AS direction '+kc_str3+' '
-                 'FROM loc_WITH_idx loc1 join loc_WITH_idx loc2 '
-                 'USING (lid) join '+table+' l on (l.id = loc1.lid) '
-                 'WHERE loc2.idx = loc1.idx+1 '
-                 'and geometryType(st_linesubstring(l.geom, loc1.locus, loc2.locus)) = \'LINESTRING\');')
-        cursor.execute(query)
-
-        #: Insert all other, non-intersecting line features to the corrected features table
-        query = ('INSERT INTO '+outtable+' '
-                 '(old_id,sub_id, geom, name, direction '+kc_str2+') '
-                 '(WITH used AS (SELECT distinct old_id FROM '+outtable+') '
-                 'SELECT id, 1 AS sub_id, geom, '+streetname_column+', '
-                 'ST_AZIMUTH(st_startpoint(geom),'
-                 'st_endpoint(geom)) AS direction '+kc_str2+' '
-                 'FROM '+table+' '
-                 'WHERE id not in (SELECT * FROM used));')
-        cursor.execute(query)
+        #: A final output table is built into a new version, which is published after loading
+        if intermediate:
+            target = outtable
+        else:
+            target = self.new_version(outtable)
+        self.create_split_table(target, table, keepcolumns, intermediate=intermediate)
+
+        #: Intersection points of the features as fraction of the participating lines, read from the topology
+        self.ensure_topology(table)
+        self.create_cut_locations(table)
+
+        #: Insert all splitted parts of the intersecting features and all other, non-intersecting line features into
+        # the presplitted table
+        self.split_lines(table, 'interloc_'+table, target, streetname_column, keepcolumns)
+        self.finish_table(target, ['old_id'] + split_indexes)
+
+        #: The topology of the presplitted table is derived from the topology of the input table, it is only needed
+        #: by the following stages
+        if intermediate:
+            self.ensure_topology(outtable, parent=table)
+        else:
+            self.publish_table(outtable, target)
 
     def generate_junctions(self, table):
         """Generates a table with junctionpoints and a table of intersectionpoints which build a junction and calculates
@@ -672,58 +1586,21 @@ class OSMDeviationfinder(object):
         query = ('CREATE INDEX '+table+'_id_idx on '+table+' USING btree(id);')
         cursor.execute(query)
 
-        query = 'DROP TABLE IF EXISTS '+table+'_points;'
-        cursor.execute(query)
-
-        query = 'DROP TABLE IF EXISTS '+table+'_junctions;'
-        cursor.execute(query)
-
-        query = 'DROP INDEX IF EXISTS '+table+'_points_geom_idx;'
-        cursor.execute(query)
-
-        #: Recreate tables if they already exist
-        if DEBUG:
-            query = ('CREATE TABLE '+table+'_points '
-                     '(id bigserial PRIMARY KEY, matched boolean, parentline_id integer, junction_id integer, '
-                     'azimuth numeric);')
-            cursor.execute(query)
-        else:
-            query = ('CREATE TEMP TABLE '+table+'_points'
-                     '(id bigserial PRIMARY KEY, matched boolean, parentline_id integer, junction_id integer, '
-                     'azimuth numeric) ON COMMIT DROP;')
-            cursor.execute(query)
-
-        query = ('SELECT addGeometryColumn (\''+table+'_points\',\'geom\','
-                 '(SELECT ST_SRID(geom) AS srid '
-                 'FROM '+table+' '
-                 'WHERE geom IS NOT NULL LIMIT 1),\'POINT\',2);')
-        cursor.execute(query)
-
-        if DEBUG:
-            query = ('CREATE TABLE '+table+'_junctions '
-                     '(id bigserial PRIMARY KEY, roads_count integer, found_partner integer);')
-            cursor.execute(query)
-        else:
-            query = ('CREATE TEMP TABLE '+table+'_junctions '
-                     '(id bigserial PRIMARY KEY, roads_count integer, found_partner integer) ON COMMIT DROP;')
-            cursor.execute(query)
+        #: Recreate tables if they already exist, they are read by the following stages
+        self.create_intermediate_table(table+'_points', 'id bigserial PRIMARY KEY, matched boolean, '
+                                       'parentline_id integer, junction_id integer, azimuth numeric', table)
+        self.create_intermediate_table(table+'_junctions', 'id bigserial PRIMARY KEY, roads_count integer, '
+                                       'found_partner integer', table)
 
-        query = ('SELECT addGeometryColumn (\''+table+'_junctions\',\'geom\','
-                 '(SELECT ST_SRID(geom) AS srid FROM '+table+' '
-                 'WHERE geom IS NOT NULL LIMIT 1),\'POINT\',2);')
-        cursor.execute(query)
-
-        #: Create table with intersections of features to generate a list of intersection points
+        #: Create table with intersections of features to generate a list of intersection points, the crossings,
+        #: start- and endpoints and the azimuths of the first and last segment are read from the topology
+        self.ensure_topology(table)
         query = ('CREATE TEMP TABLE intergeom'+table+' ON COMMIT DROP AS '
-                 '(SELECT ST_Intersection(t1.geom, t2.geom) AS g,'
-                 'ST_Startpoint(t1.geom) AS sp,'
-                 'ST_Endpoint(t1.geom) AS ep, '
-                 't1.id AS l1id, t2.id AS l2id,'
-                 't1.geom AS line,'
-                 'Count(Distinct t1.id) AS roads_count '
-                 'FROM '+table+' AS t1, '+table+' AS t2 '
-                 'WHERE t1.id <> t2.id and ST_Intersects(t1.geom, t2.geom) '
-                 'GROUP BY g, l1id, l2id, line, sp, ep);')
+                 '(SELECT c.geom AS g, sn.geom AS sp, tn.geom AS ep, c.l1id, c.l2id, '
+                 'e.startazimuth AS sa, e.endazimuth AS ea '
+                 'FROM '+table+'_crossings c JOIN '+table+'_edges e ON (e.id = c.l1id) '
+                 'LEFT JOIN '+table+'_nodes sn ON (sn.id = e.source) '
+                 'LEFT JOIN '+table+'_nodes tn ON (tn.id = e.target));')
         cursor.execute(query)
 
         ##: Insert startpoints from non-intersecting linefeatures into table _points
@@ -738,15 +1615,19 @@ class OSMDeviationfinder(object):
         #         'FROM '+table+' t)')
         #cursor.execute(query)
 
-        #: Create table _points with distinct start-, end- and intersection points from previous table
+        #: Create table _points with distinct start-, end- and intersection points from previous table.
+        #: Start- and endpoints get the azimuth of their line segment copied, if an intersection point is equal to one
+        #: of them, the copied azimuth is kept (prio). For closed lines the endpoint azimuth is used.
         query = ('INSERT INTO '+table+'_points '
-                 '(geom, parentline_id, matched) '
-                 '(SELECT distinct (st_dump(points.geom)).geom, points.l1id, false AS matched '
-                 'FROM (SELECT it.g AS geom, l1id, ep '
-                 'FROM intergeom'+table+' it union all '
-                 'SELECT it.sp AS geom, l1id, ep FROM intergeom'+table+' it union all '
-                 'SELECT it.ep AS geom, l1id, ep FROM intergeom'+table+' it) AS points '
-                 'WHERE st_geometrytype(points.geom)=\'ST_Point\' or st_geometrytype(points.geom)=\'ST_MultiPoint\');')
+                 '(geom, parentline_id, matched, azimuth) '
+                 '(SELECT DISTINCT ON (points.geom, points.l1id) points.geom, points.l1id, false AS matched, '
+                 'points.azimuth '
+                 'FROM (SELECT (st_dump(it.g)).geom AS geom, l1id, NULL::numeric AS azimuth, 2 AS prio '
+                 'FROM intergeom'+table+' it '
+                 'WHERE st_geometrytype(it.g)=\'ST_Point\' or st_geometrytype(it.g)=\'ST_MultiPoint\' union all '
+                 'SELECT it.sp AS geom, l1id, it.sa AS azimuth, 1 AS prio FROM intergeom'+table+' it union all '
+                 'SELECT it.ep AS geom, l1id, it.ea AS azimuth, 0 AS prio FROM intergeom'+table+' it) AS points '
+                 'ORDER BY points.geom, points.l1id, points.prio);')
         cursor.execute(query)
 
         #: Also insert startpoints from non-intersecting linefeatures into table _points
@@ -783,8 +1664,7 @@ class OSMDeviationfinder(object):
                  'GROUP BY tp.geom);')
         cursor.execute(query)
 
-        query = ('CREATE INDEX '+table+'_junctions_geom_idx ON '+table+'_junctions USING GIST (geom);')
-        cursor.execute(query)
+        self.finish_table(table+'_junctions')
 
         #: Update _points table with junction id of the junction they are part of
         query = ('UPDATE '+table+'_points SET junction_id = f.tjid '
@@ -794,24 +1674,7 @@ class OSMDeviationfinder(object):
                  'WHERE f.id = '+table+'_points.id;')
         cursor.execute(query)
 
-        #: Update _points table with calculated azimuth angle of the line the point is being startpoint of
-        query = ('UPDATE '+table+'_points SET azimuth = f.azimuth '
-                 'FROM (SELECT ST_AZIMUTH(tp.geom, st_pointn(it.line,2)) AS azimuth, tp.id AS id '
-                 'FROM '+table+'_points tp, intergeom'+table+' it '
-                 'WHERE it.l1id = tp.parentline_id and st_equals(tp.geom,st_startpoint(it.line))) AS f '
-                 'WHERE f.id = '+table+'_points.id;')
-        cursor.execute(query)
-
-        #: Update _points table with calculated azimuth angle of the line the point is being endpoint of
-        query = ('UPDATE '+table+'_points SET azimuth = f.azimuth '
-                 'FROM (SELECT ST_AZIMUTH(tp.geom, st_pointn(it.line,ST_NPoints(it.line)-1)) AS azimuth, tp.id AS id '
-                 'FROM '+table+'_points tp, intergeom'+table+' it '
-                 'WHERE it.l1id = tp.parentline_id and st_equals(tp.geom,st_endpoint(it.line))) AS f '
-                 'WHERE f.id = '+table+'_points.id;')
-        cursor.execute(query)
-
-        query = ('CREATE INDEX '+table+'_points_geom_idx ON '+table+'_points  USING GIST (geom);')
-        cursor.execute(query)
+        self.finish_table(table+'_points', ['junction_id', 'parentline_id'])
 
     def junction_matching(self, basetable, table1, table2, searchradius, azimuthdifftolerance, max_azdiff, max_distancediff,
                           max_roads_countdiff):
@@ -839,6 +1702,7 @@ class OSMDeviationfinder(object):
                  'and abs((abs((t1p.azimuth-t2p.azimuth))+'+azimuthdifftolerance+') % '
                  +two_pi+' - '+azimuthdifftolerance+')<'+azimuthdifftolerance+' order BY t1j_id;')
         cursor.execute(query)
+        self.finish_table('potentialpairs', spatial=False)
 
         query = ('DROP TABLE IF EXISTS potentialpairs2;')
         cursor.execute(query)
@@ -848,7 +1712,7 @@ class OSMDeviationfinder(object):
         #: Creates table with potential sub-junction-point (start- endpoints of lines) pairs of the two datasets
         query = ('CREATE TEMP TABLE potentialpairs2 '
                  '(t1j_id integer, t2j_id integer, t1p_id integer, t2p_id integer, '
-                 'found_partner boolean default false, azdiff numeric);')
+                 'found_partner boolean default false, azdiff numeric) ON COMMIT DROP;')
         cursor.execute(query)
 
         #: Fill table potentialpairs2 with all potential pairs and parameters on sub-junction-point level
@@ -868,6 +1732,7 @@ class OSMDeviationfinder(object):
                  'FROM potentialpairs order BY t1j_id) dists WHERE dists.t2j_id = best.t2j_id '
                  'and dists.t1j_id = best.t1j_id and best.t1p_id = dists.t1p_id);')
         cursor.execute(query)
+        self.finish_table('potentialpairs2', spatial=False)
 
 
         #: Just keep potential pairs (on sub-junction level) with min. azimuth difference
@@ -877,7 +1742,6 @@ class OSMDeviationfinder(object):
                  'WHERE pp2.t1j_id = f.t1j_id and pp2.t2j_id=f.t2j_id '
                  'and pp2.t2p_id = f.t2p_id and pp2.azdiff!=f.azdiff;')
         cursor.execute(query)
-        self.connection.commit()
 
         #: Create a table with the entries of potentialpairs2, which calculated parameters are within the given limits
         #: and save the wighted sum of parameters as junction_diff
@@ -915,6 +1779,26 @@ class OSMDeviationfinder(object):
                  'and foundmatches.junction_diff!=f.junction_diff;')
         cursor.execute(query)
 
+        self.store_junction_matches(basetable, table1, table2)
+
+        #query = ('UPDATE '+table2+'_points SET matched = true '
+        #         'FROM (SELECT unnest(t2p_ids) AS t2p_ids FROM foundmatches) AS f '
+        #         'WHERE '+table2+'_points.id = f.t2p_ids;')
+        #cursor.execute(query)
+        #query = ('UPDATE '+table1+'_points SET matched = true '
+        #         'FROM (SELECT unnest(t1p_ids) AS t1p_ids FROM foundmatches) AS f '
+        #         'WHERE '+table1+'_points.id = f.t1p_ids;')
+        #cursor.execute(query)
+
+    def store_junction_matches(self, basetable, table1, table2):
+        """Writes the junction matches of the table foundmatches back: a table with deviation lines between the matched
+        junctions is created and the points of all matched junctions are marked as matched.
+
+        :param table1: first inputtable with junctions of the matching process
+        :param table2: second inputtable with junctions of the matching process
+        """
+        cursor = self.cursor
+
         #: Create a table with deviation lines between the matched junctions of the two datasets
         query = 'DROP TABLE IF EXISTS '+basetable+'_junction_deviationlines;'
         cursor.execute(query)
@@ -932,14 +1816,149 @@ class OSMDeviationfinder(object):
                  'WHERE ff.t1j_id = '+table1+'_points.junction_id;')
         cursor.execute(query)
 
-        #query = ('UPDATE '+table2+'_points SET matched = true '
-        #         'FROM (SELECT unnest(t2p_ids) AS t2p_ids FROM foundmatches) AS f '
-        #         'WHERE '+table2+'_points.id = f.t2p_ids;')
-        #cursor.execute(query)
-        #query = ('UPDATE '+table1+'_points SET matched = true '
-        #         'FROM (SELECT unnest(t1p_ids) AS t1p_ids FROM foundmatches) AS f '
-        #         'WHERE '+table1+'_points.id = f.t1p_ids;')
-        #cursor.execute(query)
+    def junction_matching_inprocess(self, basetable, table1, table2, searchradius, azimuthdifftolerance, max_azdiff,
+                                    max_distancediff, max_roads_countdiff, maxcomponentsize=300):
+        """In-process alternative to junction_matching with the same parameters and results tables.
+        The junctions and their points are fetched once, potential junction pairs are found with a spatial hash and
+        scored with the same weights (rel_azdiff*2+dist_diff*3+rc_diff)/6 as in junction_matching.
+        Instead of deleting all but the minimum junction_diff from each side in turn (which depends on the deletion
+        order), the one-to-one assignment is solved for each group of connected junction pairs at once with the
+        hungarian method, leaving a junction unmatched costs 0.5 on each side. Groups with more than
+        maxcomponentsize junctions are assigned greedily by ascending junction_diff.
+        The matches are written back in bulk, see store_junction_matches.
+
+        :param table1: first inputtable with junctions for the matching process
+        :param table2: second inputtable with junctions for the matching process
+        :param maxcomponentsize: the max. number of junctions in a group that is solved with the hungarian method
+        """
+        cursor = self.cursor
+
+        searchradius = float(searchradius)
+        azimuthdifftolerance = float(azimuthdifftolerance)
+        max_azdiff = float(max_azdiff)
+        max_roads_countdiff = float(max_roads_countdiff)
+
+        #: Fetch junctions and their points with azimuth values of both tables once
+        junctions = []
+        points = []
+        for table in (table1, table2):
+            query = 'SELECT id, ST_X(geom), ST_Y(geom), roads_count FROM '+table+'_junctions;'
+            cursor.execute(query)
+            junctions.append(dict((r[0], (r[1], r[2], r[3])) for r in cursor.fetchall()))
+            query = ('SELECT id, junction_id, azimuth FROM '+table+'_points '
+                     'WHERE junction_id IS NOT NULL and azimuth IS NOT NULL;')
+            cursor.execute(query)
+            jpoints = {}
+            for pid, jid, azimuth in cursor.fetchall():
+                jpoints.setdefault(jid, []).append((pid, float(azimuth)))
+            points.append(jpoints)
+
+        #: Spatial hash of the junctions of table2 with a cellsize of searchradius
+        grid = {}
+        for jid, (x, y, rc) in junctions[1].iteritems():
+            grid.setdefault((int(math.floor(x/searchradius)), int(math.floor(y/searchradius))), []).append(jid)
+
+        #: Score all junction pairs within searchradius. On sub-junction-point level only the point pairs with min.
+        #: azimuth difference are kept for each point of table1 and then for each point of table2
+        pairs = {}
+        for t1j_id, (x1, y1, rc1) in junctions[0].iteritems():
+            t1points = points[0].get(t1j_id)
+            if not t1points:
+                continue
+            cx, cy = int(math.floor(x1/searchradius)), int(math.floor(y1/searchradius))
+            for gx in (cx-1, cx, cx+1):
+                for gy in (cy-1, cy, cy+1):
+                    for t2j_id in grid.get((gx, gy), ()):
+                        x2, y2, rc2 = junctions[1][t2j_id]
+                        dist = math.hypot(x2-x1, y2-y1)
+                        if dist > searchradius:
+                            continue
+                        t2points = points[1].get(t2j_id)
+                        if not t2points:
+                            continue
+                        best_t1 = []
+                        for t1p_id, az1 in t1points:
+                            diffs = [(azimuth_diff(az1, az2, azimuthdifftolerance), t2p_id) for t2p_id, az2 in t2points]
+                            diffs = [d for d in diffs if d[0] < azimuthdifftolerance]
+                            if diffs:
+                                mindiff = min(diffs)[0]
+                                best_t1.extend((d, t2p_id) for d, t2p_id in diffs if d == mindiff)
+                        if not best_t1:
+                            continue
+                        mindiffs = {}
+                        for d, t2p_id in best_t1:
+                            mindiffs[t2p_id] = min(d, mindiffs.get(t2p_id, d))
+                        best = [d for d, t2p_id in best_t1 if d == mindiffs[t2p_id]]
+                        rel_azdiff = sum(best)/len(best)/max_azdiff
+                        dist_diff = dist/searchradius
+                        rc_diff = abs(rc2-rc1)/max_roads_countdiff
+                        if rel_azdiff < 1 and dist_diff < 1 and rc_diff < 1:
+                            pairs[(t1j_id, t2j_id)] = (rel_azdiff*2+dist_diff*3+rc_diff)/6.0
+
+        #: Group the junction pairs into connected components, each component is assigned on its own
+        parent = {}
+
+        def find(node):
+            while parent.setdefault(node, node) != node:
+                parent[node] = parent[parent[node]]
+                node = parent[node]
+            return node
+
+        for t1j_id, t2j_id in pairs:
+            parent[find((1, t1j_id))] = find((2, t2j_id))
+        components = {}
+        for t1j_id, t2j_id in pairs:
+            components.setdefault(find((1, t1j_id)), []).append((t1j_id, t2j_id))
+
+        matches = []
+        for edges in components.itervalues():
+            rows = sorted(set(e[0] for e in edges))
+            cols = sorted(set(e[1] for e in edges))
+            rowidx = dict((t1j_id, i) for i, t1j_id in enumerate(rows))
+            colidx = dict((t2j_id, j) for j, t2j_id in enumerate(cols))
+            n, m = len(rows), len(cols)
+            if n+m > maxcomponentsize:
+                used1, used2 = set(), set()
+                for diff, t1j_id, t2j_id in sorted((pairs[e], e[0], e[1]) for e in edges):
+                    if t1j_id not in used1 and t2j_id not in used2:
+                        used1.add(t1j_id)
+                        used2.add(t2j_id)
+                        matches.append((t1j_id, t2j_id, diff))
+                continue
+            #: Square cost matrix: junctions of table1 and dummies (unmatched junctions of table2) as rows, junctions
+            #: of table2 and dummies (unmatched junctions of table1) as columns
+            big = 1e9
+            size = n+m
+            costs = [[big] * size for i in xrange(size)]
+            for i in xrange(n):
+                costs[i][m+i] = 0.5
+            for j in xrange(m):
+                costs[n+j][j] = 0.5
+                for i in xrange(n):
+                    costs[n+j][m+i] = 0.0
+            for t1j_id, t2j_id in edges:
+                costs[rowidx[t1j_id]][colidx[t2j_id]] = pairs[(t1j_id, t2j_id)]
+            for i, j in enumerate(min_cost_assignment(costs)[:n]):
+                if j < m and costs[i][j] < big:
+                    matches.append((rows[i], cols[j], pairs[(rows[i], cols[j])]))
+
+        #: Bulk load the matches and write them back like junction_matching
+        query = ('CREATE TEMP TABLE foundmatches (t1j_id integer, t2j_id integer, junction_diff numeric) '
+                 'ON COMMIT DROP;')
+        cursor.execute(query)
+        copy_rows(cursor, 'foundmatches', ('t1j_id', 't2j_id', 'junction_diff'), matches)
+
+        self.store_junction_matches(basetable, table1, table2)
+
+    def create_cutpoints_table(self, table1):
+        """(Re)creates the table holding the cutpoints for the line features of table1.
+
+        :param table1: the table whose line features will be split with the cutpoints
+        """
+        #: Recreate tables if they already exist
+        self.create_intermediate_table(table1+'_cutpoints', 'id bigserial PRIMARY KEY, parentline_id integer, '
+                                       'sourcepointid integer, sourcelineid integer, locus numeric, azimuth numeric, '
+                                       'distance numeric, iscurved boolean default false', table1)
 
     def cutpoint_creation(self, table1, table2, searchradius, azimuthdifftolerance, maxcheckpointanglediff):
         """Create cutpoints for the line features of table1 based on non-matched junction points of table2, which
@@ -952,24 +1971,7 @@ class OSMDeviationfinder(object):
         #: connection = psycopg2.connect(self.dbconnectioninfo_psycopg)
         cursor = self.cursor  # connection.cursor()
 
-        query = ('DROP TABLE IF EXISTS '+table1+'_cutpoints;')
-        cursor.execute(query)
-
-        #: Recreate tables if they already exist
-        if DEBUG:
-            query = ('CREATE TABLE '+table1+'_cutpoints'
-                     '(id bigserial PRIMARY KEY, parentline_id integer, sourcepointid integer,sourcelineid integer,'
-                     'locus numeric, azimuth numeric, distance numeric, iscurved boolean default false);')
-            cursor.execute(query)
-        else:
-            query = ('CREATE TEMP TABLE '+table1+'_cutpoints '
-                     '(id bigserial PRIMARY KEY, parentline_id integer, sourcepointid integer,sourcelineid integer,'
-                     'locus numeric, azimuth numeric, distance numeric, iscurved boolean) ON COMMIT DROP;')
-            cursor.execute(query)
-
-        query = ('SELECT addGeometryColumn (\''+table1+'_cutpoints\',\'geom\','
-                 '(SELECT ST_SRID(geom) AS srid FROM '+table1+' WHERE geom IS NOT NULL LIMIT 1),\'POINT\',2);')
-        cursor.execute(query)
+        self.create_cutpoints_table(table1)
 
         #: Calculate and insert cutpoints for line features of table1 using non-matched sub-junction-points of table2
         #: that are within the searchradius of a line of table1. Each cutpoint has two sub-cutpoint-points: the nodes
@@ -987,6 +1989,7 @@ class OSMDeviationfinder(object):
                         'and ST_DWithin(t2p.geom, t1.geom, '+searchradius+')) AS subq '
                  'WHERE locus < 0.9999 and locus > 0.0001);')
         cursor.execute(query)
+        self.finish_table(table1+'_cutpoints', ['sourcepointid', 'parentline_id'])
         # and ((ST_DWithin(t2p.geom, st_startpoint(reflines.geom),0.00007) or
         # ST_DWithin(t2p.geom,st_endpoint(reflines.geom),0.00007)) or not
         # (ST_DWithin(st_closestpoint(osm.geom,t2p.geom),st_startpoint(osm.geom),0.00007) or
@@ -1077,21 +2080,9 @@ class OSMDeviationfinder(object):
         cursor.execute(query)
 
         #: Recreate tables for Cutpoint Checkpoints if they already exist
-        query = 'DROP TABLE IF EXISTS '+table1+'_cutcheckpoints;'
-        cursor.execute(query)
-
-        if DEBUG:
-            query = ('CREATE TABLE '+table1+'_cutcheckpoints(id bigserial PRIMARY KEY, parentline_id integer, '
-                     'sourcepointid integer,sourcelineid integer,locus numeric, azimuth numeric);')
-            cursor.execute(query)
-        else:
-            query = ('CREATE TEMP TABLE '+table1+'_cutcheckpoints(id bigserial PRIMARY KEY, parentline_id integer, '
-                     'sourcepointid integer,sourcelineid integer,locus numeric, azimuth numeric) ON COMMIT DROP;')
-            cursor.execute(query)
-
-        query = ('SELECT addGeometryColumn (\''+table1+'_cutcheckpoints\',\'geom\',(SELECT ST_SRID(geom) AS srid '
-                 'FROM '+table2+' WHERE geom IS NOT NULL LIMIT 1),\'POINT\',2);')
-        cursor.execute(query)
+        self.create_intermediate_table(table1+'_cutcheckpoints', 'id bigserial PRIMARY KEY, parentline_id integer, '
+                                       'sourcepointid integer, sourcelineid integer, locus numeric, azimuth numeric',
+                                       table2)
 
         #: Create a table with checkpoints for each cutpoint in a given radius (this process is similar to the creation
         #: of cutpoints). The checkpoints help to determine, if the created cutpoint is justifiably on the line
@@ -1104,6 +2095,7 @@ class OSMDeviationfinder(object):
                  'WHERE ST_DWithin(t1cp.geom, t2.geom, '+searchradius+')) AS subq '
                  'WHERE locus < 0.9999 and locus > 0.0001);')
         cursor.execute(query) #abs distanzbeschränkung
+        self.finish_table(table1+'_cutcheckpoints', ['sourcepointid'])
         # and not (ST_DWithin(st_closestpoint(t2.geom,o.geom),st_startpoint(t2.geom),0.00002)
         # or ST_DWithin(st_closestpoint(t2.geom,o.geom),st_endpoint(t2.geom),0.00002))
 
@@ -1149,40 +2141,220 @@ class OSMDeviationfinder(object):
         cursor.execute(query)
         print table1
 
-    def linesplit_with_cutpoints(self, table, result_table, keepcolumns={}):
-        """This split method uses a set of cutpoints to split the line features of a table and saves the splitted
-        features in the result table. The cutpoints used for the splitting process should be created with the
-        cutpoint_creation method
+    def cutpoint_creation_numpy(self, table1, table2, searchradius, azimuthdifftolerance, maxcheckpointanglediff):
+        """Vectorized alternative to cutpoint_creation with the same parameters and result table.
+        The lines of both tables and the non-matched junction points of table2 are loaded once as numpy arrays, only
+        the pairs of points and lines within the searchradius (2*searchradius for the checkpoints) are queried with
+        the spatial index. The projection of the points onto the lines, the azimuth values and the checkpoint rules
+        are then calculated in memory and only the remaining cutpoints are written to the cutpoint table.
 
-        :param table: the input table, which hold the features to be split
-        :param result_table: the output table
+        :param table1: first inputtable for the cutpoint creation process
+        :param table2: second inputtable for the cutpoint creation process
         """
+        if np is None:
+            raise ImportError('The numpy cutpoint engine needs numpy, install it or use the sql engine')
+
+        cursor = self.cursor
+        radius = float(searchradius)
+        tolerance = float(azimuthdifftolerance)
+        maxcpdiff = float(maxcheckpointanglediff)
+
+        self.create_cutpoints_table(table1)
+
+        #: Non-matched junction points of table2 and the lines of both tables
+        query = ('SELECT t2p.id, t2p.parentline_id, ST_X(t2p.geom), ST_Y(t2p.geom), t2p.azimuth '
+                 'FROM '+table2+'_points t2p, '+table2+' t2 '
+                 'WHERE t2p.matched = false and t2p.parentline_id = t2.id ORDER BY t2p.id;')
+        cursor.execute(query)
+        rows = cursor.fetchall()
+        if not rows:
+            return
+        pointindex = dict((row[0], i) for i, row in enumerate(rows))
+        point_ids = np.array([row[0] for row in rows], dtype=np.int64)
+        point_lines = np.array([row[1] for row in rows], dtype=np.int64)
+        point_xy = np.array([(row[2], row[3]) for row in rows], dtype=np.float64)
+        point_az = np.array([np.nan if row[4] is None else float(row[4]) for row in rows])
+        lines1 = LineArrays.from_table(cursor, table1)
+        lines2 = LineArrays.from_table(cursor, table2)
+
+        def candidate_pairs(table, distance, lines):
+            #: Pairs of (point index, line index) within the given distance, found with the spatial index
+            query = ('SELECT t2p.id, t.id FROM '+table2+'_points t2p, '+table+' t '
+                     'WHERE t2p.matched = false and ST_DWithin(t2p.geom, t.geom, '+distance+');')
+            cursor.execute(query)
+            pairs = [(pointindex[pid], lines.index[lid]) for pid, lid in cursor.fetchall()
+                     if pid in pointindex and lid in lines.index]
+            return np.array(pairs, dtype=np.int64).reshape(-1, 2)
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            #: Cutpoints: the closest points on the lines of table1, not too near to their start- or endpoint
+            pairs = candidate_pairs(table1, searchradius, lines1)
+            distance, locus, closest = lines1.project(point_xy[pairs[:, 0]], pairs[:, 1])
+            keep = (locus < 0.9999) & (locus > 0.0001)
+            cp_point, cp_line = pairs[keep, 0], pairs[keep, 1]
+            cp_locus, cp_xy, cp_distance = locus[keep], closest[keep], distance[keep]
+
+            #: Azimuth in line direction at the cutpoint
+            cp_azimuth = np.empty(len(cp_locus))
+            cp_azimuth.fill(np.nan)
+            valid = (cp_locus != 0) & (cp_locus < 0.999999)
+            cp_azimuth[valid] = azimuths(lines1.interpolate(cp_line[valid], cp_locus[valid]),
+                                         lines1.interpolate(cp_line[valid], cp_locus[valid]+0.000001))
+
+            #: Not yet completely implemented, see cutpoint_creation: flag cutpoints on curved lines
+            delta = 0.00001 / lines1.lengths[cp_line]
+            valid = (cp_locus > delta) & (cp_locus < 1-delta)
+            segmentazimuth = np.empty(len(cp_locus))
+            segmentazimuth.fill(np.nan)
+            segmentazimuth[valid] = azimuths(lines1.interpolate(cp_line[valid], cp_locus[valid]-delta[valid]),
+                                             lines1.interpolate(cp_line[valid], cp_locus[valid]+delta[valid]))
+            rounded = np.floor(np.abs(np.abs(segmentazimuth-cp_azimuth)+0.2)*10+0.5)/10
+            cp_iscurved = (rounded % (2*math.pi) - 0.2) > 0.2
+
+            #: Correct the orientation of the cutpoint azimuth with the azimuth of the generating point and delete
+            #: cutpoints with an azimuth difference above the limit (orientation independent)
+            source_azimuth = point_az[cp_point]
+            flip = azimuth_diff(source_azimuth, cp_azimuth, tolerance) > tolerance
+            cp_azimuth[flip] = (cp_azimuth[flip] + math.pi) % (2*math.pi)
+            keep = ~(azimuth_diff(source_azimuth, cp_azimuth, tolerance, math.pi) > tolerance)
+
+            #: Only keep the cutpoints closest to their generating point
+            mindistance = np.empty(len(point_ids))
+            mindistance.fill(np.inf)
+            np.minimum.at(mindistance, cp_point[keep], cp_distance[keep])
+            keep &= cp_distance == mindistance[cp_point]
+            cp_point, cp_line, cp_locus, cp_xy = cp_point[keep], cp_line[keep], cp_locus[keep], cp_xy[keep]
+            cp_distance, cp_azimuth, cp_iscurved = cp_distance[keep], cp_azimuth[keep], cp_iscurved[keep]
+
+            #: Checkpoints: closest points of the cutpoints on the lines of table2 within the searchradius. These
+            #: lines are within 2*searchradius of the generating point, so they are found with one indexed query.
+            pairs = candidate_pairs(table2, str(2*radius), lines2)
+            pairs = pairs[np.argsort(pairs[:, 0], kind='mergesort')]
+            first = np.searchsorted(pairs[:, 0], cp_point, side='left')
+            count = np.searchsorted(pairs[:, 0], cp_point, side='right') - first
+            chk_cp = np.repeat(np.arange(len(cp_point)), count)
+            chk_line = pairs[np.repeat(first - (np.cumsum(count)-count), count) + np.arange(count.sum()), 1]
+            chk_distance, chk_locus, chk_xy = lines2.project(cp_xy[chk_cp], chk_line)
+            keep = (chk_distance <= radius) & (chk_locus < 0.9999) & (chk_locus > 0.0001)
+            chk_cp, chk_line, chk_distance, chk_locus = chk_cp[keep], chk_line[keep], chk_distance[keep], chk_locus[keep]
+
+            chk_azimuth = np.empty(len(chk_cp))
+            chk_azimuth.fill(np.nan)
+            valid = chk_locus < 0.999999
+            chk_azimuth[valid] = azimuths(lines2.interpolate(chk_line[valid], chk_locus[valid]),
+                                          lines2.interpolate(chk_line[valid], chk_locus[valid]+0.000001))
+
+            #: Correct the orientation of the checkpoints and delete checkpoints above the angle limit
+            flip = azimuth_diff(cp_azimuth[chk_cp], chk_azimuth, maxcpdiff) > maxcpdiff
+            chk_azimuth[flip] = (chk_azimuth[flip] + math.pi) % (2*math.pi)
+            keep = ~(azimuth_diff(cp_azimuth[chk_cp], chk_azimuth, maxcpdiff) > maxcpdiff)
+
+            #: Delete cutpoints with a checkpoint on another line, which is closer than the generating point
+            closer = keep & (lines2.ids[chk_line] != point_lines[cp_point[chk_cp]]) & \
+                (chk_distance + chk_distance*0.1 < cp_distance[chk_cp])
+            keep = np.ones(len(cp_point), dtype=bool)
+            keep[chk_cp[closer]] = False
+
+        query = 'SELECT ST_SRID(geom) FROM '+table1+' WHERE geom IS NOT NULL LIMIT 1;'
+        cursor.execute(query)
+        srid = cursor.fetchone()[0]
+        rows = []
+        for i in np.flatnonzero(keep):
+            rows.append((int(lines1.ids[cp_line[i]]), int(point_ids[cp_point[i]]), int(point_lines[cp_point[i]]),
+                         float(cp_locus[i]), None if np.isnan(cp_azimuth[i]) else float(cp_azimuth[i]),
+                         float(cp_distance[i]), bool(cp_iscurved[i]),
+                         'SRID=%d;POINT(%r %r)' % (srid, float(cp_xy[i, 0]), float(cp_xy[i, 1]))))
+        copy_rows(cursor, table1+'_cutpoints', ('parentline_id', 'sourcepointid', 'sourcelineid', 'locus', 'azimuth',
+                                                 'distance', 'iscurved', 'geom'), rows)
+        self.finish_table(table1+'_cutpoints', ['sourcepointid', 'parentline_id'])
+
+    def split_lines(self, table, cutlocations, outtable, streetname_column='name', keepcolumns={}, azimuths=True,
+                    cursor=None):
+        """Splits the line features of a table at the given locations and inserts the parts, together with all
+        features that are not split, into an existing output table. This is done in one statement: the substrings
+        are computed once in a subquery (OFFSET 0 keeps the planner from inlining st_linesubstring into every column
+        derived from it) and the ids of the split features are passed to the insert of the remaining features with
+        a data-modifying CTE.
+
+        The linesplitting implementation is based on:
+        https://github.com/pgRouting/pgrouting/blob/master/src/common/sql/pgrouting_node_network.sql
+        (Author: Nicolas Ribot, 2013)
+
+        :param table: the table with the line features to split
+        :param cutlocations: a table or subquery with the columns l1id (id of the line) and locus (fraction of the line)
+        :param outtable: the output table
+        :param streetname_column: the column of the table that is inserted into the name column of the output table
+        :param azimuths: if True, the columns direction, startazimuth, endazimuth, canon_direction and loglength are
+        filled
+        :param cursor: the cursor to use, the cursor of the deviation finder if None
+        """
+        if cursor is None:
+            cursor = self.cursor
 
-        #: Build strings for columns that should be included in linesplit result table
-        kc_str1 = ''
         kc_str2 = ''
         kc_str3 = ''
         for k in keepcolumns:
-            kc_str1 += ', ' + k + ' ' + keepcolumns.get(k)
             kc_str2 += ', ' + k
             kc_str3 += ', l.' + k
 
-        #connection = psycopg2.connect(self.dbconnectioninfo_psycopg)
-        cursor = self.cursor #connection.cursor()
-
-        query = ('CREATE TEMP TABLE interloc_'+table+' ON COMMIT DROP AS '
-                 '(SELECT cp.parentline_id AS l1id, null AS l2id, locus AS locus FROM '+table+'_cutpoints cp);')
-        cursor.execute(query)
-        query = 'CREATE INDEX interloc_'+table+'_id_idx on interloc_'+table+'(l1id);'
+        columns = 'old_id, sub_id, geom, name'
+        derived = ''
+        if azimuths:
+            columns += ', direction, startazimuth, endazimuth, canon_direction, loglength'
+            derived = (', ST_AZIMUTH(st_startpoint(geom), st_endpoint(geom)), '
+                       +startazimuth_sql('geom')+', '+endazimuth_sql('geom')+', '
+                       +canon_direction_sql('geom')+', '+loglength_sql('geom'))
+
+        query = ('WITH cut_locations AS ('
+                 'SELECT l1id AS lid, locus FROM '+cutlocations+' c UNION ALL '
+                 'SELECT DISTINCT l1id AS lid, 0 AS locus FROM '+cutlocations+' c UNION ALL '
+                 'SELECT DISTINCT l1id AS lid, 1 AS locus FROM '+cutlocations+' c), '
+                 'loc_with_idx AS ('
+                 'SELECT lid, locus, row_number() over (partition BY lid order BY locus) AS idx FROM cut_locations), '
+                 'splitted AS ('
+                 'INSERT INTO '+outtable+' ('+columns+kc_str2+') '
+                 'SELECT old_id, sub_id, geom, name'+derived+kc_str2+' '
+                 'FROM (SELECT l.id AS old_id, loc1.idx AS sub_id, '
+                 'st_linesubstring(l.geom, loc1.locus, loc2.locus) AS geom, l.'+streetname_column+' AS name'+kc_str3+' '
+                 'FROM loc_with_idx loc1 join loc_with_idx loc2 USING (lid) join '+table+' l on (l.id = loc1.lid) '
+                 'WHERE loc2.idx = loc1.idx+1 OFFSET 0) AS substrings '
+                 'WHERE geometryType(geom) = \'LINESTRING\' '
+                 'RETURNING old_id) '
+                 'INSERT INTO '+outtable+' ('+columns+kc_str2+') '
+                 'SELECT id, 1 AS sub_id, geom, '+streetname_column+derived+kc_str2+' '
+                 'FROM '+table+' t '
+                 'WHERE NOT EXISTS (SELECT 1 FROM splitted s WHERE s.old_id = t.id);')
         cursor.execute(query)
 
-        #: Recreate table for linesplit result if it already exists
+    def create_split_table(self, result_table, table, keepcolumns={}, cursor=None, intermediate=False):
+        """(Re)creates an empty table for the splitted line features of a table. The table has no indexes yet,
+        call finish_table with split_indexes after loading it.
+
+        :param result_table: the table to create
+        :param table: the input table of the split, its srid and geometry type are used for the result table
+        :param keepcolumns: a dictionary with additional columns and their types
+        :param cursor: the cursor to use, the cursor of the deviation finder if None
+        :param intermediate: if True, the table is created with create_intermediate_table
+        """
+        if cursor is None:
+            cursor = self.cursor
+
+        #: Build strings for columns that should be included in linesplit result table
+        kc_str1 = ''
+        for k in keepcolumns:
+            kc_str1 += ', ' + k + ' ' + keepcolumns.get(k)
+        columns = ('id bigserial PRIMARY KEY, old_id integer, sub_id integer, '
+                   'name varchar, direction numeric, startazimuth numeric, endazimuth numeric, '
+                   'canon_direction double precision, loglength double precision '+kc_str1)
+
+        if intermediate:
+            self.create_intermediate_table(result_table, columns, table, None, cursor)
+            return
+
         query = ('DROP TABLE IF EXISTS '+result_table+';')
         cursor.execute(query)
 
-        query = ('CREATE TABLE '+result_table+' '
-                 '(id bigserial PRIMARY KEY, old_id integer, sub_id integer, '
-                 'name varchar, direction numeric '+kc_str1+');')
+        query = 'CREATE TABLE '+result_table+' ('+columns+');'
         cursor.execute(query)
         query = ('SELECT addGeometryColumn(\''+result_table+'\',\'geom\','
                  '(SELECT ST_SRID(geom) AS srid '
@@ -1190,31 +2362,29 @@ class OSMDeviationfinder(object):
                  'WHERE geom IS NOT NULL LIMIT 1),'
                  '(SELECT geometrytype(geom) FROM '+table+' limit 1), 2);')
         cursor.execute(query)
-        query = ('CREATE INDEX '+result_table+'_geom_idx ON '+result_table+'  USING GIST (geom);')
-        cursor.execute(query)
 
-        #: Insert splitted feature parts into result table
-        query = ('INSERT INTO '+result_table+' (old_id, sub_id, geom, name, direction '+kc_str2+') (WITH cut_locations '
-                 'AS (SELECT l1id AS lid, locus FROM interloc_'+table+' UNION ALL SELECT i.l1id AS lid, 0 AS locus '
-                 'FROM interloc_'+table+' i left join '+table+' b on (i.l1id = b.id) UNION ALL '
-                 'SELECT i.l1id AS lid, 1 AS locus FROM interloc_'+table+' i '
-                 'left join '+table+' b on (i.l1id = b.id) order BY lid, locus ), '
-                 'loc_WITH_idx AS ( SELECT lid, locus, row_number() over (partition BY lid order BY locus) AS idx '
-                 'FROM cut_locations) SELECT l.id, loc1.idx AS sub_id, st_linesubstring(l.geom, loc1.locus, loc2.locus)'
-                 ' AS geom, l.name AS name, ST_AZIMUTH(st_startpoint(st_linesubstring(l.geom, loc1.locus, loc2.locus)),'
-                 'st_endpoint(st_linesubstring(l.geom, loc1.locus, loc2.locus))) AS direction '+kc_str3+' '
-                 'FROM loc_WITH_idx loc1 join loc_WITH_idx loc2 USING (lid) join '+table+' l on (l.id = loc1.lid) '
-                 'WHERE loc2.idx = loc1.idx+1 and geometryType(st_linesubstring(l.geom, loc1.locus, loc2.locus)) = '
-                 '\'LINESTRING\');')
-        cursor.execute(query)
+    def linesplit_with_cutpoints(self, table, result_table, keepcolumns={}, cursor=None):
+        """This split method uses a set of cutpoints to split the line features of a table and saves the splitted
+        features in the result table. The cutpoints used for the splitting process should be created with the
+        cutpoint_creation method
 
-        #: Insert non splitted parts into result table
-        query = ('INSERT INTO '+result_table+' (old_id, sub_id, geom,name, direction '+kc_str2+') '
-                 '(WITH used AS (SELECT distinct old_id FROM '+result_table+') SELECT id, 1 AS sub_id, geom, '
-                 'name, ST_AZIMUTH(st_startpoint(geom),st_endpoint(geom)) AS direction '+kc_str2+' '
-                 'FROM '+table+' '
-                 'WHERE id not in (SELECT * FROM used));')
-        cursor.execute(query)
+        :param table: the input table, which hold the features to be split
+        :param result_table: the output table
+        :param cursor: the cursor to use, the cursor of the deviation finder if None
+        """
+
+        if cursor is None:
+            cursor = self.cursor
+
+        #: Build the linesplit result into a new version of the result table
+        version = self.new_version(result_table, cursor)
+        self.create_split_table(version, table, keepcolumns, cursor)
+
+        #: Insert splitted feature parts and non splitted features into result table
+        self.split_lines(table, '(SELECT parentline_id AS l1id, locus FROM '+table+'_cutpoints)', version,
+                         'name', keepcolumns, cursor=cursor)
+        self.finish_table(version, split_indexes, cursor=cursor)
+        self.publish_table(result_table, version, cursor)
 
     def noharmonization(self, table, result_table, keepcolumns={}, streetname_column='name'):
             """This split method uses a set of cutpoints to split the line features of a table and saves the splitted
@@ -1240,7 +2410,7 @@ class OSMDeviationfinder(object):
             cursor.execute(query)
             query = ('CREATE TABLE '+result_table+' '
                  '(id bigserial PRIMARY KEY, old_id integer, sub_id integer, '
-                 'name varchar, direction numeric '+kc_str1+');')
+                 'name varchar, direction numeric, startazimuth numeric, endazimuth numeric '+kc_str1+');')
             cursor.execute(query)
             query = ('SELECT addGeometryColumn(\''+result_table+'\',\'geom\','
                  '(SELECT ST_SRID(geom) AS srid '
@@ -1250,12 +2420,567 @@ class OSMDeviationfinder(object):
             cursor.execute(query)
             query = ('CREATE INDEX '+result_table+'_geom_idx ON '+result_table+'  USING GIST (geom);')
             cursor.execute(query)
-            query = ('INSERT INTO '+result_table+' (old_id, sub_id, geom,name, direction '+kc_str2+') '
+            query = ('INSERT INTO '+result_table+' (old_id, sub_id, geom,name, direction, startazimuth, endazimuth '
+                 +kc_str2+') '
                  'SELECT id, 1 AS sub_id, geom, '
-                 + streetname_column +', ST_AZIMUTH(st_startpoint(geom),st_endpoint(geom)) AS direction '+kc_str2+' '
+                 + streetname_column +', ST_AZIMUTH(st_startpoint(geom),st_endpoint(geom)) AS direction, '
+                 +startazimuth_sql('geom')+', '+endazimuth_sql('geom')+' '+kc_str2+' '
                  'FROM '+table+';')
             self.cursor.execute(query)
 
+    def create_intermediate_table(self, table, columns, sourcetable, geometrytype='POINT', cursor=None):
+        """(Re)creates an empty intermediate table of the pipeline with a geometry column geom. Intermediate tables
+        are unlogged: they are not written to the WAL, which makes loading them much faster, and they are truncated
+        after a crash of the database server. A truncated table changes its version, so the stage creating it runs
+        again, see stages_to_run. The table is registered for the retention policy, see drop_intermediates.
+        Indexes are not created here, call finish_table after loading the table.
+
+        :param table: the table to create
+        :param columns: the column definitions of the table, without the geometry column
+        :param sourcetable: the table whose srid is used for the geometry column
+        :param geometrytype: the type of the geometry column, None for the type of the source table
+        :param cursor: the cursor to use, the cursor of the deviation finder if None
+        """
+        if cursor is None:
+            cursor = self.cursor
+
+        query = 'DROP TABLE IF EXISTS '+table+';'
+        cursor.execute(query)
+        query = 'CREATE UNLOGGED TABLE '+table+' ('+columns+');'
+        cursor.execute(query)
+
+        if geometrytype is None:
+            geometrytype = '(SELECT geometrytype(geom) FROM '+sourcetable+' limit 1)'
+        else:
+            geometrytype = '\''+geometrytype+'\''
+        query = ('SELECT addGeometryColumn(\''+table+'\',\'geom\','
+                 '(SELECT ST_SRID(geom) AS srid FROM '+sourcetable+' WHERE geom IS NOT NULL LIMIT 1),'
+                 +geometrytype+', 2);')
+        cursor.execute(query)
+        self.register_intermediate(table, cursor)
+
+    def register_intermediate(self, table, cursor=None):
+        """Registers a table as intermediate table, see drop_intermediates
+
+        :param table: the intermediate table
+        :param cursor: the cursor to use, the cursor of the deviation finder if None
+        """
+        if cursor is None:
+            cursor = self.cursor
+        self.create_intermediate_registry(cursor)
+        query = 'DELETE FROM '+intermediates_table+' WHERE tablename = %s;'
+        cursor.execute(query, (table,))
+        query = 'INSERT INTO '+intermediates_table+' (tablename) VALUES (%s);'
+        cursor.execute(query, (table,))
+
+    def create_intermediate_registry(self, cursor=None):
+        """Creates the registry of the intermediate tables, if it doesn't exist yet"""
+        if cursor is None:
+            cursor = self.cursor
+        query = ('CREATE TABLE IF NOT EXISTS '+intermediates_table+' '
+                 '(tablename varchar PRIMARY KEY, created timestamp DEFAULT now());')
+        cursor.execute(query)
+
+    def finish_table(self, table, indexes=(), spatial=True, cursor=None):
+        """Creates the indexes of a loaded table and analyzes it. Building an index once after the bulk insert is
+        faster than maintaining it during the insert, and the statistics gathered by ANALYZE let the planner of the
+        following queries estimate the row counts (autovacuum analyzes new tables late and temporary tables never).
+
+        :param table: the loaded table
+        :param indexes: the columns that get a btree index
+        :param spatial: if True, the geometry column geom gets a GiST index
+        :param cursor: the cursor to use, the cursor of the deviation finder if None
+        """
+        if cursor is None:
+            cursor = self.cursor
+        if spatial:
+            query = 'CREATE INDEX '+table+'_geom_idx ON '+table+' USING GIST (geom);'
+            cursor.execute(query)
+        for column in indexes:
+            query = 'CREATE INDEX '+table+'_'+column+'_idx ON '+table+' USING btree('+column+');'
+            cursor.execute(query)
+        query = 'ANALYZE '+table+';'
+        cursor.execute(query)
+
+    def drop_intermediates(self, prefix):
+        """Drops all registered intermediate tables, whose name starts with the given prefix followed by an
+        underscore, together with their topology tables, and removes them from the registries. The underscore keeps
+        the prefix odf_x_tile1 from matching the tables of odf_x_tile10.
+
+        :param prefix: the prefix of the tables to drop, eg. the basetable of a deviation map
+        """
+        cursor = self.cursor
+        self.create_intermediate_registry()
+        self.create_topology_registry()
+        pattern = prefix.replace('_', '\\_')+'\\_%'
+        query = 'SELECT tablename FROM '+intermediates_table+' WHERE tablename LIKE %s;'
+        cursor.execute(query, (pattern,))
+        for row in cursor.fetchall():
+            for suffix in ('', '_nodes', '_edges', '_crossings'):
+                cursor.execute('DROP TABLE IF EXISTS '+row[0]+suffix+';')
+            query = 'DELETE FROM '+topology_table+' WHERE tablename = %s;'
+            cursor.execute(query, (row[0],))
+        query = 'DELETE FROM '+intermediates_table+' WHERE tablename LIKE %s;'
+        cursor.execute(query, (pattern,))
+        self.create_version_registry(cursor)
+        query = 'DELETE FROM '+table_versions_table+' WHERE tablename LIKE %s;'
+        cursor.execute(query, (pattern,))
+
+    def new_version(self, table, cursor=None):
+        """Returns the name of a new version of a published table, <table>_v<n> with n greater than the numbers of
+        all existing versions. The version is built under this name and then published with publish_table, so
+        readers of the table are never blocked by the rebuild.
+
+        :param table: the published table
+        :param cursor: the cursor to use, the cursor of the deviation finder if None
+        """
+        if cursor is None:
+            cursor = self.cursor
+        pattern = '^'+table+'_v([0-9]+)$'
+        query = ('SELECT coalesce(max(substring(table_name from %s)::integer), 0) FROM information_schema.tables '
+                 'WHERE table_schema = \'public\' AND table_name ~ %s;')
+        cursor.execute(query, (pattern, pattern))
+        return table+'_v'+str(cursor.fetchone()[0]+1)
+
+    def publish_table(self, table, version, cursor=None, collect=True):
+        """Publishes a version of a table: the view <table> is switched to the version in one statement, which is
+        visible to the readers with the commit of the current transaction. Queries already running keep reading the
+        previous version. If the table exists as a regular table (created before tables were versioned), it is
+        dropped first. The versions not published anymore are dropped, see collect_versions.
+
+        The switch locks the view until the commit, a stage running in run_stage only registers its publications,
+        they are switched right before the stage commits.
+
+        :param table: the name of the view read by the readers
+        :param version: the new version, see new_version
+        :param cursor: the cursor to use, the cursor of the deviation finder if None
+        :param collect: drop the versions not published anymore
+        """
+        if cursor is None:
+            cursor = self.cursor
+        if self.publications is not None and cursor is self.cursor:
+            self.publications.append((table, version))
+            return
+        query = ('SELECT table_type FROM information_schema.tables '
+                 'WHERE table_schema = \'public\' AND table_name = %s;')
+        cursor.execute(query, (table,))
+        row = cursor.fetchone()
+        if row is not None and row[0] != 'VIEW':
+            cursor.execute('DROP TABLE '+table+';')
+
+        #: Replacing the view only works if the columns of the new version extend the columns of the published one
+        cursor.execute('SAVEPOINT odf_publish;')
+        try:
+            cursor.execute('CREATE OR REPLACE VIEW '+table+' AS SELECT * FROM '+version+';')
+        except psycopg2.Error:
+            cursor.execute('ROLLBACK TO SAVEPOINT odf_publish;')
+            cursor.execute('DROP VIEW IF EXISTS '+table+';')
+            cursor.execute('CREATE VIEW '+table+' AS SELECT * FROM '+version+';')
+        cursor.execute('RELEASE SAVEPOINT odf_publish;')
+        if collect:
+            self.collect_versions(table, cursor)
+
+    def unpublish_table(self, table, cursor=None):
+        """Removes a published table (or a regular table of this name) and all of its versions, which are not read
+        anymore, see collect_versions.
+
+        :param table: the published table
+        :param cursor: the cursor to use, the cursor of the deviation finder if None
+        """
+        if cursor is None:
+            cursor = self.cursor
+        query = ('SELECT table_type FROM information_schema.tables '
+                 'WHERE table_schema = \'public\' AND table_name = %s;')
+        cursor.execute(query, (table,))
+        row = cursor.fetchone()
+        if row is not None and row[0] == 'VIEW':
+            cursor.execute('DROP VIEW '+table+';')
+        elif row is not None:
+            cursor.execute('DROP TABLE '+table+';')
+        self.collect_versions(table, cursor)
+
+    def collect_versions(self, table, cursor=None):
+        """Drops the versions of a table, which are not published by the view <table>. A version is only dropped,
+        if it can be locked without waiting: a version still read by a query keeps its lock, it is skipped and
+        dropped by a later call.
+
+        :param table: the published table
+        :param cursor: the cursor to use, the cursor of the deviation finder if None
+        """
+        if cursor is None:
+            cursor = self.cursor
+        query = ('SELECT table_name FROM information_schema.view_table_usage '
+                 'WHERE view_schema = \'public\' AND view_name = %s;')
+        cursor.execute(query, (table,))
+        published = set(row[0] for row in cursor.fetchall())
+        query = ('SELECT table_name FROM information_schema.tables '
+                 'WHERE table_schema = \'public\' AND table_name ~ %s;')
+        cursor.execute(query, ('^'+table+'_v[0-9]+$',))
+        for row in cursor.fetchall():
+            if row[0] in published:
+                continue
+            cursor.execute('SAVEPOINT odf_collect;')
+            try:
+                cursor.execute('LOCK TABLE '+row[0]+' IN ACCESS EXCLUSIVE MODE NOWAIT;')
+                cursor.execute('DROP TABLE '+row[0]+';')
+                cursor.execute('RELEASE SAVEPOINT odf_collect;')
+            except psycopg2.OperationalError:
+                cursor.execute('ROLLBACK TO SAVEPOINT odf_collect;')
+
+    def table_version(self, table, cursor=None, target=None):
+        """Returns a version of a persistent table or None, if the table doesn't exist (or is temporary). The version
+        is read from the catalog and the version registry, the table itself isn't read: it is made of the relation
+        (its oid and its file, so a recreated or truncated table gets a new version, a published table is
+        identified by its published version, see publish_table) and the number of changes of the table recorded by
+        finished stages (see record_stage).
+
+        :param table: the table
+        :param cursor: the cursor to use, the cursor of the deviation finder if None
+        :param target: the relation holding the content of the table, eg. a version which isn't published yet
+        """
+        if cursor is None:
+            cursor = self.cursor
+        query = ('SELECT c.oid, c.relfilenode, c.relkind FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace '
+                 'WHERE n.nspname = \'public\' AND c.relname = %s;')
+        cursor.execute(query, (target or table,))
+        row = cursor.fetchone()
+        if row is not None and row[2] == 'v':
+            query = ('SELECT c.oid, c.relfilenode, c.relkind FROM information_schema.view_table_usage u '
+                     'JOIN pg_class c ON c.relname = u.table_name '
+                     'JOIN pg_namespace n ON n.oid = c.relnamespace AND n.nspname = u.table_schema '
+                     'WHERE u.view_schema = \'public\' AND u.view_name = %s;')
+            cursor.execute(query, (target or table,))
+            row = cursor.fetchone()
+        if row is None:
+            return None
+        self.create_version_registry(cursor)
+        query = 'SELECT version FROM '+table_versions_table+' WHERE tablename = %s;'
+        cursor.execute(query, (table,))
+        changes = cursor.fetchone()
+        return str(row[0])+'.'+str(row[1])+':'+str(changes[0] if changes is not None else 0)
+
+    def create_version_registry(self, cursor=None):
+        """Creates the table with the number of recorded changes per table (see table_version), if it doesn't exist
+        yet
+
+        :param cursor: the cursor to use, the cursor of the deviation finder if None
+        """
+        if cursor is None:
+            cursor = self.cursor
+        query = ('CREATE TABLE IF NOT EXISTS '+table_versions_table+' '
+                 '(tablename varchar PRIMARY KEY, version bigint);')
+        cursor.execute(query)
+
+    def count_rows(self, tables, cursor=None):
+        """Returns the estimated number of rows of the given tables (published tables are counted by their published
+        version) from the statistics of the catalog, see finish_table
+
+        :param tables: the names of the tables
+        :param cursor: the cursor to use, the cursor of the deviation finder if None
+        """
+        if cursor is None:
+            cursor = self.cursor
+        query = ('SELECT coalesce(sum(greatest(c.reltuples, 0)), 0)::bigint FROM pg_class c '
+                 'JOIN pg_namespace n ON n.oid = c.relnamespace '
+                 'WHERE n.nspname = \'public\' AND c.relkind = \'r\' AND (c.relname = ANY(%s) OR c.relname IN '
+                 '(SELECT table_name FROM information_schema.view_table_usage '
+                 'WHERE view_schema = \'public\' AND view_name = ANY(%s)));')
+        cursor.execute(query, (list(tables), list(tables)))
+        return cursor.fetchone()[0]
+
+    def create_stage_registry(self):
+        """Creates the table with the state of the finished pipeline stages, if it doesn't exist yet"""
+        query = ('CREATE TABLE IF NOT EXISTS '+stage_runs_table+' '
+                 '(stage varchar PRIMARY KEY, options varchar, inputs text, outputs text, finished timestamp);')
+        self.cursor.execute(query)
+        self.create_version_registry()
+
+    def record_stage(self, stage, cursor=None, targets={}):
+        """Stores the options hash and the versions of the input and output tables of a finished stage and returns
+        the versions of the output tables
+
+        :param stage: the finished stage
+        :param cursor: the cursor to use, the cursor of the deviation finder if None
+        :param targets: the versions of the output tables, which the stage publishes (see run_stage)
+        """
+        if cursor is None:
+            cursor = self.cursor
+        inputs = dict((t, self.table_version(t, cursor)) for t in stage.inputs)
+        #: The stage changed its output tables, also the ones it modified in place
+        self.create_version_registry(cursor)
+        for t in stage.outputs:
+            query = ('INSERT INTO '+table_versions_table+' (tablename, version) VALUES (%s, 1) '
+                     'ON CONFLICT (tablename) DO UPDATE SET version = '+table_versions_table+'.version + 1;')
+            cursor.execute(query, (t,))
+        outputs = dict((t, self.table_version(t, cursor, targets.get(t))) for t in stage.outputs)
+        query = 'DELETE FROM '+stage_runs_table+' WHERE stage = %s;'
+        cursor.execute(query, (stage.key(),))
+        query = ('INSERT INTO '+stage_runs_table+' (stage, options, inputs, outputs, finished) '
+                 'VALUES (%s, %s, %s, %s, now());')
+        cursor.execute(query, (stage.key(), stage.options_hash(), json.dumps(inputs), json.dumps(outputs)))
+        return outputs
+
+    def stages_to_run(self, stages):
+        """Returns the indices of the stages, which have to run. A stage is skipped, if it finished before with the
+        same options and its input and output tables still have the versions recorded then (for tables modified by
+        later stages, the version recorded by the last of them). A stage has to run too, if an earlier stage that
+        writes one of its tables runs, or if a later stage that modifies one of its output tables runs.
+
+        :param stages: a list of Stage objects
+        """
+        records = {}
+        for stage in stages:
+            query = 'SELECT options, inputs, outputs FROM '+stage_runs_table+' WHERE stage = %s;'
+            self.cursor.execute(query, (stage.key(),))
+            row = self.cursor.fetchone()
+            if row is not None:
+                records[stage.key()] = (row[0], json.loads(row[1]), json.loads(row[2]))
+
+        versions = {}
+
+        def version(table):
+            if table not in versions:
+                versions[table] = self.table_version(table)
+            return versions[table]
+
+        run = set()
+        for i, stage in enumerate(stages):
+            record = records.get(stage.key())
+            if record is None or record[0] != stage.options_hash():
+                run.add(i)
+                continue
+            fresh = all(t in record[1] and record[1][t] is not None and record[1][t] == version(t)
+                        for t in stage.inputs)
+            for t in stage.outputs:
+                last = max(j for j in xrange(len(stages)) if t in stages[j].outputs)
+                expected = records.get(stages[last].key(), (None, {}, {}))[2].get(t)
+                fresh = fresh and expected is not None and expected == version(t)
+            if not fresh:
+                run.add(i)
+
+        changed = True
+        while changed:
+            changed = False
+            for i, stage in enumerate(stages):
+                if i in run:
+                    continue
+                for j in run:
+                    if (j < i and stages[j].outputs & (stage.inputs | stage.outputs)) or \
+                            (j > i and stages[j].outputs & stage.outputs):
+                        run.add(i)
+                        changed = True
+                        break
+        return run
+
+    def close_connection(self, connection):
+        """Detaches a connection from the handle of the run (see RunHandle) and closes it
+
+        :param connection: the connection to close
+        """
+        if self.handle is not None:
+            self.handle.detach(connection)
+        if not connection.closed:
+            connection.close()
+
+    def run_stage(self, stage, retries=2):
+        """Runs a stage in its own transaction on the connection of the deviation finder: the outputs of the stage
+        and its record (see record_stage) are committed together, so they are published atomically. If the stage
+        fails with an operational error (eg. a deadlock, a serialization failure or a lost connection), it is rolled
+        back and retried up to the given number of times, the stages recreate their outputs from their inputs.
+
+        The versions published by the stage (see publish_table) are recorded first, their views are switched by the
+        last statements of the transaction, so the views are locked only for the commit.
+
+        The statement timeout and work_mem of the stage are set for its transaction only. If the run is cancelled
+        (see RunHandle) or a query exceeds the statement timeout, the stage is rolled back and StageAborted is raised.
+
+        Returns the number of rows in the output tables of the stage.
+
+        :param stage: the Stage object to run
+        :param retries: the number of retries after an operational error
+        """
+        for attempt in xrange(retries+1):
+            try:
+                self.publications = []
+                self.check_cancelled(stage)
+                if stage.statement_timeout:
+                    self.cursor.execute('SET LOCAL statement_timeout = %s;', (int(float(stage.statement_timeout)*1000),))
+                if stage.work_mem:
+                    self.cursor.execute('SET LOCAL work_mem = %s;', (stage.work_mem,))
+                getattr(self, stage.method)(*stage.args)
+                #: Queries are only cancelled while they run, a cancel between two queries stops the stage here
+                self.check_cancelled(stage)
+                publications, self.publications = self.publications, None
+                targets = dict(publications)
+                outputs = self.record_stage(stage, targets=targets)
+                rows = self.count_rows([targets.get(t, t) for t in outputs if outputs[t] is not None])
+                for table, version in publications:
+                    self.publish_table(table, version, collect=False)
+                self.connection.commit()
+                if publications:
+                    for table, version in publications:
+                        self.collect_versions(table)
+                    self.connection.commit()
+                return rows
+            except psycopg2.extensions.QueryCanceledError:
+                query = self.cursor.query
+                self.connection.rollback()
+                if self.handle is not None and self.handle.cancelled():
+                    raise StageAborted(stage, query, 'cancelled')
+                raise StageAborted(stage, query, 'timeout')
+            except psycopg2.OperationalError:
+                if self.connection.closed:
+                    if self.handle is not None:
+                        self.handle.detach(self.connection)
+                    self.connection = psycopg2.connect(self.dbconnectioninfo_psycopg)
+                    if self.handle is not None:
+                        self.handle.attach(self.connection)
+                else:
+                    self.connection.rollback()
+                self.cursor = self.connection.cursor()
+                if attempt == retries:
+                    raise
+            except Exception:
+                if not self.connection.closed:
+                    self.connection.rollback()
+                raise
+            finally:
+                self.publications = None
+
+    def progress(self, message, step=None, steps=None, stage=None, rows=None, done=False):
+        """Returns a ProgressEvent for a progress message, its elapsed time is measured from the start of the run
+        (the first event, if the run didn't set started)
+
+        :param message: the progress message
+        :param step: the number of the current step
+        :param steps: the number of steps of the run
+        :param stage: the name of the current stage
+        :param rows: the number of rows written by the last finished step
+        :param done: True, if the event reports the end of the step
+        """
+        if self.started is None:
+            self.started = time.time()
+        return ProgressEvent(message, stage, step, steps, rows, round(time.time()-self.started, 3), done)
+
+    def check_cancelled(self, stage):
+        """Raises StageAborted, if the current run was cancelled
+
+        :param stage: the current stage
+        """
+        if self.handle is not None and self.handle.cancelled():
+            raise StageAborted(stage, None, 'cancelled')
+
+    def run_stages(self, stages, parallel=True, resume=True):
+        """Runs a list of stages and yields their progress events (see ProgressEvent): one when a stage starts and
+        one with the number of rows in its output tables when it is done. Every stage runs in its own transaction, see
+        run_stage. A stage depends on the previous stages, which write one of its input or output tables or read one
+        of its output tables. Stages without pending dependencies are started in the order of the list, so the
+        progress messages keep the order of the pipeline.
+
+        Every finished stage is recorded with its options and the versions of its tables. If resume is True, stages
+        which are unchanged since their last run are skipped, see stages_to_run. So a failed run continues with the
+        failed stage and repeated runs only redo the stages affected by changed options.
+
+        The tables passed between the stages are persistent, so if parallel is True, the current transaction is
+        committed and ready stages run in parallel, each on a pooled connection. Otherwise the stages run one after
+        another on the connection of the deviation finder.
+
+        If the generator is closed (eg. the client of a streamed run disconnects), the running stages are cancelled.
+
+        :param stages: a list of Stage objects
+        :param parallel: run ready stages in parallel
+        :param resume: skip unchanged stages
+        """
+        if self.handle is None:
+            self.handle = RunHandle(self.dbconnectioninfo_psycopg)
+        self.handle.attach(self.connection)
+        self.create_stage_registry()
+        self.create_topology_registry()
+        self.create_intermediate_registry()
+        self.connection.commit()
+        if resume:
+            run = self.stages_to_run(stages)
+        else:
+            run = set(xrange(len(stages)))
+        steps = len(stages)
+        for i, stage in enumerate(stages):
+            if i not in run:
+                yield self.progress(stage.message+' (unchanged, skipped)', i+1, steps, stage.method, done=True)
+
+        if not parallel:
+            try:
+                for i, stage in enumerate(stages):
+                    if i in run:
+                        yield self.progress(stage.message, i+1, steps, stage.method)
+                        rows = self.run_stage(stage)
+                        yield self.progress(stage.message+' finished', i+1, steps, stage.method, rows, True)
+            except GeneratorExit:
+                #: The client is gone, stop the run like the parallel path does
+                self.handle.cancel()
+                raise
+            return
+
+        dependencies = []
+        for i, stage in enumerate(stages):
+            depends = set()
+            for j in xrange(i):
+                if stages[j].outputs & (stage.inputs | stage.outputs) or stages[j].inputs & stage.outputs:
+                    depends.add(j)
+            dependencies.append(depends)
+
+        idle = []
+        results = Queue.Queue()
+
+        def work(i, worker):
+            try:
+                rows = worker.run_stage(stages[i])
+                results.put((i, worker, rows, None))
+            except Exception as e:
+                results.put((i, worker, None, e))
+
+        started = set(i for i in xrange(len(stages)) if i not in run)
+        done = set(started)
+        error = None
+        while len(done) < len(started) or (error is None and len(started) < len(stages)):
+            if error is None:
+                for i, stage in enumerate(stages):
+                    if i not in started and dependencies[i] <= done:
+                        if idle:
+                            worker = idle.pop()
+                        else:
+                            worker = OSMDeviationfinder(self.dbconnectioninfo_psycopg)
+                            worker.connection = psycopg2.connect(self.dbconnectioninfo_psycopg)
+                            worker.cursor = worker.connection.cursor()
+                            worker.handle = self.handle
+                            self.handle.attach(worker.connection)
+                        started.add(i)
+                        thread = threading.Thread(target=work, args=(i, worker))
+                        thread.daemon = True
+                        thread.start()
+                        try:
+                            yield self.progress(stage.message, i+1, steps, stage.method)
+                        except GeneratorExit:
+                            error = GeneratorExit()
+                            self.handle.cancel()
+                            break
+            if len(done) == len(started):
+                break
+            i, worker, rows, e = results.get()
+            done.add(i)
+            idle.append(worker)
+            if e is not None and error is None:
+                error = e
+            if e is None and not isinstance(error, GeneratorExit):
+                try:
+                    yield self.progress(stages[i].message+' finished', i+1, steps, stages[i].method, rows, True)
+                except GeneratorExit:
+                    error = GeneratorExit()
+                    self.handle.cancel()
+        for worker in idle:
+            self.close_connection(worker.connection)
+        if error is not None:
+            raise error
+
     def harmonize_datasets(self, harmonization_options):
         """Split the line features of two datasets at nearly the same locations to (hopefully) get nearly the same
         segments in both datasets. This tries to minimize 1:M and M:N relationships between matchingpartners and will
@@ -1269,9 +2994,17 @@ class OSMDeviationfinder(object):
         see the documentation for HarmonizeOptions Class
         """
 
+        self.started = time.time()
         if harmonization_options is None:
             yield 'Error: Harmonization Options not set!'
             return
+        if harmonization_options.cutpointengine == 'numpy' and np is None:
+            yield 'Error: The numpy cutpoint engine needs numpy!'
+            return
+        if harmonization_options.harmonize and int(harmonization_options.tiles) > 1:
+            for message in self.harmonize_datasets_tiled(harmonization_options):
+                yield message
+            return
 
         #: Shorter parameters for shorter queries
         basetable = harmonization_options.basetable
@@ -1292,93 +3025,649 @@ class OSMDeviationfinder(object):
         self.connection = psycopg2.connect(self.dbconnectioninfo_psycopg)
         self.cursor = self.connection.cursor()
 
+        #: The pipeline is described as a list of stages with their input and output tables, independent stages
+        #: of the reference and osm dataset can run in parallel, see run_stages
+        stages = []
+        if not harmonization_options.harmonize:
+            yield 'No harmonization'
+        #: Clean datasets if options are True
+        if harmonization_options.cleanref:
+            stages.append(Stage('Cleaning Reference Dataset', 'clean_dataset',
+                                (reftable, harmonization_options.cleanrefradius, streetnamecol, keepcolumns_t1),
+                                [reftable], [reftable+'_corrected']))
+            reftable += '_corrected'
+            streetnamecol = 'name'
+        if harmonization_options.cleanosm:
+            stages.append(Stage('Cleaning OSM Dataset', 'clean_dataset',
+                                (osmtable, harmonization_options.cleanosmradius, 'name', keepcolumns_t2),
+                                [osmtable], [osmtable+'_corrected']))
+            osmtable += '_corrected'
+
         if harmonization_options.harmonize:
-            #: Clean datasets if options are True
-            if harmonization_options.cleanref:
-                yield 'Cleaning Reference Dataset'
-                self.clean_dataset(reftable, harmonization_options.cleanrefradius, streetnamecol, keepcolumns_t1)
-                reftable += '_corrected'
-                streetnamecol = 'name'
-            if harmonization_options.cleanosm:
-                yield 'Cleaning OSM Dataset'
-                self.clean_dataset(osmtable, harmonization_options.cleanosmradius, 'name', keepcolumns_t2)
-                osmtable += '_corrected'
             #: Presplit queries for reference lines
             if harmonization_options.presplitref:
-                yield 'Presplitting Reference Lines'
-                self.presplit_dataset(reftable, reftable+'_presplitted', keepcolumns_t1, streetnamecol)
+                stages.append(Stage('Presplitting Reference Lines', 'presplit_dataset',
+                                    (reftable, reftable+'_presplitted', keepcolumns_t1, streetnamecol),
+                                    [reftable], [reftable+'_presplitted']))
                 reftable += '_presplitted'
             if harmonization_options.presplitosm:
-                yield 'Presplitting OSM Lines'
-                self.presplit_dataset(osmtable, osmtable+'_presplitted', keepcolumns_t2, 'name')
+                stages.append(Stage('Presplitting OSM Lines', 'presplit_dataset',
+                                    (osmtable, osmtable+'_presplitted', keepcolumns_t2, 'name'),
+                                    [osmtable], [osmtable+'_presplitted']))
                 osmtable += '_presplitted'
 
-            yield 'Generating Reference Junctions'
-            self.generate_junctions(reftable)
-
-            yield 'Generating OSM Junctions'
-            self.generate_junctions(osmtable)
-
-            yield 'Junction Matching between Reference and OSM Junctions'
-            self.junction_matching(basetable, reftable, osmtable, searchradius, azimuthdifftolerance, max_azdiff,
-                                   max_distancediff, max_roads_countdiff)
-
-            yield 'Creating Cutpoints for Reference-Dataset based on non-matched junction points'
-            self.cutpoint_creation(reftable, osmtable, searchradius, azimuthdifftolerance, maxcheckpointanglediff)
-
-            yield 'Creating Cutpoints for OSM-Dataset based on non-matched junction points'
-            self.cutpoint_creation(osmtable, reftable, searchradius, azimuthdifftolerance, maxcheckpointanglediff)
-
-            yield 'Splitting Reference Lines with Reference Cutpoints'
-            self.linesplit_with_cutpoints(reftable, ref_out_table, keepcolumns_t1)
+            stages.append(Stage('Generating Reference Junctions', 'generate_junctions', (reftable,),
+                                [reftable], [reftable+'_points', reftable+'_junctions']))
+            stages.append(Stage('Generating OSM Junctions', 'generate_junctions', (osmtable,),
+                                [osmtable], [osmtable+'_points', osmtable+'_junctions']))
 
-            yield 'Splitting OSM Lines with OSM Cutpoints'
-            self.linesplit_with_cutpoints(osmtable, osm_out_table, keepcolumns_t2)
+            if harmonization_options.junctionmatchingengine == 'python':
+                junction_matching = 'junction_matching_inprocess'
+            else:
+                junction_matching = 'junction_matching'
+            stages.append(Stage('Junction Matching between Reference and OSM Junctions', junction_matching,
+                                (basetable, reftable, osmtable, searchradius, azimuthdifftolerance, max_azdiff,
+                                 max_distancediff, max_roads_countdiff),
+                                [reftable+'_junctions', osmtable+'_junctions'],
+                                [reftable+'_points', osmtable+'_points', basetable+'_junction_deviationlines']))
+
+            if harmonization_options.cutpointengine == 'numpy':
+                cutpoint_creation = 'cutpoint_creation_numpy'
+            else:
+                cutpoint_creation = 'cutpoint_creation'
+            stages.append(Stage('Creating Cutpoints for Reference-Dataset based on non-matched junction points',
+                                cutpoint_creation,
+                                (reftable, osmtable, searchradius, azimuthdifftolerance, maxcheckpointanglediff),
+                                [reftable, osmtable, osmtable+'_points'],
+                                [reftable+'_cutpoints', reftable+'_cutcheckpoints']))
+            stages.append(Stage('Creating Cutpoints for OSM-Dataset based on non-matched junction points',
+                                cutpoint_creation,
+                                (osmtable, reftable, searchradius, azimuthdifftolerance, maxcheckpointanglediff),
+                                [osmtable, reftable, reftable+'_points'],
+                                [osmtable+'_cutpoints', osmtable+'_cutcheckpoints']))
+
+            stages.append(Stage('Splitting Reference Lines with Reference Cutpoints', 'linesplit_with_cutpoints',
+                                (reftable, ref_out_table, keepcolumns_t1),
+                                [reftable, reftable+'_cutpoints'], [ref_out_table]))
+            stages.append(Stage('Splitting OSM Lines with OSM Cutpoints', 'linesplit_with_cutpoints',
+                                (osmtable, osm_out_table, keepcolumns_t2),
+                                [osmtable, osmtable+'_cutpoints'], [osm_out_table]))
         else:
-            yield 'No harmonization'
             #self.noharmonization(reftable, ref_out_table, keepcolumns_t1, streetnamecol)
             #self.noharmonization(osmtable, osm_out_table, keepcolumns_t2, 'name')
-            #: Clean datasets if options are True
-            if harmonization_options.cleanref:
-                yield 'Cleaning Reference Dataset'
-                self.clean_dataset(reftable, harmonization_options.cleanrefradius, streetnamecol, keepcolumns_t1)
-                reftable += '_corrected'
-                streetnamecol = 'name'
-            if harmonization_options.cleanosm:
-                yield 'Cleaning OSM Dataset'
-                self.clean_dataset(osmtable, harmonization_options.cleanosmradius, 'name', keepcolumns_t2)
-                osmtable += '_corrected'
             #: Presplit queries for reference lines
             if harmonization_options.presplitref:
-                yield 'Presplitting Reference Lines'
-                self.presplit_dataset(reftable, ref_out_table, keepcolumns_t1, streetnamecol)
-                #reftable += '_presplitted'
+                stages.append(Stage('Presplitting Reference Lines', 'presplit_dataset',
+                                    (reftable, ref_out_table, keepcolumns_t1, streetnamecol, False),
+                                    [reftable], [ref_out_table]))
             if harmonization_options.presplitosm:
-                yield 'Presplitting OSM Lines'
-                self.presplit_dataset(osmtable, osm_out_table, keepcolumns_t2, 'name')
-                #osmtable += '_presplitted'
+                stages.append(Stage('Presplitting OSM Lines', 'presplit_dataset',
+                                    (osmtable, osm_out_table, keepcolumns_t2, 'name', False),
+                                    [osmtable], [osm_out_table]))
+
+        #: Resource budgets of the stages
+        profile = work_mem_profiles.get(harmonization_options.work_mem_profile, {})
+        for stage in stages:
+            stage.statement_timeout = harmonization_options.statement_timeout
+            stage.work_mem = profile.get(stage.method, profile.get(None))
+
+        runner = self.run_stages(stages)
+        try:
+            for message in runner:
+                yield message
+        except StageAborted as e:
+            if harmonization_options.retention == 'drop':
+                self.drop_intermediates(basetable)
+            self.connection.commit()
+            self.close_connection(self.connection)
+            yield 'Error: '+str(e)
+            return
+        except GeneratorExit:
+            runner.close()
+            self.close_connection(self.connection)
+            raise
+        except Exception:
+            if harmonization_options.retention == 'drop':
+                self.connection.rollback()
+                self.drop_intermediates(basetable)
+                self.connection.commit()
+            raise
+        if harmonization_options.retention in ('drop', 'failed'):
+            self.drop_intermediates(basetable)
         self.connection.commit()
-        self.connection.close()
+        self.close_connection(self.connection)
+
+    def partition_tiles(self, tilebase, reftable, osmtable, n, buffer):
+        """Divides the extent of two tables into n x n tiles, every line is owned by the tile containing its
+        ST_PointOnSurface. For each tile the lines within buffer of the extent of its owned lines are copied into the
+        tile tables <tilebase><tile>_ref and <tilebase><tile>_osm (with the column odf_owned).
+        Returns the list of the tiles with the extent of their owned lines and a function, which returns the sql
+        expression of the tile owning a geometry, or None, if both tables are empty.
+
+        :param tilebase: the prefix of the tile tables
+        :param reftable: the reference table
+        :param osmtable: the osm table
+        :param n: the number of tiles per axis
+        :param buffer: the distance around the owned lines of a tile, whose lines are copied into its tile tables
+        """
+        cursor = self.cursor
+        query = ('SELECT ST_XMin(e), ST_YMin(e), ST_XMax(e), ST_YMax(e), '
+                 '(SELECT ST_SRID(geom) FROM '+reftable+' WHERE geom IS NOT NULL LIMIT 1) '
+                 'FROM (SELECT ST_Extent(geom) AS e FROM (SELECT geom FROM '+reftable+' UNION ALL '
+                 'SELECT geom FROM '+osmtable+') AS g) AS ext;')
+        cursor.execute(query)
+        xmin, ymin, xmax, ymax, srid = cursor.fetchone()
+        if xmin is None:
+            return None
+        width = (xmax-xmin)/n or 1.0
+        height = (ymax-ymin)/n or 1.0
+
+        def tile_sql(geom):
+            #: Index of the tile containing the point on surface of a geometry
+            return ('(LEAST(floor((ST_X(ST_PointOnSurface('+geom+'))-%r)/%r)::integer, %d)*%d + '
+                    'LEAST(floor((ST_Y(ST_PointOnSurface('+geom+'))-%r)/%r)::integer, %d))'
+                    % (xmin, width, n-1, n, ymin, height, n-1))
+
+        query = ('SELECT tile, ST_XMin(e), ST_YMin(e), ST_XMax(e), ST_YMax(e) '
+                 'FROM (SELECT '+tile_sql('geom')+' AS tile, ST_Extent(geom) AS e '
+                 'FROM (SELECT geom FROM '+reftable+' UNION ALL SELECT geom FROM '+osmtable+') AS g '
+                 'WHERE geom IS NOT NULL GROUP BY 1) AS tiles WHERE tile IS NOT NULL ORDER BY tile;')
+        cursor.execute(query)
+        extents = cursor.fetchall()
 
-    def linematch_datasets(self, linematch_options):
-        """Simple Line Matching method to find nearly same Features in both datasets.
-        In the first stage of line matching, for each feature in the reference dataset up to numneighbours(10)
-        potential neighbours in the osm dataset, based on parameters such as length and area are selected.
-        The selection based on length and area is fast, but not precise or significant
-        In the second stage, more meaningful parameters are used to decide whether a feature exists in both datasets
-        or not, those parameters are st_hausdorffdistance and the mean positional difference of points of the features
-        The calculation of the mean positional difference is not fast but the most significant in the matching process;
-        for the best result, it should be used in both ways ref-osm, osm-ref
-        The PostGIS st_hausdorffdistance is not a real Hausdorffdistance
-        (see http://postgis.refractions.net/docs/ST_HausdorffDistance.html),
-        it's the maximum distance between the points of two features
+        for tile, x0, y0, x1, y1 in extents:
+            for table, suffix in ((reftable, ref_suffix), (osmtable, osm_suffix)):
+                tiletable = tilebase+str(tile)+suffix
+                query = 'DROP TABLE IF EXISTS '+tiletable+';'
+                cursor.execute(query)
+                query = ('CREATE UNLOGGED TABLE '+tiletable+' AS SELECT t.*, '+tile_sql('t.geom')+' = '+str(tile)+' '
+                         'AS odf_owned FROM '+table+' t '
+                         'WHERE t.geom && ST_MakeEnvelope(%r, %r, %r, %r, %d);'
+                         % (x0-buffer, y0-buffer, x1+buffer, y1+buffer, srid))
+                cursor.execute(query)
+                self.register_intermediate(tiletable)
+                self.finish_table(tiletable)
+        return extents, tile_sql
 
-        :param linematch_options: an object of the LinematchOptions Class is used to hold all necessary options for
-         the linematching process, see the documentation on the LinematchOptions Class
+    def create_task_queue(self, cursor=None):
+        """Creates the queue of the tile tasks, if it doesn't exist yet. A task stays pending until a worker finished
+        it, a worker claims a task by locking its row (see claim_task), so the task of a worker which dies (and with
+        it its connection) returns to the queue.
+
+        :param cursor: the cursor to use, the cursor of the deviation finder if None
+        """
+        if cursor is None:
+            cursor = self.cursor
+        query = ('CREATE TABLE IF NOT EXISTS '+task_table+' (id bigserial PRIMARY KEY, run varchar, kind varchar, '
+                 'tile integer, options text, state varchar DEFAULT \'pending\', worker varchar, error text, '
+                 'created timestamp DEFAULT now(), finished timestamp);')
+        cursor.execute(query)
+
+    def enqueue_tasks(self, run, kind, tasks):
+        """Replaces the unclaimed tasks of a run with new tasks and returns their ids. Tasks of the run, which are
+        claimed by a worker, are left to it.
+
+        :param run: the name of the run, eg. the basetable of the deviation map
+        :param kind: 'harmonize' or 'linematch'
+        :param tasks: a list of (tile, options) tuples, the options are the HarmonizeOptions or LinematchOptions
+        object of the tile
+        """
+        cursor = self.cursor
+        self.create_task_queue(cursor)
+        query = ('DELETE FROM '+task_table+' WHERE id IN (SELECT id FROM '+task_table+' '
+                 'WHERE run = %s AND kind = %s FOR UPDATE SKIP LOCKED);')
+        cursor.execute(query, (run, kind))
+        ids = []
+        for tile, options in tasks:
+            query = 'INSERT INTO '+task_table+' (run, kind, tile, options) VALUES (%s, %s, %s, %s) RETURNING id;'
+            cursor.execute(query, (run, kind, tile, json.dumps(options.__dict__)))
+            ids.append(cursor.fetchone()[0])
+        return ids
+
+    def claim_task(self, connection, run=None, kind=None):
+        """Claims the oldest pending task, which isn't claimed by another worker, and returns it as a dictionary
+        (id, run, kind, tile and options) or None, if there is no such task. The row of the task stays locked by the
+        open transaction of the connection until finish_task is called.
+
+        :param connection: the connection of the worker, used for nothing else while the task runs
+        :param run: only claim tasks of this run
+        :param kind: only claim tasks of this kind
+        """
+        cursor = connection.cursor()
+        self.create_task_queue(cursor)
+        connection.commit()
+        query = 'SELECT id, run, kind, tile, options FROM '+task_table+' WHERE state = \'pending\''
+        args = []
+        if run is not None:
+            query += ' AND run = %s'
+            args.append(run)
+        if kind is not None:
+            query += ' AND kind = %s'
+            args.append(kind)
+        query += ' ORDER BY id LIMIT 1 FOR UPDATE SKIP LOCKED;'
+        cursor.execute(query, args)
+        row = cursor.fetchone()
+        if row is None:
+            connection.rollback()
+            return None
+        return {'id': row[0], 'run': row[1], 'kind': row[2], 'tile': row[3], 'options': json.loads(row[4])}
+
+    def finish_task(self, connection, task, worker=None, error=None):
+        """Reports the result of a claimed task and releases its row
+
+        :param connection: the connection, which claimed the task
+        :param task: the task returned by claim_task
+        :param worker: the name of the worker
+        :param error: the error message, if the task failed
+        """
+        cursor = connection.cursor()
+        query = ('UPDATE '+task_table+' SET state = %s, worker = %s, error = %s, finished = now() '
+                 'WHERE id = %s;')
+        cursor.execute(query, ('failed' if error is not None else 'done', worker, error, task['id']))
+        connection.commit()
+
+    def run_task(self, task):
+        """Runs the stages of a claimed tile task with the options of the tile and returns None or the error message
+
+        :param task: the task returned by claim_task
+        """
+        if task['kind'] == 'harmonize':
+            options = HarmonizeOptions('')
+            progress = self.harmonize_datasets
+        elif task['kind'] == 'linematch':
+            options = LinematchOptions('')
+            progress = self.linematch_datasets
+        else:
+            return 'Error: Unknown task kind '+str(task['kind'])
+        options.__dict__.update(task['options'])
+        error = None
+        try:
+            for message in progress(options):
+                if message.startswith('Error'):
+                    error = message
+        except Exception as e:
+            error = 'Error: '+str(e)
+            if self.connection is not None:
+                self.close_connection(self.connection)
+        return error
+
+    def work_tasks(self, worker=None, run=None, kind=None):
+        """Claims and runs tasks until there are no more pending tasks or the run is cancelled (see RunHandle).
+        Returns the number of tasks run.
+
+        :param worker: the name of the worker, stored with the results of the tasks
+        :param run: only run tasks of this run
+        :param kind: only run tasks of this kind
+        """
+        connection = psycopg2.connect(self.dbconnectioninfo_psycopg)
+        #: Local workers share the handle of their run, a worker process gets a new handle for every task
+        shared = self.handle
+        count = 0
+        try:
+            while shared is None or not shared.cancelled():
+                task = self.claim_task(connection, run, kind)
+                if task is None:
+                    break
+                if shared is None:
+                    self.handle = RunHandle(self.dbconnectioninfo_psycopg)
+                error = self.run_task(task)
+                self.finish_task(connection, task, worker, error)
+                count += 1
+        finally:
+            self.handle = shared
+            connection.close()
+        return count
+
+    def run_tasks(self, run, kind, tasks, workers, interval=1.0):
+        """Enqueues the tile tasks of a run, runs them with the given number of local workers (threads sharing the
+        handle of the run) and waits until all tasks are finished. External worker processes (see worker.py), also
+        on other machines, claim tasks from the same queue, with workers=0 the tasks are only run by them.
+        Yields a progress event for every finished task and an error message, if a task failed or the run was
+        cancelled. If a task fails, the run is cancelled (see RunHandle) or the generator is closed, the unclaimed
+        tasks are cancelled.
+
+        :param run: the name of the run, eg. the basetable of the deviation map
+        :param kind: 'harmonize' or 'linematch'
+        :param tasks: a list of (tile, options) tuples, see enqueue_tasks
+        :param workers: the number of local workers
+        :param interval: the polling interval in seconds
+        """
+        ids = self.enqueue_tasks(run, kind, tasks)
+        #: The tasks (and the tile tables) have to be visible to the workers
+        self.connection.commit()
+        if self.handle is None:
+            self.handle = RunHandle(self.dbconnectioninfo_psycopg)
+
+        def work(name):
+            worker = OSMDeviationfinder(self.dbconnectioninfo_psycopg)
+            worker.handle = self.handle
+            worker.work_tasks(name, run, kind)
+
+        threads = []
+        for i in xrange(min(int(workers), len(tasks))):
+            thread = threading.Thread(target=work, args=('local-'+str(i),))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+
+        cursor = self.cursor
+        finished = 0
+        error = None
+        try:
+            while True:
+                #: A cancelled run cancels its unclaimed tasks (the local workers stop claiming them, external workers
+                #: would still run them) and only waits for the claimed tasks. A claimed task stays pending while its
+                #: row is locked by its worker (so the task of a dead worker returns to the queue), the remaining
+                #: pending tasks are the claimed ones
+                if self.handle.cancelled():
+                    if error is None:
+                        error = 'Error: cancelled'
+                    self.cancel_tasks(ids)
+                query = 'SELECT id, state, tile, error FROM '+task_table+' WHERE id = ANY(%s) ORDER BY id;'
+                cursor.execute(query, (ids,))
+                rows = cursor.fetchall()
+                self.connection.commit()
+                done = [row for row in rows if row[1] != 'pending']
+                for row in done:
+                    if row[1] == 'failed' and error is None:
+                        error = 'Error: Tile '+str(row[2])+' failed: '+str(row[3])
+                        self.cancel_tasks(ids)
+                while finished < len(done):
+                    finished += 1
+                    yield self.progress('Finished tile '+str(finished)+' of '+str(len(ids)), finished, len(ids),
+                                        kind+'_tile', done=True)
+                if len(done) == len(rows):
+                    break
+                time.sleep(interval)
+        except GeneratorExit:
+            #: The client is gone, stop the local tiles and the unclaimed tasks
+            self.handle.cancel()
+            self.cancel_tasks(ids)
+            raise
+        for thread in threads:
+            thread.join()
+        if error is not None:
+            yield error
+
+    def cancel_tasks(self, ids):
+        """Cancels the unclaimed tasks of a list of tasks, claimed tasks are left to their workers
+
+        :param ids: the ids of the tasks
+        """
+        query = ('UPDATE '+task_table+' SET state = \'cancelled\', finished = now() WHERE id IN '
+                 '(SELECT id FROM '+task_table+' WHERE id = ANY(%s) AND state = \'pending\' FOR UPDATE SKIP LOCKED);')
+        self.cursor.execute(query, (ids,))
+        self.connection.commit()
+
+    def harmonize_datasets_tiled(self, harmonization_options):
+        """Tile-partitioned version of harmonize_datasets. The datasets are partitioned into tiles (see
+        partition_tiles) with a buffer of 2*searchradius, the tile tables are harmonized independently as tasks of
+        the task queue, by local workers and external worker processes, see run_tasks.
+        Finally the parts of the owned lines and the junction deviation lines of the owned reference junctions are
+        stitched into the result tables, so lines crossing tile borders are only taken from the tile owning them.
+
+        :param harmonization_options: an object of the HarmonizeOptions Class, see harmonize_datasets
         """
+        basetable = harmonization_options.basetable
+        reftable = harmonization_options.reftable
+        osmtable = harmonization_options.osmtable
+        ref_out_table = basetable+ref_suffix+harmonization_options.outsuffix
+        osm_out_table = basetable+osm_suffix+harmonization_options.outsuffix
+        n = int(harmonization_options.tiles)
+        buffer = 2*float(harmonization_options.searchradius)
+
+        self.connection = psycopg2.connect(self.dbconnectioninfo_psycopg)
+        self.cursor = self.connection.cursor()
+        cursor = self.cursor
+
+        yield self.progress('Partitioning the datasets into tiles', stage='partition')
+        partition = self.partition_tiles(basetable+'_tile', reftable, osmtable, n, buffer)
+        if partition is None:
+            self.close_connection(self.connection)
+            yield 'Error: No features to harmonize!'
+            return
+        extents, tile_sql = partition
+        #: The topology registry has to exist for the workers
+        self.create_topology_registry()
+
+        tasks = []
+        for extent in extents:
+            tile_options = copy.copy(harmonization_options)
+            tile_options.basetable = basetable+'_tile'+str(extent[0])
+            tile_options.reftable = tile_options.basetable+ref_suffix
+            tile_options.osmtable = tile_options.basetable+osm_suffix
+            tile_options.keepcolumns_t1 = dict(harmonization_options.keepcolumns_t1, odf_owned='boolean')
+            tile_options.keepcolumns_t2 = dict(harmonization_options.keepcolumns_t2, odf_owned='boolean')
+            tile_options.tiles = 1
+            #: The intermediates of the tiles are dropped once, after stitching, never by a finishing tile
+            tile_options.retention = 'keep'
+            tasks.append((extent[0], tile_options))
+
+        try:
+            for message in self.run_tasks(basetable, 'harmonize', tasks, harmonization_options.workers):
+                yield message
+                if message.startswith('Error'):
+                    if harmonization_options.retention == 'drop':
+                        for extent in extents:
+                            self.drop_intermediates(basetable+'_tile'+str(extent[0]))
+                        self.connection.commit()
+                    self.close_connection(self.connection)
+                    return
+        except GeneratorExit:
+            self.close_connection(self.connection)
+            raise
+
+        yield self.progress('Stitching the tiles', stage='stitch')
+        for out_table, table, suffix, keepcolumns in ((ref_out_table, reftable, ref_suffix,
+                                                       harmonization_options.keepcolumns_t1),
+                                                      (osm_out_table, osmtable, osm_suffix,
+                                                       harmonization_options.keepcolumns_t2)):
+            version = self.new_version(out_table)
+            self.create_split_table(version, table, keepcolumns)
+            columns = 'old_id, sub_id, name, direction, startazimuth, endazimuth, canon_direction, loglength, geom'
+            for k in keepcolumns:
+                columns += ', ' + k
+            query = ('INSERT INTO '+version+' ('+columns+') '
+                     + ' UNION ALL '.join('SELECT '+columns+' FROM '+basetable+'_tile'+str(extent[0])+suffix
+                                          + harmonization_options.outsuffix+' WHERE odf_owned' for extent in extents)
+                     + ';')
+            cursor.execute(query)
+            self.finish_table(version, split_indexes)
+            self.publish_table(out_table, version)
+
+        #: Junction deviation lines start at the reference junction, the tile of that junction owns the line
+        query = 'DROP TABLE IF EXISTS '+basetable+'_junction_deviationlines;'
+        cursor.execute(query)
+        query = ('CREATE TABLE '+basetable+'_junction_deviationlines AS '
+                 + ' UNION ALL '.join('SELECT geom FROM '+basetable+'_tile'+str(extent[0])+'_junction_deviationlines '
+                                      'WHERE '+tile_sql('st_startpoint(geom)')+' = '+str(extent[0])
+                                      for extent in extents)
+                 + ';')
+        cursor.execute(query)
+        rows = cursor.rowcount
+        for extent in extents:
+            if harmonization_options.retention in ('drop', 'failed'):
+                self.drop_intermediates(basetable+'_tile'+str(extent[0]))
+            if not DEBUG:
+                self.drop_tables_like(basetable+'_tile'+str(extent[0])+'_')
+        self.connection.commit()
+        self.close_connection(self.connection)
+        yield self.progress('Stitching the tiles finished', stage='stitch', rows=rows, done=True)
+
+    def candidate_generation(self, table1, table2, searchradius, minmatchingfeatlen, maxlengthdiffratio, maxanglediff,
+                             maxpotentialmatches, cursor=None, stats=False, indexed=None):
+        """Creates the temporary table potentialmatches (t1_id, t2_id) with the matching candidates: for every
+        feature of table1 up to maxpotentialmatches (at most max_potential_matches) nearest features of table2, which
+        satisfy all candidate predicates (see candidate_predicates). The indexed range predicates are used, if both
+        tables have the columns canon_direction and loglength (split tables created before they were added don't).
+
+        Returns the statistics of the candidate generation as a dictionary: the number of candidates and reference
+        features, the cap, the seconds taken and the histogram of the candidates per reference feature
+        ({candidates: features}). If stats is True, it contains the remaining pairs after each predicate and the cap
+        ('remaining', starting with all pairs) and the ratio of the pairs pruned by each of them ('pruned') too.
+
+        :param table1: the reference table
+        :param table2: the osm table
+        :param searchradius: see candidate_predicates
+        :param minmatchingfeatlen: see candidate_predicates
+        :param maxlengthdiffratio: see candidate_predicates
+        :param maxanglediff: see candidate_predicates
+        :param maxpotentialmatches: the max. number of candidates per reference feature
+        :param cursor: the cursor to use, the cursor of the deviation finder if None
+        :param stats: measure the pruning ratio of the predicates
+        :param indexed: use the indexed range predicates, None to use them if both tables have their columns
+        """
+        if cursor is None:
+            cursor = self.cursor
+        if indexed is None:
+            indexed = (self.has_columns(table1, split_indexes, cursor=cursor) and
+                       self.has_columns(table2, split_indexes, cursor=cursor))
+        start = time.time()
+        predicates = candidate_predicates(searchradius, minmatchingfeatlen, maxlengthdiffratio, maxanglediff, indexed)
+        limit = min(int(maxpotentialmatches), max_potential_matches)
+        query = ('create temp table potentialmatches on commit drop as '
+                 + candidate_sql(table1, table2, predicates, limit)+';')
+        cursor.execute(query)
+        result = {'candidates': cursor.rowcount, 'limit': limit, 'indexed': indexed}
+        #: Temporary tables are never analyzed by autovacuum, without statistics the planner assumes a default row
+        #: count for the joins of the following queries
+        self.finish_table('potentialmatches', ['t1_id', 't2_id'], False, cursor)
+        result['seconds'] = time.time()-start
+
+        query = ('SELECT n, count(*) FROM (SELECT t1.id, count(p.t2_id) AS n FROM '+table1+' t1 '
+                 'LEFT JOIN potentialmatches p ON p.t1_id = t1.id GROUP BY t1.id) AS c GROUP BY n ORDER BY n;')
+        cursor.execute(query)
+        result['histogram'] = dict(cursor.fetchall())
+        result['features'] = sum(result['histogram'].values())
+        if not stats:
+            return result
+
+        query = ('SELECT (SELECT count(*) FROM '+table1+')*(SELECT count(*) FROM '+table2+'), count(*)'
+                 + ''.join(', sum(CASE WHEN '+' AND '.join(sql for name, sql in predicates[1:i+1])+' THEN 1 ELSE 0 END)'
+                           for i in xrange(1, len(predicates)))
+                 + ' FROM '+table1+' t1 JOIN '+table2+' t2 ON '+predicates[0][1]+';')
+        cursor.execute(query)
+        counts = [int(c or 0) for c in cursor.fetchone()] + [result['candidates']]
+        names = ['pairs'] + [name for name, sql in predicates] + ['maxpotentialmatches']
+        result['remaining'] = zip(names, counts)
+        result['pruned'] = [(names[i], 1.0-float(counts[i])/counts[i-1] if counts[i-1] else 0.0)
+                            for i in xrange(1, len(counts))]
+        return result
+
+    def positional_deviation(self, table1, table2, reverse, segmentlength, cursor=None, pairs='potentialmatches',
+                             bounded=False, maxpoints=None):
+        """Creates the temporary table posdev_t1 (t1_id, t2_id, diff) with the mean positional difference of the
+        reference line to the osm line of every pair: the mean distance of the points of the reference line,
+        segmentized with segmentlength, to the osm line. If reverse is True, the table posdev_t2 (t2_id, t1_id, diff)
+        with the mean distance of the points of the osm line to the reference line is created.
+        The sql aggregate can't stop early, so the limits of bounded pairs are ignored, see positional_deviation_numpy.
+
+        :param table1: the reference table
+        :param table2: the osm table
+        :param reverse: calculate the differences of the osm lines
+        :param segmentlength: the interval of the points along the lines
+        :param cursor: the cursor to use, the cursor of the deviation finder if None
+        :param pairs: a table or subquery with the pairs (t1_id, t2_id)
+        :param bounded: pairs has a column maxdiff with the max. difference of each pair
+        :param maxpoints: the max. number of points per line of adaptive sampling, None for fixed sampling, see
+        sample_points_sql
+        """
+        if cursor is None:
+            cursor = self.cursor
+        if reverse:
+            query = ('create temp table posdev_t2 on commit drop  as '
+                     '(SELECT n.t2_id, n.t1_id, (sum(ST_Distance(t2p.geom,t1.geom))/count(t2p.id)) as diff '
+                     'FROM '+pairs+' n, '
+                     +sample_points_sql(table2, segmentlength, maxpoints)+' t2p, '+table1+' t1 '
+                     'WHERE n.t2_id = t2p.id and n.t1_id = t1.id '
+                     'GROUP BY n.t2_id, n.t1_id);')
+            cursor.execute(query)
+            self.finish_table('posdev_t2', ['t2_id'], False, cursor)
+        else:
+            query = ('create temp table posdev_t1 on commit drop as '
+                     '(SELECT n.t1_id, n.t2_id,(sum(ST_Distance(t1p.geom,t2.geom))/count(t1p.id)) as diff '
+                     'FROM '+pairs+' n, '
+                     +sample_points_sql(table1, segmentlength, maxpoints)+' t1p, '+table2+' t2 '
+                     'WHERE n.t1_id = t1p.id and n.t2_id = t2.id GROUP BY n.t1_id, n.t2_id);')
+            cursor.execute(query)
+            self.finish_table('posdev_t1', ['t1_id'], False, cursor)
+
+    def positional_deviation_numpy(self, lines1, lines2, reverse, segmentlength, cursor=None,
+                                   pairs='potentialmatches', bounded=False, processes=1, maxpoints=None):
+        """Vectorized alternative to positional_deviation with the same result tables. The lines of the candidates
+        are given as LineArrays, the points of the segmentized source lines are projected onto the target lines of
+        all pairs in batches (see LineArrays.mean_distances) and the mean distances are bulk loaded with COPY.
+        Pairs with a line without geometry (or with less than two vertices) get no difference, like in the sql
+        version. If bounded is True, a pair is abandoned as soon as the lower bound of its difference exceeds its
+        maxdiff, abandoned pairs get no difference either.
+
+        Returns the number of abandoned pairs.
+
+        :param lines1: the LineArrays of the reference lines of the pairs
+        :param lines2: the LineArrays of the osm lines of the pairs
+        :param reverse: calculate the differences of the osm lines, see positional_deviation
+        :param segmentlength: the interval of the points along the lines
+        :param cursor: the cursor to use, the cursor of the deviation finder if None
+        :param pairs: a table or subquery with the pairs (t1_id, t2_id)
+        :param bounded: pairs has a column maxdiff with the max. difference of each pair
+        :param processes: if not 1, the pairs are partitioned by reference line among this number of processes (0 for
+        the number of cpus), see parallel_mean_distances
+        :param maxpoints: the max. number of points per line of adaptive sampling, None for fixed sampling, see
+        LineArrays.sample
+        """
+        if np is None:
+            raise ImportError('The numpy positional difference engine needs numpy, install it or use the sql engine')
+        if cursor is None:
+            cursor = self.cursor
+        if reverse:
+            table, columns = 'posdev_t2', ['t2_id', 't1_id']
+            sources, targets = lines2, lines1
+        else:
+            table, columns = 'posdev_t1', ['t1_id', 't2_id']
+            sources, targets = lines1, lines2
+        query = ('create temp table '+table+' ('+columns[0]+' integer, '+columns[1]+' integer, '
+                 'diff double precision) on commit drop;')
+        cursor.execute(query)
+
+        query = ('SELECT n.'+columns[0]+', n.'+columns[1]+(', n.maxdiff' if bounded else ', NULL')+' '
+                 'FROM '+pairs+' n WHERE n.t2_id IS NOT NULL;')
+        cursor.execute(query)
+        pairs = [(sources.index[s], targets.index[t], maxdiff) for s, t, maxdiff in cursor.fetchall()
+                 if s in sources.index and t in targets.index]
+        abandoned = 0
+        if pairs:
+            limits = np.array([maxdiff for s, t, maxdiff in pairs], dtype=np.float64) if bounded else None
+            pairs = np.array([(s, t) for s, t, maxdiff in pairs], dtype=np.int64)
+            if maxpoints is None:
+                points, offsets = sources.segmentize(float(segmentlength))
+            else:
+                points, offsets = sources.sample(float(segmentlength), maxpoints)
+            if processes == 1:
+                diffs = targets.mean_distances(points, offsets, pairs[:, 0], pairs[:, 1], limits)
+            else:
+                diffs = parallel_mean_distances(targets, points, offsets, pairs[:, 0], pairs[:, 1], limits,
+                                                pairs[:, 1 if reverse else 0], processes)
+            kept = ~np.isnan(diffs)
+            abandoned = len(diffs) - int(kept.sum())
+            copy_rows(cursor, table, columns + ['diff'], zip(sources.ids[pairs[kept, 0]].tolist(),
+                                                            targets.ids[pairs[kept, 1]].tolist(),
+                                                            diffs[kept].tolist()))
+        self.finish_table(table, columns[:1], False, cursor)
+        return abandoned
+
+    def matching_parameters(self, linematch_options, steps, cursor=None):
+        """Creates the temporary table matchingparameters with the matching parameters of the potential matches,
+        which are within the limits of the linematching (see linematch_datasets), and yields the progress messages
+        of its steps.
+
+        :param linematch_options: the LinematchOptions of the linematching
+        :param steps: the number of progress steps of the linematching
+        :param cursor: the cursor to use, the cursor of the deviation finder if None
+        """
+        if cursor is None:
+            cursor = self.cursor
 
         #: Shorter parameters
-        basetable = linematch_options.basetable
         table1 = linematch_options.reftable
         table2 = linematch_options.osmtable
         minmatchingfeatlen = str(linematch_options.minmatchingfeatlen)
@@ -1392,87 +3681,32 @@ class OSMDeviationfinder(object):
         maxmeanposdevtolength = str(linematch_options.maxmeanposdevtolength)
         minmeanposdevtolength = str(linematch_options.minmeanposdevtolength)
         maxabsolutmeanposdev = str(linematch_options.maxabsolutmeanposdev)
-        keepcolumns_t1 = linematch_options.keepcolumns_t1
-        keepcolumns_t2 = linematch_options.keepcolumns_t2
-
-        #: Build strings for columns that should be included in linematch result table
-        kc_str3 = ''
-        for k in keepcolumns_t1:
-            kc_str3 += ', t1.' + k
-        for k in keepcolumns_t2:
-            kc_str3 += ', t2.' + k
-
-        connection = psycopg2.connect(self.dbconnectioninfo_psycopg)
-        cursor = connection.cursor()
-
-        #: Recreating tables if they already exist
-        query = 'drop table if exists '+basetable+'_result;'
-        cursor.execute(query)
-
-        query = ('CREATE TABLE '+basetable+'_result (id bigserial PRIMARY KEY, fit double precision, '
-                 'meandev double precision, old_id integer,sub_id integer, osmsource bigint, refsource bigint, '
-                 'name varchar, matchname varchar);')
-        cursor.execute(query)
-
-        query = ('SELECT addGeometryColumn(\''+basetable+'_result\',\'geom\','
-                 '(SELECT ST_SRID(geom) as srid FROM '+basetable+
-                 '_ref WHERE geom IS NOT NULL LIMIT 1), (SELECT geometrytype(geom) '
-                 'FROM '+table1+' limit 1), 2);')
-        cursor.execute(query)
 
         #: Create list with n potential matching-partners of table2 for each feature of table1 using the fast definable
         #: parameters: searchradius, maxlengthdiffratio and maxanglediff
-        yield 'Creating potential matching features table'
-        query = ('create temp table potentialmatches on commit drop as '
-                 'WITH subq AS ('
-                 'SELECT t1.id as t1_id, '
-                 'unnest(ARRAY(SELECT t2.id '
-                 'FROM '+table2+' t2 '
-                 'WHERE ST_DWithin(t1.geom, t2.geom,'+searchradius+') '
-                 'and st_length(t1.geom)>'+minmatchingfeatlen+' or st_length(t2.geom)>'+minmatchingfeatlen+' '
-                 'and greatest(st_length(t1.geom),st_length(t2.geom))/least(st_length(t1.geom), st_length(t2.geom)) < '
-                 +maxlengthdiffratio+' and abs((abs((t1.direction - t2.direction))+'+maxanglediff+') % '+pi+' - '
-                 +maxanglediff+')<'+maxanglediff+' ORDER BY t1.geom <-> t2.geom LIMIT '+maxpmatches+')) as t2_id '
-                 'FROM '+table1+' t1) SELECT * FROM subq;')
-        cursor.execute(query)
-
-        #: Positional differences are distances from points along a line in a given interval to the closest points of
-        #: another line. The calculation is asymmetrical, therefore the calculations are done in both ways and the
-        #: mean value is then used as the mean positional difference.
-        #: Calculate the positional differences between the features in potentialmatches for table1 features as source
-        yield 'Calculating positional differences for reference lines'
-        query = ('create temp table posdev_t1 on commit drop as '
-                 '(SELECT n.t1_id, n.t2_id,(sum(ST_Distance(t1p.geom,t2.geom))/count(t1p.id)) as diff '
-                 'FROM potentialmatches n, '
-                 '(SELECT (st_dumppoints(st_segmentize(t1.geom,'+pdiffseglen+'))).geom, t1.id '
-                 'FROM '+table1+' t1) t1p, '+table2+' t2 '
-                 'WHERE n.t1_id = t1p.id and n.t2_id = t2.id GROUP BY n.t1_id, n.t2_id);')
-        cursor.execute(query)
-
-        #: Calculate the positional differences between the features in potentialmatches for table2 features as source
-        yield 'Calculating positional differences for osm lines'
-        query = ('create temp table posdev_t2 on commit drop  as '
-                 '(SELECT n.t2_id, n.t1_id, (sum(ST_Distance(t2p.geom,t1.geom))/count(t2p.id)) as diff '
-                 'FROM potentialmatches n, '
-                 '(SELECT (st_dumppoints(st_segmentize(t2.geom,'+pdiffseglen+'))).geom, t2.id '
-                 'FROM '+table2+' t2) t2p, '+table1+' t1 '
-                 'WHERE n.t2_id = t2p.id and n.t1_id = t1.id '
-                 'GROUP BY n.t2_id, n.t1_id);')
-        cursor.execute(query)
-
-        #: Calculate more expressive parameters between potential matches and insert them into table matchingparameters
-        yield 'Calculating matching parameters'
+        yield self.progress('Creating potential matching features table', 1, steps, 'potentialmatches')
+        stats = self.candidate_generation(table1, table2, searchradius, minmatchingfeatlen, maxlengthdiffratio,
+                                          maxanglediff, maxpmatches, cursor, linematch_options.candidatestats)
+        yield self.progress(candidate_summary(stats), 1, steps, 'potentialmatches', stats['candidates'], True)
+
+        #: Calculate the cheap matching parameters of the potential matches. The positional difference and the
+        #: Hausdorff distance are calculated later, only for the pairs which are still within the matching limits.
+        #: A pair passes the limits of the mean positional difference, if it is smaller than maxposdev/2 (the
+        #: least of the absolute limit and the limit relative to the length).
+        yield self.progress('Calculating matching parameters', 2, steps, 'matchingparameters', stats['candidates'])
         query = ('create temp table matchingparameters on commit drop as '
-                 'SELECT n.t1_id, n.t2_id, 0.0 as fit, '
-                 'st_hausdorffdistance(t1.geom, t2.geom,'+hausdorffseglen+') as hausdorff, '
+                 'SELECT n.t1_id, n.t2_id, 0.0 as fit, null::double precision as hausdorff, '
                  'greatest(st_length(t1.geom),st_length(t2.geom))/least(st_length(t1.geom),st_length(t2.geom)) lengthdiff,'
                  ' st_length(t1.geom)+st_length(t2.geom)/2.0 as meanlength, '
+                 'abs(t1.direction - t2.direction) as azimuthdiff, '
                  'abs((abs(t1.direction - t2.direction)+'+maxazimuthdiff+') %'+pi+' - '+maxazimuthdiff+') directiondiff,'
-                 ' ((pd_t1.diff+pd_t2.diff)/2.0) as meanposdev '
-                 'FROM '+table2+' t2, '+table1+' t1, posdev_t1 pd_t1, posdev_t2 pd_t2, potentialmatches n '
-                 'WHERE n.t1_id = t1.id and n.t2_id = t2.id and n.t1_id = pd_t1.t1_id and n.t2_id = pd_t2.t2_id '
-                 'and n.t2_id = pd_t1.t2_id and n.t1_id = pd_t2.t1_id;')
+                 ' null::double precision as meanposdev, '
+                 '2*least('+maxabsolutmeanposdev+', ('+maxmeanposdevtolength+'+'+minmeanposdevtolength+')*'
+                 '(st_length(t1.geom)+st_length(t2.geom)/2.0)) as maxposdev '
+                 'FROM '+table2+' t2, '+table1+' t1, potentialmatches n '
+                 'WHERE n.t1_id = t1.id and n.t2_id = t2.id;')
         cursor.execute(query)
+        self.finish_table('matchingparameters', ['t1_id'], False, cursor)
 
         # Posdiff with points at fixed distance on line. Deactivated because of bad results.
         # yield 'Calculating matching parameters'
@@ -1517,43 +3751,319 @@ class OSMDeviationfinder(object):
         #: empty.
 
 
-        #: All potential matching pairs, whose maxlengthdiffratio is not within the given limits, are eliminated
-        yield 'Deleting potential matches which are outside matching limits'
-        query = ('DELETE FROM matchingparameters using '
-                 '(SELECT matchingparameters.t1_id, matchingparameters.t2_id, matchingparameters.meanposdev '
-                 'FROM matchingparameters '
-                 'WHERE matchingparameters.lengthdiff>'+maxlengthdiffratio+') as DELETElist '
-                 'WHERE DELETElist.t1_id = matchingparameters.t1_id and DELETElist.t2_id = matchingparameters.t2_id '
-                 'and DELETElist.meanposdev = matchingparameters.meanposdev;')
+        #: All potential matching pairs, whose maxlengthdiffratio or azimuthdiff is not within the given limits, are
+        #: eliminated before the expensive parameters are calculated. A tuning run keeps all pairs.
+        prune = not linematch_options.tuning
+        yield self.progress('Deleting potential matches which are outside matching limits',
+                            3, steps, 'limit_lengthdiff', cursor.rowcount)
+        if prune:
+            query = ('DELETE FROM matchingparameters '
+                     'WHERE matchingparameters.lengthdiff>'+maxlengthdiffratio+' '
+                     'or matchingparameters.directiondiff>'+maxazimuthdiff+';')
+            cursor.execute(query)
+        cursor.execute('SELECT count(*) FROM matchingparameters;')
+        remaining = cursor.fetchone()[0]
+
+        #: Positional differences are distances from points along a line in a given interval to the closest points of
+        #: another line. The calculation is asymmetrical, therefore the calculations are done in both ways and the
+        #: mean value is then used as the mean positional difference. Both differences are positive, so the first
+        #: difference is a lower bound of twice the mean: pairs whose first difference exceeds maxposdev are
+        #: abandoned, the second difference is only calculated for the remaining pairs, with the rest of maxposdev
+        #: as its limit. The numpy engine abandons a pair within a direction too, see LineArrays.mean_distances.
+        numpy_engine = linematch_options.posdevengine in ('numpy', 'parallel')
+        processes = int(linematch_options.processes) if linematch_options.posdevengine == 'parallel' else 1
+        maxpoints = int(linematch_options.posdevmaxpoints) if linematch_options.posdevsampling == 'adaptive' else None
+        if numpy_engine:
+            #: The geometries of the candidates are loaded once for both directions, the parallel engine shares
+            #: them with its worker processes
+            lines1 = LineArrays.from_table(cursor, table1, 't.id IN (SELECT t1_id FROM matchingparameters)')
+            lines2 = LineArrays.from_table(cursor, table2, 't.id IN (SELECT t2_id FROM matchingparameters)')
+            if processes != 1:
+                lines1.share()
+                lines2.share()
+
+        #: Calculate the positional differences between the features in potentialmatches for table1 features as source
+        yield self.progress('Calculating positional differences for reference lines',
+                            4, steps, 'posdiff_ref', remaining)
+        pairs = '(SELECT t1_id, t2_id, maxposdev as maxdiff FROM matchingparameters)'
+        if numpy_engine:
+            self.positional_deviation_numpy(lines1, lines2, False, pdiffseglen, cursor, pairs, prune, processes,
+                                            maxpoints)
+        else:
+            self.positional_deviation(table1, table2, False, pdiffseglen, cursor, pairs, prune, maxpoints)
+
+        #: Calculate the positional differences between the features in potentialmatches for table2 features as source
+        yield self.progress('Calculating positional differences for osm lines',
+                            5, steps, 'posdiff_osm', cursor.rowcount)
+        pairs = ('(SELECT m.t1_id, m.t2_id, m.maxposdev-pd_t1.diff as maxdiff '
+                 'FROM matchingparameters m, posdev_t1 pd_t1 '
+                 'WHERE m.t1_id = pd_t1.t1_id and m.t2_id = pd_t1.t2_id'+(' and pd_t1.diff <= m.maxposdev' if prune
+                                                                           else '')+')')
+        if numpy_engine:
+            self.positional_deviation_numpy(lines1, lines2, True, pdiffseglen, cursor, pairs, prune, processes,
+                                            maxpoints)
+        else:
+            self.positional_deviation(table1, table2, True, pdiffseglen, cursor, pairs, prune, maxpoints)
+        cursor.execute('SELECT count(*) FROM posdev_t2;')
+        abandoned = remaining - cursor.fetchone()[0]
+        yield self.progress('Abandoned %d of %d pairs early by the lower bound of their positional difference'
+                            % (abandoned, remaining), 5, steps, 'posdiff_osm', abandoned, True)
+
+        #: All potential matching pairs, whose meanposdevtolengthratio and meanposdev are not within the given
+        #: limits, are eliminated, the abandoned pairs have no meanposdev
+        yield self.progress('Deleting potential matches which are outside matching limits',
+                            6, steps, 'limit_deviation', cursor.rowcount)
+        query = ('UPDATE matchingparameters set meanposdev = ((pd_t1.diff+pd_t2.diff)/2.0) '
+                 'FROM posdev_t1 pd_t1, posdev_t2 pd_t2 '
+                 'WHERE matchingparameters.t1_id = pd_t1.t1_id and matchingparameters.t2_id = pd_t1.t2_id '
+                 'and matchingparameters.t1_id = pd_t2.t1_id and matchingparameters.t2_id = pd_t2.t2_id;')
+        cursor.execute(query)
+        query = 'DELETE FROM matchingparameters WHERE matchingparameters.meanposdev IS NULL'
+        if prune:
+            query += (' or matchingparameters.meanposdev/matchingparameters.meanlength>'
+                      +maxmeanposdevtolength+'+'+minmeanposdevtolength+' or matchingparameters.meanposdev>'
+                      +maxabsolutmeanposdev)
+        cursor.execute(query+';')
+
+        #: The Hausdorff distance is only calculated for the pairs within all limits
+        yield self.progress('Calculating Hausdorff distances of the remaining pairs', 7, steps, 'hausdorff',
+                            cursor.rowcount)
+        query = ('UPDATE matchingparameters set hausdorff = '
+                 'st_hausdorffdistance(t1.geom, t2.geom,'+hausdorffseglen+') '
+                 'FROM '+table2+' t2, '+table1+' t1 '
+                 'WHERE matchingparameters.t1_id = t1.id and matchingparameters.t2_id = t2.id;')
+        cursor.execute(query)
+
+    def create_match_cache_registry(self, cursor=None):
+        """Creates the table with the keys and limits of the cached matching parameters of the maps, if it doesn't
+        exist yet"""
+        if cursor is None:
+            cursor = self.cursor
+        query = ('CREATE TABLE IF NOT EXISTS '+match_cache_table+' '
+                 '(basetable varchar PRIMARY KEY, key varchar, bounds text, reflength double precision, '
+                 'created timestamp);')
+        cursor.execute(query)
+
+    def match_cache_key(self, linematch_options, cursor=None):
+        """Returns the key of the matching parameters of a linematching: a hash of the versions of the split tables
+        (see table_version), so a new harmonization invalidates the cache, and of the parameters deciding about the
+        candidates and the sampling of the lines
+
+        :param linematch_options: the LinematchOptions of the linematching
+        :param cursor: the cursor to use, the cursor of the deviation finder if None
+        """
+        if cursor is None:
+            cursor = self.cursor
+        o = linematch_options
+        sampling = [o.posdevsampling, o.posdevmaxpoints] if o.posdevsampling == 'adaptive' else []
+        key = (self.table_version(o.reftable, cursor), self.table_version(o.osmtable, cursor),
+               [str(v) for v in [o.searchradius, o.minmatchingfeatlen, o.maxlengthdiffratio, o.maxanglediff,
+                                 o.maxpotentialmatches, o.posdiffsegmentlength, o.hausdorffsegmentlength] + sampling])
+        return hashlib.md5(repr(key)).hexdigest()
+
+    def cached_matches(self, basetable, key, bounds, cursor=None):
+        """Returns True, if the cached matching parameters of a map can be reused: they were stored with the same key
+        (see match_cache_key) and none of the current limits is looser than the limit used to build the cache. The
+        cache only holds the pairs within the limits, the pairs of tighter limits are a subset of them.
+
+        :param basetable: the basetable of the map
+        :param key: the key of the current linematching
+        :param bounds: the current limits, see match_cache_bounds
+        :param cursor: the cursor to use, the cursor of the deviation finder if None
+        """
+        if cursor is None:
+            cursor = self.cursor
+        self.create_match_cache_registry(cursor)
+        query = 'SELECT key, bounds FROM '+match_cache_table+' WHERE basetable = %s;'
+        cursor.execute(query, (basetable,))
+        row = cursor.fetchone()
+        if row is None or row[0] != key or not self.has_columns(basetable+'_matchcache', ['t1_id'], cursor=cursor):
+            return False
+        cachedbounds = json.loads(row[1])
+        return all(name in cachedbounds and (cachedbounds[name] is None or
+                                             (value is not None and value <= cachedbounds[name]))
+                   for name, value in bounds.items())
+
+    def store_match_cache(self, basetable, key, bounds, reftable, cursor=None):
+        """Stores the matching parameters of the pairs within the limits (the temporary table matchingparameters) as
+        the cache of a map, together with its key and the limits. The length (in meters) of the reference lines is
+        stored too, to evaluate limits and weights quickly, see evaluate_matching.
+
+        :param basetable: the basetable of the map
+        :param key: the key of the linematching, see match_cache_key
+        :param bounds: the limits, see match_cache_bounds
+        :param reftable: the reference table of the linematching
+        :param cursor: the cursor to use, the cursor of the deviation finder if None
+        """
+        if cursor is None:
+            cursor = self.cursor
+        self.create_match_cache_registry(cursor)
+        cursor.execute('DROP TABLE IF EXISTS '+basetable+'_matchcache;')
+        query = ('CREATE TABLE '+basetable+'_matchcache AS '
+                 'SELECT m.t1_id, m.t2_id, m.lengthdiff, m.meanlength, m.azimuthdiff, m.meanposdev, m.hausdorff, '
+                 'st_length(geometry(t1.geom)::geography) as reflength '
+                 'FROM matchingparameters m, '+reftable+' t1 WHERE m.t1_id = t1.id;')
+        cursor.execute(query)
+        cursor.execute('CREATE INDEX '+basetable+'_matchcache_t1_id ON '+basetable+'_matchcache (t1_id);')
+        cursor.execute('DELETE FROM '+match_cache_table+' WHERE basetable = %s;', (basetable,))
+        query = ('INSERT INTO '+match_cache_table+' (basetable, key, bounds, reflength, created) '
+                 'VALUES (%s, %s, %s, (SELECT sum(st_length(geometry(geom)::geography)) FROM '+reftable+'), now());')
+        cursor.execute(query, (basetable, key, json.dumps(bounds)))
+
+    def evaluate_matching(self, linematch_options):
+        """Evaluates limits and weights on the matching parameters cached by a tuning run (see LinematchOptions),
+        without calculating any parameter: the cached pairs are filtered with the limits and the best matches are
+        selected like in linematch_datasets. Returns a dictionary with the number of matches and of matched reference
+        lines, the length of the unmatched reference lines in meters, the mean deviation of the matches and the
+        seconds taken, or None if there is no cache of a tuning run or the cache is stale: its key (see
+        match_cache_key) differs from the key of the options, eg. after a new harmonization.
+
+        :param linematch_options: the LinematchOptions with the limits and weights to evaluate
+        """
+        basetable = linematch_options.basetable
+        maxazimuthdiff = str(linematch_options.maxazimuthdiff)
+        start = time.time()
+        connection = psycopg2.connect(self.dbconnectioninfo_psycopg)
+        cursor = connection.cursor()
+        try:
+            self.create_match_cache_registry(cursor)
+            query = 'SELECT key, bounds, reflength FROM '+match_cache_table+' WHERE basetable = %s;'
+            cursor.execute(query, (basetable,))
+            row = cursor.fetchone()
+            if row is None or any(v is not None for v in json.loads(row[1]).values()):
+                return None
+            if row[0] != self.match_cache_key(linematch_options, cursor):
+                return None
+            reflength = row[2] or 0.0
+            query = ('WITH m AS (SELECT c.*, '
+                     'abs((c.azimuthdiff+'+maxazimuthdiff+') %'+pi+' - '+maxazimuthdiff+') directiondiff '
+                     'FROM '+basetable+'_matchcache c), '
+                     'p AS (SELECT m.t1_id, m.t2_id, m.reflength, '+fit_sql(linematch_options, 'm')+' as fit '
+                     'FROM m WHERE NOT ('+outside_limits_sql(linematch_options, 'm')+')), '
+                     'f AS (SELECT p.* FROM p, (SELECT t1_id, min(fit) as minfit FROM p GROUP BY t1_id) b '
+                     'WHERE p.t1_id = b.t1_id and p.fit = b.minfit), '
+                     'r AS (SELECT f.* FROM f, (SELECT t2_id, min(fit) as minfit FROM f GROUP BY t2_id) o '
+                     'WHERE f.t2_id = o.t2_id and f.fit = o.minfit) '
+                     'SELECT count(*), count(DISTINCT t1_id), avg(fit/4), '
+                     '(SELECT sum(reflength) FROM (SELECT DISTINCT t1_id, reflength FROM r) d) FROM r;')
+            cursor.execute(query)
+            matches, matchedref, deviation, matchedlength = cursor.fetchone()
+        finally:
+            connection.rollback()
+            connection.close()
+        return {'matches': matches, 'matchedref': matchedref, 'meandeviation': deviation,
+                'unmatchedlength': reflength - (matchedlength or 0.0), 'seconds': time.time() - start}
+
+    def linematch_datasets(self, linematch_options):
+        """Simple Line Matching method to find nearly same Features in both datasets.
+        In the first stage of line matching, for each feature in the reference dataset up to numneighbours(10)
+        potential neighbours in the osm dataset, based on parameters such as length and area are selected.
+        The selection based on length and area is fast, but not precise or significant
+        In the second stage, more meaningful parameters are used to decide whether a feature exists in both datasets
+        or not, those parameters are st_hausdorffdistance and the mean positional difference of points of the features
+        The calculation of the mean positional difference is not fast but the most significant in the matching process;
+        for the best result, it should be used in both ways ref-osm, osm-ref
+        The PostGIS st_hausdorffdistance is not a real Hausdorffdistance
+        (see http://postgis.refractions.net/docs/ST_HausdorffDistance.html),
+        it's the maximum distance between the points of two features
+
+        :param linematch_options: an object of the LinematchOptions Class is used to hold all necessary options for
+         the linematching process, see the documentation on the LinematchOptions Class
+        """
+
+        if linematch_options.posdevengine in ('numpy', 'parallel') and np is None:
+            yield 'Error: The numpy positional difference engine needs numpy!'
+            return
+        #: A tuning run builds the cache of the whole map, which the tiles can't, so it always runs untiled
+        if int(linematch_options.tiles) > 1 and not linematch_options.tuning:
+            for message in self.linematch_datasets_tiled(linematch_options):
+                yield message
+            return
+
+        #: Shorter parameters
+        basetable = linematch_options.basetable
+        table1 = linematch_options.reftable
+        table2 = linematch_options.osmtable
+        maxazimuthdiff = str(linematch_options.maxazimuthdiff)
+        keepcolumns_t1 = linematch_options.keepcolumns_t1
+        keepcolumns_t2 = linematch_options.keepcolumns_t2
+
+        #: Build strings for columns that should be included in linematch result table
+        kc_str3 = ''
+        for k in keepcolumns_t1:
+            kc_str3 += ', t1.' + k
+        for k in keepcolumns_t2:
+            kc_str3 += ', t2.' + k
+
+        self.started = time.time()
+        #: The number of progress steps, see ProgressEvent
+        steps = 12
+
+        connection = psycopg2.connect(self.dbconnectioninfo_psycopg)
+        cursor = connection.cursor()
+        #: Queries of a cancelled run are stopped, see RunHandle
+        if self.handle is not None:
+            self.handle.attach(connection)
+
+        #: Recreating tables if they already exist
+        query = 'drop table if exists '+basetable+'_result;'
+        cursor.execute(query)
+
+        query = ('CREATE TABLE '+basetable+'_result (id bigserial PRIMARY KEY, fit double precision, '
+                 'meandev double precision, old_id integer,sub_id integer, osmsource bigint, refsource bigint, '
+                 'name varchar, matchname varchar);')
         cursor.execute(query)
 
-        #: All potential matching pairs, whose meanposdevtolengthratio, azimuthdiff and meanposdev are not within
-        #: the given limits, are eliminated
-        yield 'Deleting potential matches which are outside matching limits'
-        query = ('DELETE FROM matchingparameters using '
-                 '(SELECT matchingparameters.t1_id, matchingparameters.t2_id, matchingparameters.meanposdev '
-                 'FROM matchingparameters '
-                 'WHERE matchingparameters.meanposdev/matchingparameters.meanlength>'
-                 +maxmeanposdevtolength+'+'+minmeanposdevtolength+' or matchingparameters.directiondiff>'
-                 +maxazimuthdiff+' or matchingparameters.meanposdev>'
-                 +maxabsolutmeanposdev+') as DELETElist '
-                 'WHERE DELETElist.t1_id = matchingparameters.t1_id and DELETElist.t2_id = matchingparameters.t2_id '
-                 'and DELETElist.meanposdev = matchingparameters.meanposdev;')
+        query = ('SELECT addGeometryColumn(\''+basetable+'_result\',\'geom\','
+                 '(SELECT ST_SRID(geom) as srid FROM '+basetable+
+                 '_ref WHERE geom IS NOT NULL LIMIT 1), (SELECT geometrytype(geom) '
+                 'FROM '+table1+' limit 1), 2);')
         cursor.execute(query)
 
+        #: The expensive matching parameters (the positional difference and the Hausdorff distance) only depend on
+        #: the split tables, the candidate and sampling parameters. If the cache of the map was built with the same
+        #: ones and limits not looser than the current ones, only the cached pairs are filtered and scored again.
+        cached = False
+        usecache = linematch_options.matchcache or linematch_options.tuning
+        if usecache:
+            yield self.progress('Checking the cached matching parameters', 1, steps, 'matchcache')
+            cachekey = self.match_cache_key(linematch_options, cursor)
+            bounds = match_cache_bounds(linematch_options)
+            cached = self.cached_matches(basetable, cachekey, bounds, cursor)
+        if cached:
+            query = ('create temp table matchingparameters on commit drop as '
+                     'SELECT c.t1_id, c.t2_id, 0.0 as fit, c.hausdorff, c.lengthdiff, c.meanlength, c.azimuthdiff, '
+                     'abs((c.azimuthdiff+'+maxazimuthdiff+') %'+pi+' - '+maxazimuthdiff+') directiondiff, '
+                     'c.meanposdev FROM '+basetable+'_matchcache c;')
+            cursor.execute(query)
+            self.finish_table('matchingparameters', ['t1_id'], False, cursor)
+        else:
+            for message in self.matching_parameters(linematch_options, steps, cursor):
+                yield message
+            #: The pairs within the limits (all pairs of a tuning run) are cached with their matching parameters
+            if usecache:
+                self.store_match_cache(basetable, cachekey, bounds, table1, cursor)
+        if cached or linematch_options.tuning:
+            #: The cached pairs and the pairs of a tuning run are filtered with the current limits
+            cursor.execute('SELECT count(*) FROM matchingparameters;')
+            pairs = cursor.fetchone()[0]
+            cursor.execute('DELETE FROM matchingparameters WHERE '+outside_limits_sql(linematch_options)+';')
+            yield self.progress('%s %d matching parameters, %d are within the limits'
+                                % ('Reused the cached' if cached else 'Calculated', pairs, pairs-cursor.rowcount),
+                                7, steps, 'matchcache', pairs-cursor.rowcount, True)
+
         #: Calculation of the total deviation based on the sum of weighted parameters
-        yield 'Calculating matching pair deviation using weighted and normalized (to the limits) matching parameters'
+        yield self.progress('Calculating matching pair deviation using weighted and normalized (to the limits) '
+                            'matching parameters', 7, steps, 'fit', cursor.rowcount)
         query = ('UPDATE matchingparameters set fit = UPDATElist.fit '
                  'FROM (SELECT matchingparameters.t1_id, matchingparameters.t2_id, '
-                 '((matchingparameters.lengthdiff*2+matchingparameters.directiondiff/'
-                 +maxazimuthdiff+'+(matchingparameters.meanposdev/(matchingparameters.meanlength*'
-                 +maxmeanposdevtolength+'))*4+matchingparameters.hausdorff*2)/9) as fit '
+                 +fit_sql(linematch_options)+' as fit '
                  'FROM matchingparameters) as UPDATElist '
                  'WHERE UPDATElist.t1_id = matchingparameters.t1_id and UPDATElist.t2_id = matchingparameters.t2_id;')
         cursor.execute(query)
 
         #: Create a table of matching pairs with minimal deviation = best matches
-        yield 'Finding matching pairs with minimal deviation'
+        yield self.progress('Finding matching pairs with minimal deviation', 8, steps, 'best_matches', cursor.rowcount)
         query = ('create temp table found on commit drop as '
                  'SELECT matchingparameters.t1_id, '
                  'matchingparameters.t2_id, '
@@ -1564,13 +4074,13 @@ class OSMDeviationfinder(object):
                  'GROUP BY matchingparameters.t1_id order BY matchingparameters.t1_id) as f '
                  'WHERE matchingparameters.t1_id = f.t1_id and matchingparameters.fit = f.minfit;')
         cursor.execute(query)
+        self.finish_table('found', spatial=False, cursor=cursor)
 
-        query = 'drop table if exists '+basetable+'_found;'
-        cursor.execute(query)
-
-        #: Generate a table with the results of line matching and link segmented features with their parent feature-id
-        yield 'Generating result table'
-        query = ('create table '+basetable+'_found as '
+        #: Generate a table with the results of line matching and link segmented features with their parent feature-id,
+        #: it is built into a new version, which is published after the corrections
+        yield self.progress('Generating result table', 9, steps, 'result', cursor.rowcount)
+        found = self.new_version(basetable+'_found', cursor)
+        query = ('create table '+found+' as '
                  'SELECT found.t1_id, found.t2_id, t2.old_id as osmid, '
                  't1.old_id as ref_id, t2.name as t2name, t1.name as t1name, '
                  'abs(st_length(geometry(t1.geom)::geography)-st_length(geometry(t2.geom)::geography)) '
@@ -1590,58 +4100,127 @@ class OSMDeviationfinder(object):
 
 
         #: Correct too small objects by connecting them to their parent object
-        yield 'Correcting objects'
-        query = ('UPDATE '+basetable+'_found '
+        yield self.progress('Correcting objects', 10, steps, 'correction', cursor.rowcount)
+        query = ('UPDATE '+found+' '
                  'set rel_name = subq.rel_name '
                  'FROM '
                  '(SELECT t3.name as rel_name, t2.id as t2_id '
                  'FROM '+table2+' t2, '+basetable+'_osm_rel t3 '
                  'WHERE t3.name is not null and st_contains(t2.geom,t3.geom) and t3.route=\'road\') as subq '
-                 'WHERE '+basetable+'_found.t2_id = subq.t2_id;')
+                 'WHERE '+found+'.t2_id = subq.t2_id;')
         cursor.execute(query)
 
         #yield 'Calculating levenshtein distance for matches'
-        #query = ('UPDATE '+basetable+'_found '
+        #query = ('UPDATE '+found+' '
         #         'set levenshteindiff = subq.levenshteindiff '
         #         'FROM '
         #         '(SELECT levenshtein(f.t2name,f.t1name) as levenshteindiff, f.t2_id, f.t1_id '
         #         'FROM '+basetable+'_found f '
         #         'WHERE f.t2_id = t2_id and f.t1_id = t1_id and f.t2name is not null and f.t1name is not null) as subq '
-        #         'WHERE '+basetable+'_found.t2_id = subq.t2_id and '+basetable+'_found.t1_id = subq.t1_id;')
+        #         'WHERE '+found+'.t2_id = subq.t2_id and '+found+'.t1_id = subq.t1_id;')
         #cursor.execute(query)
 
-        yield 'Calculating levenshtein distance for matches'
-        query = ('UPDATE '+basetable+'_found '
-                 'set rel_name = subq.rel_name '
+        #: Street names repeat along the split segments of a street, so the distances of the names and relation names
+        #: are calculated once per distinct pair of normalized names (see name_distances) and written in one update
+        yield self.progress('Comparing the names of the matches', 11, steps, 'names', cursor.rowcount)
+        cursor.execute('SELECT DISTINCT t1name, t2name FROM '+found+' WHERE t1name is not null and t2name is not null '
+                       'UNION SELECT DISTINCT t1name, rel_name FROM '+found+' '
+                       'WHERE t1name is not null and rel_name is not null;')
+        pairs = cursor.fetchall()
+        cursor.execute('create temp table namedistances (name1 varchar, name2 varchar, distance smallint) '
+                       'on commit drop;')
+        copy_rows(cursor, 'namedistances', ['name1', 'name2', 'distance'],
+                  ((name1, name2, d) for (name1, name2), d in zip(pairs, name_distances(pairs))))
+        self.finish_table('namedistances', ['name1'], False, cursor)
+
+        yield self.progress('Calculating levenshtein distance for matches', 12, steps, 'levenshtein', len(pairs))
+        query = ('UPDATE '+found+' '
+                 'set levenshteindiff1 = subq.levenshteindiff1, levenshteindiff2 = subq.levenshteindiff2 '
                  'FROM '
-                 '(SELECT t3.name as rel_name, t2.id as t2_id '
-                 'FROM '+table2+' t2, '+basetable+'_osm_rel t3 '
-                 'WHERE t3.name is not null and st_contains(t2.geom,t3.geom) and t3.route=\'road\') as subq '
-                 'WHERE '+basetable+'_found.t2_id = subq.t2_id;')
+                 '(SELECT f.t1_id, f.t2_id, d1.distance as levenshteindiff1, d2.distance as levenshteindiff2 '
+                 'FROM '+found+' f '
+                 'LEFT JOIN namedistances d1 ON d1.name1 = f.t1name and d1.name2 = f.t2name '
+                 'LEFT JOIN namedistances d2 ON d2.name1 = f.t1name and d2.name2 = f.rel_name '
+                 'WHERE f.t1name is not null and (f.t2name is not null or f.rel_name is not null)) as subq '
+                 'WHERE '+found+'.t2_id = subq.t2_id and '+found+'.t1_id = subq.t1_id;')
         cursor.execute(query)
 
-        yield 'Calculating levenshtein distance for matches'
-        query = ('UPDATE '+basetable+'_found '
-                 'set levenshteindiff1 = subq.levenshteindiff1 '
-                 'FROM '
-                 '(SELECT levenshtein(t2.name,t1.name) as levenshteindiff1, t2.id as t2_id, t1.id as t1_id '
-                 'FROM '+table1+' t1, '+table2+' t2, '+basetable+'_found f '
-                 'WHERE t2.id = f.t2_id and t1.id = f.t1_id and t2.name is not null and t1.name is not null) as subq '
-                 'WHERE '+basetable+'_found.t2_id = subq.t2_id and '+basetable+'_found.t1_id = subq.t1_id;')
-        cursor.execute(query)
+        rows = cursor.rowcount
+        self.publish_table(basetable+'_found', found, cursor)
+        connection.commit()
+        self.close_connection(connection)
+        yield self.progress('Linematching finished', steps, steps, 'levenshtein', rows, True)
 
-        yield 'Calculating levenshtein distance for matches'
-        query = ('UPDATE '+basetable+'_found '
-                 'set levenshteindiff2 = subq.levenshteindiff2 '
-                 'FROM '
-                 '(SELECT levenshtein(f.rel_name, t1.name) as levenshteindiff2, f.t2_id as t2_id, t1.id as t1_id '
-                 'FROM '+table1+' t1, '+basetable+'_found f '
-                 'WHERE t1.id = t1_id and f.rel_name is not null and t1.name is not null) as subq '
-                 'WHERE '+basetable+'_found.t2_id = subq.t2_id and '+basetable+'_found.t1_id = subq.t1_id;')
-        cursor.execute(query)
+    def linematch_datasets_tiled(self, linematch_options):
+        """Tile-partitioned version of linematch_datasets. The harmonized datasets are partitioned into tiles (see
+        partition_tiles) with a buffer of 2*searchradius, the tiles are matched independently as tasks of the task
+        queue, by local workers and external worker processes, see run_tasks. Finally the matches of the owned
+        reference lines are stitched into the result table, an osm line matched in several tiles keeps its best
+        matches like in linematch_datasets.
 
-        connection.commit()
-        connection.close()
+        :param linematch_options: an object of the LinematchOptions Class, see linematch_datasets
+        """
+        basetable = linematch_options.basetable
+        n = int(linematch_options.tiles)
+        buffer = 2*float(linematch_options.searchradius)
+
+        self.started = time.time()
+        self.connection = psycopg2.connect(self.dbconnectioninfo_psycopg)
+        self.cursor = self.connection.cursor()
+        cursor = self.cursor
+
+        yield self.progress('Partitioning the datasets into tiles', stage='partition')
+        partition = self.partition_tiles(basetable+'_lmtile', linematch_options.reftable,
+                                         linematch_options.osmtable, n, buffer)
+        if partition is None:
+            self.close_connection(self.connection)
+            yield 'Error: No features to match!'
+            return
+        extents = partition[0]
+
+        tasks = []
+        for extent in extents:
+            tile_options = copy.copy(linematch_options)
+            tile_options.basetable = basetable+'_lmtile'+str(extent[0])
+            tile_options.reftable = tile_options.basetable+ref_suffix
+            tile_options.osmtable = tile_options.basetable+osm_suffix
+            tile_options.tiles = 1
+            #: The tile tables are dropped after the stitching, the cache of a tile would never be reused
+            tile_options.matchcache = False
+            tile_options.tuning = False
+            #: The relations are read by the linematching of every tile
+            query = ('CREATE OR REPLACE VIEW '+tile_options.basetable+'_osm_rel AS '
+                     'SELECT * FROM '+basetable+'_osm_rel;')
+            cursor.execute(query)
+            tasks.append((extent[0], tile_options))
+
+        try:
+            for message in self.run_tasks(basetable, 'linematch', tasks, linematch_options.workers):
+                yield message
+                if message.startswith('Error'):
+                    self.close_connection(self.connection)
+                    return
+        except GeneratorExit:
+            self.close_connection(self.connection)
+            raise
+
+        yield self.progress('Stitching the tiles', stage='stitch')
+        found = self.new_version(basetable+'_found')
+        query = ('CREATE TABLE '+found+' AS WITH tiles AS ('
+                 + ' UNION ALL '.join('SELECT f.* FROM '+basetable+'_lmtile'+str(extent[0])+'_found f, '
+                                      + basetable+'_lmtile'+str(extent[0])+ref_suffix+' t1 '
+                                      'WHERE f.t1_id = t1.id AND t1.odf_owned' for extent in extents)
+                 + ') SELECT f.* FROM tiles f WHERE NOT EXISTS '
+                 '(SELECT 1 FROM tiles o WHERE o.t2_id = f.t2_id AND o.deviation < f.deviation);')
+        cursor.execute(query)
+        rows = cursor.rowcount
+        self.publish_table(basetable+'_found', found)
+        if not DEBUG:
+            for extent in extents:
+                self.drop_tables_like(basetable+'_lmtile'+str(extent[0])+'_')
+        self.connection.commit()
+        self.close_connection(self.connection)
+        yield self.progress('Linematching finished', stage='stitch', rows=rows, done=True)
 
     def create_spatial_index(self, tablename):
         query = ('CREATE INDEX '+tablename+'_gix ON '+tablename+' USING GIST(geom);')
@@ -1659,12 +4238,16 @@ class OSMDeviationfinder(object):
         http://gis.stackexchange.com/questions/16374/how-to-create-a-regular-polygon-grid-in-postgis
         It uses a postgresql-method called makegrid_2d(), this method is shown in install_grid_method()
         """
+        self.started = time.time()
         if result_options is None:
             yield 'Error: No Options definied!'
             return
 
         connection = psycopg2.connect(self.dbconnectioninfo_psycopg)
         cursor = connection.cursor()
+        #: Queries of a cancelled run are stopped, see RunHandle
+        if self.handle is not None:
+            self.handle.attach(connection)
 
         #: Shorter parameters for queries
         basetable = result_options.basetable
@@ -1679,35 +4262,32 @@ class OSMDeviationfinder(object):
         maxlev = str(result_options.maxlev)
         gridcellsize = str(result_options.gridcellsize)
 
-        #: Drop result tables if they already exist
-        yield 'Deleting existing results'
-        query = 'drop table if exists '+basetable+'_posdevlines;'
-        cursor.execute(query)
-        query = 'drop table if exists '+basetable+'_matchedref;'
-        cursor.execute(query)
-        query = 'drop table if exists '+basetable+'_matchedosm;'
-        cursor.execute(query)
-        query = 'drop table if exists '+basetable+'_unmatchedref;'
-        cursor.execute(query)
-        query = 'drop table if exists '+basetable+'_unmatchedosm;'
-        cursor.execute(query)
-        query = 'drop table if exists '+basetable+'_minlevenshtein;'
-        cursor.execute(query)
-        query = 'drop table if exists '+basetable+'_maxlevenshtein;'
-        cursor.execute(query)
-        query = ('drop table if exists '+basetable+'_grid;')
-        cursor.execute(query)
-        query = ('drop table if exists '+basetable+'_maxdevgrid;')
-        cursor.execute(query)
-        query = ('drop table if exists '+basetable+'_matchingrategrid;')
-        cursor.execute(query)
-        query = ('drop table if exists '+basetable+'_absdevgrid;')
-        cursor.execute(query)
+        #: The results are built into new versions and published at the end, until then viewers keep reading the
+        #: previous results
+        versions = {}
+
+        def build(name):
+            versions[basetable+name] = self.new_version(basetable+name, cursor)
+            return versions[basetable+name]
+
+        #: Every chosen result and the publishing is a progress step, see ProgressEvent
+        steps = 1 + len([chosen for chosen in (
+            result_options.posdevlines and result_options.posdevlinedist is not None,
+            result_options.matchedref and result_options.matchedrefminlen is not None,
+            result_options.matchedosm and result_options.matchedosmminlen is not None,
+            result_options.unmatchedref and result_options.unmatchedrefminlen is not None,
+            result_options.unmatchedosm and result_options.unmatchedosmminlen is not None,
+            result_options.minlevenshtein and result_options.minlev is not None,
+            result_options.maxlevenshtein and result_options.maxlev is not None,
+            result_options.maxdevgrid or result_options.matchingrategrid or result_options.absdevgrid,
+            result_options.maxdevgrid, result_options.matchingrategrid, result_options.absdevgrid) if chosen])
+        step = 0
 
         #: If chosen by user, create a table with lines representing positional differences
         if result_options.posdevlines and result_options.posdevlinedist is not None:
-            yield 'Creating deviation vectors'
-            query = ('create table '+basetable+'_posdevlines as '
+            step += 1
+            yield self.progress('Creating deviation vectors', step, steps, 'posdevlines', cursor.rowcount)
+            query = ('create table '+build('_posdevlines')+' as '
                      'SELECT st_makeline(st_closestpoint(t2.geom,t1.geom), t1.geom) as geom, '
                      'st_length(st_transform(st_makeline(st_closestpoint(t2.geom, t1.geom), t1.geom),32633)) as fit '
                      'FROM (SELECT id, (st_dumppoints(st_segmentize(geom, '+posdevlinedist+'))).geom '
@@ -1717,40 +4297,46 @@ class OSMDeviationfinder(object):
 
         #: If chosen by user, create table with matched features of table1
         if result_options.matchedref and result_options.matchedrefminlen is not None:
-            yield 'Extracting matched Reference Lines'
-            query = ('create table '+basetable+'_matchedt1 as '
+            step += 1
+            yield self.progress('Extracting matched Reference Lines', step, steps, 'matchedt1', cursor.rowcount)
+            query = ('create table '+build('_matchedt1')+' as '
                      '(select matches.*, t1.geom from '+table1+' t1, '+basetable+'_found matches '
                      'WHERE matches.t1_id = t1.id and st_length(t1.geom)>'+matchedt1minlen+');')
             cursor.execute(query)
 
         #: If chosen by user, create table with matched features of table2
         if result_options.matchedosm and result_options.matchedosmminlen is not None:
-            yield 'Extracting matched OSM Lines'
-            query = ('create table '+basetable+'_matchedt2 as '
+            step += 1
+            yield self.progress('Extracting matched OSM Lines', step, steps, 'matchedt2', cursor.rowcount)
+            query = ('create table '+build('_matchedt2')+' as '
                      '(select matches.*, t2.geom from '+table2+' t2, '+basetable+'_found matches '
                      'WHERE matches.t1_id = t2.id and st_length(t2.geom)>'+matchedt2minlen+');')
             cursor.execute(query)
 
         #: If chosen by user, create table with unmatched features of table1, whose lengths are > unmatchedt1minlen
         if result_options.unmatchedref and result_options.unmatchedrefminlen is not None:
-            yield 'Extracting unmatched Reference Lines'
-            query = ('create table '+basetable+'_unmatchedt1 as '
+            step += 1
+            yield self.progress('Extracting unmatched Reference Lines', step, steps, 'unmatchedt1', cursor.rowcount)
+            query = ('create table '+build('_unmatchedt1')+' as '
                      '(select matches.*, t1.geom from '+table1+' t1, '+basetable+'_found matches '
                      'WHERE matches.t1_id = t1.id and st_length(t1.geom)>'+unmatchedt1minlen+');')
             cursor.execute(query)
 
         #: If chosen by user, create table with unmatched features of table2, whose lengths are > unmatchedt2minlen
         if result_options.unmatchedosm and result_options.unmatchedosmminlen is not None:
-            yield 'Extracting unmatched OSM Lines'
-            query = ('create table '+basetable+'_unmatchedt2 as '
+            step += 1
+            yield self.progress('Extracting unmatched OSM Lines', step, steps, 'unmatchedt2', cursor.rowcount)
+            query = ('create table '+build('_unmatchedt2')+' as '
                      '(select matches.*, t2.geom from '+table2+' t2, '+basetable+'_found matches '
                      'WHERE matches.t1_id = t2.id and st_length(t2.geom)>'+unmatchedt2minlen+');')
             cursor.execute(query)
 
         #: If chosen by user, create table with matched features of table1, whose levenshteindiff < minlev
         if result_options.minlevenshtein and result_options.minlev is not None:
-            yield 'Extracting Features with Levenshteindistance < '+ minlev
-            query = ('create table '+basetable+'_minlevenshtein as '
+            step += 1
+            yield self.progress('Extracting Features with Levenshteindistance < '+minlev, step, steps,
+                                'minlevenshtein', cursor.rowcount)
+            query = ('create table '+build('_minlevenshtein')+' as '
                      '(select matches.*, t1.geom from ' + table1 + ' t1, ' + basetable + '_found matches '
                      'WHERE matches.t1_id = t1.id and matches.levenshteindiff<' + minlev +
                      ' and matches.t2name is not Null and matches.t1name is not Null);')
@@ -1758,8 +4344,10 @@ class OSMDeviationfinder(object):
 
         #: If chosen by user, create table with unmatched features of table1, whose levenshteindiff > maxlev
         if result_options.maxlevenshtein and result_options.maxlev is not None:
-            yield 'Extracting Features with Levenshteindistance > '+ maxlev
-            query = ('create table '+basetable+'_maxlevenshtein as '
+            step += 1
+            yield self.progress('Extracting Features with Levenshteindistance > '+maxlev, step, steps,
+                                'maxlevenshtein', cursor.rowcount)
+            query = ('create table '+build('_maxlevenshtein')+' as '
                      '(select matches.*, t1.geom from ' + table1 + ' t1, ' + basetable + '_found matches '
                      'WHERE matches.t1_id = t1.id and matches.levenshteindiff>' + maxlev +
                      'and matches.t2name is not Null and matches.t1name is not Null);')
@@ -1767,42 +4355,49 @@ class OSMDeviationfinder(object):
 
         #: If chosen by user, create table containing a grid for the given area of interest
         if result_options.maxdevgrid or result_options.matchingrategrid or result_options.absdevgrid:
-            yield 'Creating Grid'
+            step += 1
+            yield self.progress('Creating Grid', step, steps, 'grid', cursor.rowcount)
             #: Create grid for the given area and cellsize
-            query = ('create table '+basetable+'_grid as SELECT cell '
+            grid = build('_grid')
+            query = ('create table '+grid+' as SELECT cell '
                      'FROM (SELECT (ST_Dump(makegrid_2d((SELECT ST_ConcaveHull(ST_Collect(geom),0.99) '
                      'FROM '+table1+'),'+gridcellsize+'))).geom AS cell) AS q_grid;')
             cursor.execute(query)
 
             # Create index for faster operations on grid
-            query = ('CREATE INDEX '+basetable+'_grid_cell_idx ON '+basetable+'_grid USING GIST (cell);')
+            query = ('CREATE INDEX '+grid+'_cell_idx ON '+grid+' USING GIST (cell);')
             cursor.execute(query)
 
         #: If chosen by user, create table containing a grid with maximum deviation per grid cell
         if result_options.maxdevgrid:
-            yield 'Creating Maximum Deviation Grid'
-            if not result_options.posdevlines:
-                query = ('create temp table '+basetable+'_posdevlines on commit drop as '
+            step += 1
+            yield self.progress('Creating Maximum Deviation Grid', step, steps, 'maxdevgrid', cursor.rowcount)
+            if result_options.posdevlines:
+                posdevlines = versions[basetable+'_posdevlines']
+            else:
+                posdevlines = 'posdevlines'
+                query = ('create temp table posdevlines on commit drop as '
                          'SELECT st_makeline(st_closestpoint(t2.geom,t1.geom), t1.geom) as geom, r.deviation as fit '
                          'FROM (SELECT id, (st_dumppoints(st_segmentize(geom, '+posdevlinedist+'))).geom '
                          'FROM '+table1+') as t1, '+table2+' as t2, '+basetable+'_found r '
                          'WHERE r.t1_id = t1.id and r.t2_id = t2.id;')
                 cursor.execute(query)
-            query = ('create table '+basetable+'_maxdevgrid as '
+            query = ('create table '+build('_maxdevgrid')+' as '
                      '(select max(st_length(geometry(t1s.geom)::geography)) as maxdev, '
-                     'grid.cell as cell from '+basetable+'_grid grid, '+basetable+'_posdevlines t1s '
+                     'grid.cell as cell from '+grid+' grid, '+posdevlines+' t1s '
                      'where st_intersects(grid.cell, t1s.geom) group by grid.cell);')
             cursor.execute(query)
 
         #: If chosen by user, create table containing a grid with matching rate per grid cell
         if result_options.matchingrategrid:
-            yield 'Creating Matchingrate Grid'
-            query = ('create table '+basetable+'_matchingrategrid as '
+            step += 1
+            yield self.progress('Creating Matchingrate Grid', step, steps, 'matchingrategrid', cursor.rowcount)
+            query = ('create table '+build('_matchingrategrid')+' as '
                      '(with t1 as (select sum(st_length(st_intersection(grid.cell,t1.geom))) as t1length, '
-                     'grid.cell as cell from '+basetable+'_grid grid, '+table1+' t1 '
+                     'grid.cell as cell from '+grid+' grid, '+table1+' t1 '
                      'where st_intersects(grid.cell, t1.geom) group by grid.cell), '
                      'mt1 as (select sum(st_length(st_intersection(grid.cell,t1.geom))) as mt1length, '
-                     'grid.cell as cell from '+basetable+'_grid grid, '+table1+' t1,  '+basetable+'_found as matched '
+                     'grid.cell as cell from '+grid+' grid, '+table1+' t1,  '+basetable+'_found as matched '
                      'where st_intersects(grid.cell, t1.geom) and t1.id = matched.t1_id group by grid.cell) '
                      'select (mt1.mt1length/t1.t1length) as matchingrate, t1.cell as cell from t1, mt1 '
                      'where st_equals(t1.cell,mt1.cell) and t1.t1length!=0 );')
@@ -1810,20 +4405,32 @@ class OSMDeviationfinder(object):
 
         #: If chosen by user, create table containing a grid with completeness per grid cell
         if result_options.absdevgrid:
-            yield 'Creating Completeness Grid'
-            query = ('create table '+basetable+'_absdevgrid as '
+            step += 1
+            yield self.progress('Creating Completeness Grid', step, steps, 'absdevgrid', cursor.rowcount)
+            query = ('create table '+build('_absdevgrid')+' as '
                      '(with t1 as (select sum(st_length(st_intersection(grid.cell,t1.geom))) as t1lengths, '
-                     'grid.cell as cell from '+basetable+'_grid grid, '+table1+' t1 '
+                     'grid.cell as cell from '+grid+' grid, '+table1+' t1 '
                      'where st_intersects(grid.cell, t1.geom) group by grid.cell), '
                      't2 as (select sum(st_length(st_intersection(grid.cell,t2.geom))) as t2lengths, '
-                     'grid.cell as cell from '+basetable+'_grid grid, '+table2+' t2 '
+                     'grid.cell as cell from '+grid+' grid, '+table2+' t2 '
                      'where st_intersects(grid.cell, t2.geom) group by grid.cell) '
                      'select (t1.t1lengths/t2.t2lengths) as lengthdiffratio, t1.cell as cell from t1, t2 '
                      'where st_equals(t1.cell,t2.cell));')
             cursor.execute(query)
 
+        #: Publish the new results and remove the results, which were not chosen this time
+        yield self.progress('Publishing results', steps, steps, 'publish', cursor.rowcount)
+        for name in ('_posdevlines', '_matchedt1', '_matchedt2', '_unmatchedt1', '_unmatchedt2', '_minlevenshtein',
+                     '_maxlevenshtein', '_grid', '_maxdevgrid', '_matchingrategrid', '_absdevgrid', '_matchedref',
+                     '_matchedosm', '_unmatchedref', '_unmatchedosm'):
+            if basetable+name in versions:
+                self.publish_table(basetable+name, versions[basetable+name], cursor)
+            else:
+                self.unpublish_table(basetable+name, cursor)
+
         connection.commit()
-        connection.close()
+        self.close_connection(connection)
+        yield self.progress('Results published', steps, steps, 'publish', done=True)
 
     def install_asmultipoint(self):
         """Function to install the postgresql-method named asmultipoint used by geometric correction"""
@@ -1934,6 +4541,40 @@ ALTER FUNCTION public.st_asmultipoint(geometry)
             print concavehull
         return concavehull
 
+    def has_columns(self, table, columns, schema='public', cursor=None):
+        """Returns True if all given columns exist in the chosen table and schema.
+        Uses the cursor of the currently running process (or the given cursor), so uncommitted tables are found too.
+        """
+        if cursor is None:
+            cursor = self.cursor
+        query = ("SELECT count(*) FROM information_schema.columns WHERE table_schema = '"+schema+"' "
+                 "AND table_name = '"+table+"' "
+                 "AND column_name IN ('"+"','".join(columns)+"');")
+        cursor.execute(query)
+        return cursor.fetchone()[0] == len(columns)
+
+    def drop_tables_like(self, prefix, schema='public'):
+        """Drops all tables, whose name starts with the given prefix, and removes them from the registries
+
+        :param prefix: the prefix of the tables to drop
+        """
+        pattern = prefix.replace('_', '\\_')+'%'
+        #: Published tables are views of their versions, the views are dropped first
+        query = ('SELECT table_name, table_type FROM information_schema.tables '
+                 'WHERE table_schema = %s and table_name LIKE %s ORDER BY table_type = \'VIEW\' DESC;')
+        self.cursor.execute(query, (schema, pattern))
+        for row in self.cursor.fetchall():
+            if row[1] == 'VIEW':
+                self.cursor.execute('DROP VIEW IF EXISTS '+row[0]+';')
+            else:
+                self.cursor.execute('DROP TABLE IF EXISTS '+row[0]+';')
+        self.create_topology_registry()
+        query = 'DELETE FROM '+topology_table+' WHERE tablename LIKE %s;'
+        self.cursor.execute(query, (pattern,))
+        self.create_intermediate_registry()
+        query = 'DELETE FROM '+intermediates_table+' WHERE tablename LIKE %s;'
+        self.cursor.execute(query, (pattern,))
+
     def get_textcolumns(self, table, schema='public'):
         """Returns all columns of type character varying of chosen table and schema.
         """
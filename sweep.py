@@ -0,0 +1,307 @@
+#  -*- coding: utf-8 -*-
+"""
+    OSM Deviation Finder - Parameter Sweep
+    ~~~~~~~~~~~~~~~~~~~~
+
+    Runs the harmonization and linematching of an existing deviation map for every combination of a grid of
+    HarmonizeOptions and LinematchOptions values in parallel, in a pool of processes with their own database
+    connections, and reports the runtime, the number of candidates, the match rate and the mean deviation of every
+    combination.
+
+    Every harmonization runs once per distinct combination of harmonization values, in its own set of tables, on
+    unlogged copies of the imported datasets of the map (the harmonization indexes its inputs, which views can't
+    have). The linematchings share the split tables of their harmonization. Linematchings, which only differ in
+    their limits and weights, run one after another on the same cached matching parameters (see
+    LinematchOptions.tuning), so only the first of them calculates the parameters, use --no-reuse to measure the
+    runtime of every combination on its own.
+
+    The grid is a json file with a list or a single value per option, eg.:
+        {"harmonize": {"harmonize": true, "searchradius": [0.0003, 0.0005]},
+         "linematch": {"maxanglediff": [0.2, 0.32], "posdiffsegmentlength": [0.0005, 0.001]}}
+    or is given by --set options (repeatable).
+
+    Usage:
+        python sweep.py "dbname=odf host=localhost user=odf password=odf" 1a2b3c4d --grid grid.json
+        python sweep.py "dbname=odf host=localhost user=odf password=odf" 1a2b3c4d \\
+            --set linematch.searchradius=0.0003,0.0005 --set linematch.maxanglediff=0.2,0.32 --processes 4
+
+    :copyright: (c) 2015 by Martin Hochenwarter
+    :license:  MIT
+"""
+
+__author__ = 'Martin Hochenwarter'
+__version__ = '0.1'
+
+import csv
+import json
+import time
+import argparse
+import itertools
+import multiprocessing
+import psycopg2
+from osmdeviationfinder import OSMDeviationfinder, HarmonizeOptions, LinematchOptions, table_prefix, ref_suffix, \
+    osm_suffix, splitted_suffix, stage_runs_table, match_cache_table
+
+#: The options of the linematching, which don't change its cached matching parameters, see match_cache_key
+tuning_options = ['maxazimuthdiff', 'maxmeanposdevtolength', 'minmeanposdevtolength', 'maxabsolutmeanposdev',
+                  'maxdeviation', 'lengthdiffweight', 'directiondiffweight', 'meanposdevweight', 'hausdorffweight']
+
+#: The columns of the result table
+columns = ['harmonize', 'linematch', 'harmonize_s', 'linematch_s', 'reused', 'candidates', 'matches', 'matchrate',
+           'meandeviation', 'error']
+
+
+def parse_value(value):
+    """Parses a value of a --set option as json (numbers, true, false), other values are strings"""
+    try:
+        return json.loads(value)
+    except ValueError:
+        return value
+
+
+def combinations(values):
+    """Returns a list of dictionaries with every combination of the values, a list holds the alternatives of an
+    option, any other value is used in all combinations
+
+    :param values: a dictionary with a value or a list of values per option
+    """
+    names = sorted(values)
+    alternatives = [values[n] if isinstance(values[n], list) else [values[n]] for n in names]
+    return [dict(zip(names, c)) for c in itertools.product(*alternatives)]
+
+
+def describe(values):
+    """Returns a short description of the values of a combination"""
+    return ' '.join('%s=%s' % (n, values[n]) for n in sorted(values)) or '-'
+
+
+def copy_inputs(odf, basetable, sources):
+    """Creates the unlogged tables <basetable><suffix> as copies of the given source tables and registers them as
+    intermediate tables, so they are dropped with the other tables of the sweep
+
+    :param odf: the OSMDeviationfinder with the connection to use
+    :param basetable: the basetable of the copies
+    :param sources: a dictionary with the source table per suffix
+    """
+    for suffix, source in sorted(sources.items()):
+        odf.cursor.execute('DROP TABLE IF EXISTS '+basetable+suffix+';')
+        odf.cursor.execute('CREATE UNLOGGED TABLE '+basetable+suffix+' AS SELECT * FROM '+source+';')
+        odf.register_intermediate(basetable+suffix)
+
+
+def create_views(cursor, basetable, sources):
+    """Creates the views <basetable><suffix> of the given source tables
+
+    :param basetable: the basetable of the views
+    :param sources: a dictionary with the source table per suffix
+    """
+    for suffix, source in sorted(sources.items()):
+        cursor.execute('CREATE OR REPLACE VIEW '+basetable+suffix+' AS SELECT * FROM '+source+';')
+
+
+def run_harmonize(task):
+    """Runs a harmonization in a process of the pool and returns the seconds taken and the error message or None
+
+    :param task: a tuple of the connection string and the HarmonizeOptions
+    """
+    dbconnectioninfo, options = task
+    start = time.time()
+    try:
+        for message in OSMDeviationfinder(dbconnectioninfo).harmonize_datasets(options):
+            if message.startswith('Error'):
+                return time.time()-start, str(message)
+    except Exception as e:
+        return time.time()-start, 'Error: '+str(e)
+    return time.time()-start, None
+
+
+def run_linematch_group(task):
+    """Runs the linematchings of a group, which share their matching parameters, one after another in a process of
+    the pool. Returns a list with the seconds taken, the number of candidates (of the run, which calculated them),
+    the number of matches, the match rate (matched to all reference lines), the mean deviation and the error message
+    or None per linematching.
+
+    :param task: a tuple of the connection string and the list of LinematchOptions
+    """
+    dbconnectioninfo, group = task
+    results = []
+    candidates = None
+    for options in group:
+        start = time.time()
+        error = None
+        try:
+            for message in OSMDeviationfinder(dbconnectioninfo).linematch_datasets(options):
+                if message.startswith('Error'):
+                    error = str(message)
+                    break
+                if getattr(message, 'stage', None) == 'potentialmatches' and message.done:
+                    candidates = message.rows
+        except Exception as e:
+            error = 'Error: '+str(e)
+        seconds = time.time()-start
+        if error is not None:
+            results.append((seconds, candidates, None, None, None, error))
+            continue
+        connection = psycopg2.connect(dbconnectioninfo)
+        cursor = connection.cursor()
+        cursor.execute('SELECT count(*), count(DISTINCT t1_id), avg(deviation) FROM '+options.basetable+'_found;')
+        matches, matched, deviation = cursor.fetchone()
+        cursor.execute('SELECT count(*) FROM '+options.reftable+';')
+        reflines = cursor.fetchone()[0]
+        connection.close()
+        results.append((seconds, candidates, matches, float(matched)/reflines if reflines else 0.0,
+                        float(deviation) if deviation is not None else None, None))
+    return results
+
+
+def sweep(dbconnectioninfo, map_id, grid, processes=2, reuse=True, keep=False):
+    """Runs the combinations of the grid and returns a list with a dictionary (see columns) per combination
+
+    :param dbconnectioninfo: the connection string for the database
+    :param map_id: the id of an existing deviation map
+    :param grid: a dictionary with the values per option of 'harmonize' and 'linematch', see combinations
+    :param processes: the number of processes of the pool
+    :param reuse: run linematchings, which only differ in their limits and weights, on the same cached parameters
+    :param keep: keep the tables of the sweep
+    """
+    source = table_prefix+map_id
+    prefix = map_id+'_sw'
+    harmonizations = combinations(dict({'harmonize': True}, **grid.get('harmonize', {})))
+    linematchings = combinations(grid.get('linematch', {}))
+
+    connection = psycopg2.connect(dbconnectioninfo)
+    cursor = connection.cursor()
+    odf = OSMDeviationfinder(dbconnectioninfo)
+    odf.connection = connection
+    odf.cursor = cursor
+    htasks = []
+    for i, values in enumerate(harmonizations):
+        options = HarmonizeOptions(prefix+str(i))
+        options.__dict__.update(values)
+        #: The copied inputs are intermediates, they are needed by the linematchings and dropped with the sweep
+        options.retention = 'keep'
+        copy_inputs(odf, options.basetable, {ref_suffix: source+ref_suffix, osm_suffix: source+osm_suffix,
+                                             '_osm_rel': source+'_osm_rel'})
+        htasks.append((dbconnectioninfo, options))
+    connection.commit()
+
+    views = []
+    pool = multiprocessing.Pool(processes)
+    try:
+        hresults = pool.map(run_harmonize, htasks)
+
+        #: Linematchings with the same options apart from the limits and weights form a group
+        ltasks = []
+        lgroups = []
+        for i, values in enumerate(harmonizations):
+            if hresults[i][1] is not None:
+                continue
+            groups = {}
+            for j, lvalues in enumerate(linematchings):
+                if reuse:
+                    key = tuple(sorted((n, v) for n, v in lvalues.items() if n not in tuning_options))
+                else:
+                    key = j
+                groups.setdefault(key, []).append(j)
+            for g, members in enumerate(sorted(groups.values())):
+                basetable = table_prefix+prefix+str(i)
+                group = []
+                for j in members:
+                    options = LinematchOptions(prefix+str(i)+'l'+str(g))
+                    options.__dict__.update(linematchings[j])
+                    options.reftable = basetable+ref_suffix+splitted_suffix
+                    options.osmtable = basetable+osm_suffix+splitted_suffix
+                    options.tiles = 1
+                    options.matchcache = reuse
+                    options.tuning = reuse and len(members) > 1
+                    group.append(options)
+                create_views(cursor, group[0].basetable, {ref_suffix: basetable+ref_suffix,
+                                                          '_osm_rel': basetable+'_osm_rel'})
+                views += [group[0].basetable+ref_suffix, group[0].basetable+'_osm_rel']
+                ltasks.append((dbconnectioninfo, group))
+                lgroups.append((i, members))
+        connection.commit()
+        lresults = pool.map(run_linematch_group, ltasks)
+    finally:
+        pool.close()
+        pool.join()
+
+    rows = []
+    for i, values in enumerate(harmonizations):
+        if hresults[i][1] is not None:
+            rows.append({'harmonize': describe(values), 'linematch': '-', 'harmonize_s': hresults[i][0],
+                         'error': hresults[i][1]})
+    for (i, members), results in zip(lgroups, lresults):
+        for n, (j, result) in enumerate(zip(members, results)):
+            seconds, candidates, matches, matchrate, deviation, error = result
+            rows.append({'harmonize': describe(harmonizations[i]), 'linematch': describe(linematchings[j]),
+                         'harmonize_s': hresults[i][0], 'linematch_s': seconds, 'reused': n > 0,
+                         'candidates': candidates, 'matches': matches, 'matchrate': matchrate,
+                         'meandeviation': deviation, 'error': error})
+
+    if keep:
+        #: The views of the linematchings are only needed by their runs
+        for view in views:
+            cursor.execute('DROP VIEW IF EXISTS '+view+';')
+        connection.commit()
+    else:
+        odf.drop_tables_like(table_prefix+prefix)
+        pattern = '%'+(table_prefix+prefix).replace('_', '\\_')+'%'
+        for table, column in ((stage_runs_table, 'stage'), (match_cache_table, 'basetable')):
+            cursor.execute('SELECT count(*) FROM information_schema.tables WHERE table_name = %s;', (table,))
+            if cursor.fetchone()[0]:
+                cursor.execute('DELETE FROM '+table+' WHERE '+column+' LIKE %s;', (pattern,))
+        connection.commit()
+    connection.close()
+    return rows
+
+
+def print_table(rows):
+    """Prints the results of a sweep as a table, the best match rates first"""
+    def cell(value):
+        if isinstance(value, float):
+            return '%.4f' % value
+        return '' if value is None else str(value)
+    rows = sorted(rows, key=lambda r: (-(r.get('matchrate') or 0.0), r.get('linematch_s') or 0.0))
+    table = [columns] + [[cell(r.get(c)) for c in columns] for r in rows]
+    widths = [max(len(line[k]) for line in table) for k in xrange(len(columns))]
+    for line in table:
+        print '  '.join(value.ljust(widths[k]) for k, value in enumerate(line)).rstrip()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Parameter sweep for the OSM Deviation Finder')
+    parser.add_argument('dbconnectioninfo', help='the connection string for the database')
+    parser.add_argument('map_id', help='the id of an existing deviation map')
+    parser.add_argument('--grid', help='a json file with the values per option of "harmonize" and "linematch"')
+    parser.add_argument('--set', action='append', default=[], metavar='KIND.OPTION=V1,V2',
+                        help='the values of an option, eg. linematch.maxanglediff=0.2,0.32')
+    parser.add_argument('--processes', type=int, default=multiprocessing.cpu_count())
+    parser.add_argument('--no-reuse', dest='reuse', action='store_false',
+                        help='calculate the matching parameters of every linematching on its own')
+    parser.add_argument('--keep', action='store_true', help='keep the tables of the sweep')
+    parser.add_argument('--csv', help='write the results to this csv file')
+    args = parser.parse_args()
+
+    grid = {'harmonize': {}, 'linematch': {}}
+    if args.grid:
+        with open(args.grid) as f:
+            grid.update(json.load(f))
+    for option in args.set:
+        name, values = option.split('=', 1)
+        kind, name = name.split('.', 1)
+        if kind not in grid:
+            parser.error('the kind of an option is harmonize or linematch: '+option)
+        grid[kind][name] = [parse_value(v) for v in values.split(',')]
+    for kind, cls in (('harmonize', HarmonizeOptions), ('linematch', LinematchOptions)):
+        unknown = [n for n in grid[kind] if not hasattr(cls(args.map_id), n)]
+        if unknown:
+            parser.error('unknown %s options: %s' % (kind, ', '.join(unknown)))
+
+    rows = sweep(args.dbconnectioninfo, args.map_id, grid, args.processes, args.reuse, args.keep)
+    print_table(rows)
+    if args.csv:
+        with open(args.csv, 'wb') as f:
+            writer = csv.writer(f)
+            writer.writerow(columns)
+            for row in rows:
+                writer.writerow([row.get(c) for c in columns])
@@ -25,11 +25,13 @@ import shutil
 import zipfile
 import uuid
 import socket
-from osmdeviationfinder import OSMDeviationfinder, HarmonizeOptions, LinematchOptions, ResultOptions
+from osmdeviationfinder import OSMDeviationfinder, HarmonizeOptions, LinematchOptions, ResultOptions, RunHandle
 from osgeo import ogr
 from web import app, db
-from models import User, DevMap
-from flask import json, request, Blueprint, jsonify, redirect, url_for, render_template, Response, abort, make_response
+from models import User, DevMap, Job
+from jobs import JobPool, stream_job, stream_events
+from flask import json, request, Blueprint, jsonify, redirect, url_for, render_template, Response, abort, make_response, \
+    stream_with_context
 from flask.ext.login import (current_user, login_required)
 from werkzeug.utils import secure_filename
 from geoserver.catalog import Catalog
@@ -58,6 +60,17 @@ gs_password = 'geoserver'
 gs_workspace = 'OSMDeviationMaps'
 gs_store = 'osmdeviationmaps'
 
+#: Local pool running the processing steps as background jobs, see web.jobs
+JOB_WORKERS = 2
+jobs = JobPool(JOB_WORKERS)
+
+
+@devmap.before_app_first_request
+def start_jobs():
+    """Starts the job pool with the first request, its heartbeat fails the jobs interrupted by a restart, see
+    JobPool.beat"""
+    jobs.start()
+
 
 class Shapefile(object):
     def __init__(self, name, ref, directory):
@@ -212,8 +225,9 @@ def osm_download(uid):
         bbox = json.dumps(dm.boundsxy)
         bbox = bbox[bbox.find("[["):bbox.find("]]")+2].replace('[', '').replace(']', '').replace(',', '')
         devfinder = OSMDeviationfinder(connectioninfo)
-        return Response(devfinder.osm_from_overpass(bbox, typesquery, f, uid),
-                        mimetype='text/html')
+        job_id = jobs.submit(uid, 'osmdownload', devfinder.osm_from_overpass(bbox, typesquery, f, uid))
+        return Response(stream_with_context(stream_job(job_id)), mimetype='text/html',
+                        headers={'X-Job-Id': str(job_id)})
     return render_template('osmdownload.html', uid=uid)
 
 
@@ -260,6 +274,20 @@ def harmonize(uid):
             harmonization_options.cleanrefradius = request.form['cleandistance']
         if 'streetnamecol' in request.form:
             harmonization_options.streetnamecol = request.form['streetnamecol']
+        if 'junctionmatchingengine' in request.form:
+            harmonization_options.junctionmatchingengine = request.form['junctionmatchingengine']
+        if 'cutpointengine' in request.form:
+            harmonization_options.cutpointengine = request.form['cutpointengine']
+        if 'tiles' in request.form:
+            harmonization_options.tiles = int(request.form['tiles'])
+        if 'workers' in request.form:
+            harmonization_options.workers = int(request.form['workers'])
+        if 'retention' in request.form:
+            harmonization_options.retention = request.form['retention']
+        if 'statement_timeout' in request.form:
+            harmonization_options.statement_timeout = float(request.form['statement_timeout'])
+        if 'work_mem_profile' in request.form:
+            harmonization_options.work_mem_profile = request.form['work_mem_profile']
         if harmonization_options.streetnamecol == 'NoNameCol':
             devfinder.create_nonamecolumn('odf_'+uid+'_ref')
         dm.basetable = harmonization_options.basetable
@@ -282,13 +310,75 @@ def harmonize(uid):
         dm.max_roads_countdiff = harmonization_options.max_roads_countdiff
         dm.max_azdiff = harmonization_options.max_azdiff
         dm.max_distancediff = harmonization_options.max_distancediff
+        dm.junctionmatchingengine = harmonization_options.junctionmatchingengine
+        dm.cutpointengine = harmonization_options.cutpointengine
+        dm.tiles = harmonization_options.tiles
+        dm.workers = harmonization_options.workers
+        dm.retention = harmonization_options.retention
+        dm.statement_timeout = harmonization_options.statement_timeout
+        dm.work_mem_profile = harmonization_options.work_mem_profile
         db.session.add(dm)
         db.session.commit()
-        return Response(devfinder.harmonize_datasets(harmonization_options), mimetype='text/html')
+        devfinder.handle = RunHandle(connectioninfo)
+        job_id = jobs.submit(uid, 'harmonize', devfinder.harmonize_datasets(harmonization_options), 3,
+                             devfinder.handle)
+        return Response(stream_with_context(stream_job(job_id)), mimetype='text/html',
+                        headers={'X-Job-Id': str(job_id)})
     namecolumns = devfinder.get_textcolumns('odf_'+uid+'_ref')
     return render_template('harmonize.html', uid=uid, namecolumns=namecolumns, dm=dm)
 
 
+@devmap.route('/<uid>/cancel/', methods=['POST'])
+def cancel(uid):
+    """Cancels the queued or running jobs (harmonization, linematching or result generation) of a deviation map.
+    A running job stops with an error message, see RunHandle.
+    """
+    uid = uid.encode('ISO-8859-1')
+    pending = Job.query.filter(Job.uid == uid, Job.state.in_(['queued', 'running'])).all()
+    for job in pending:
+        jobs.cancel(job.id)
+    return jsonify(cancelled=len(pending))
+
+
+@devmap.route('/<uid>/jobs/<int:job_id>/', methods=['GET'])
+def job_state(uid, job_id):
+    """Returns the state, the progress messages and the progress events of a job as json, used to poll the progress
+    of a job."""
+    uid = uid.encode('ISO-8859-1')
+    job = Job.query.get(job_id)
+    if job is None or job.uid != uid:
+        abort(404)
+    return jsonify(id=job.id, kind=job.kind, state=job.state, progress=job.messages(),
+                   events=[json.loads(event) for event in job.events.splitlines()])
+
+
+@devmap.route('/<uid>/jobs/<int:job_id>/stream/', methods=['GET'])
+def job_stream(uid, job_id):
+    """Streams the progress messages of a job, the stream can be reopened after a lost connection."""
+    uid = uid.encode('ISO-8859-1')
+    job = Job.query.get(job_id)
+    if job is None or job.uid != uid:
+        abort(404)
+    return Response(stream_with_context(stream_job(job_id)), mimetype='text/html')
+
+
+@devmap.route('/<uid>/jobs/<int:job_id>/events/', methods=['GET'])
+def job_events(uid, job_id):
+    """Relays the progress events of a job as Server-Sent Events (see web.jobs.stream_events), any number of clients
+    can watch the same job. A reconnecting EventSource continues after its last event."""
+    uid = uid.encode('ISO-8859-1')
+    job = Job.query.get(job_id)
+    if job is None or job.uid != uid:
+        abort(404)
+    last = request.headers.get('Last-Event-ID', request.args.get('last', '0'))
+    try:
+        last = int(last)
+    except ValueError:
+        last = 0
+    return Response(stream_with_context(stream_events(job_id, last)), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
 @devmap.route('/<uid>/linematch/', methods=['GET', 'POST'])
 def linematch(uid):
     """This function is used to show and handle the linematching options and process.
@@ -324,6 +414,16 @@ def linematch(uid):
             linematch_options.posdiffsegmentlength = request.form['posdiffsegmentlength']
         if 'hausdorffsegmentlength' in request.form:
             linematch_options.hausdorffsegmentlength = request.form['hausdorffsegmentlength']
+        if 'posdevengine' in request.form:
+            linematch_options.posdevengine = request.form['posdevengine']
+        if 'posdevsampling' in request.form:
+            linematch_options.posdevsampling = request.form['posdevsampling']
+        if 'posdevmaxpoints' in request.form:
+            linematch_options.posdevmaxpoints = int(request.form['posdevmaxpoints'])
+        for weight in ('lengthdiffweight', 'directiondiffweight', 'meanposdevweight', 'hausdorffweight'):
+            if weight in request.form:
+                setattr(linematch_options, weight, float(request.form[weight]))
+        linematch_options.tuning = 'matchtuning' in request.form
         if 'maxazimuthdiff' in request.form:
             linematch_options.maxazimuthdiff = request.form['maxazimuthdiff']
         if 'maxmeanposdifftolengthratio' in request.form:
@@ -341,6 +441,14 @@ def linematch(uid):
         dm.maxpotentialmatches = linematch_options.maxpotentialmatches
         dm.posdiffsegmentlength = linematch_options.posdiffsegmentlength
         dm.hausdorffsegmentlength = linematch_options.hausdorffsegmentlength
+        dm.posdevengine = linematch_options.posdevengine
+        dm.posdevsampling = linematch_options.posdevsampling
+        dm.posdevmaxpoints = linematch_options.posdevmaxpoints
+        dm.matchtuning = linematch_options.tuning
+        dm.lengthdiffweight = linematch_options.lengthdiffweight
+        dm.directiondiffweight = linematch_options.directiondiffweight
+        dm.meanposdevweight = linematch_options.meanposdevweight
+        dm.hausdorffweight = linematch_options.hausdorffweight
         dm.maxazimuthdiff = linematch_options.maxazimuthdiff
         dm.maxmeanposdevtolength = linematch_options.maxmeanposdevtolength
         dm.minmeanposdevtolength = linematch_options.minmeanposdevtolength
@@ -348,11 +456,93 @@ def linematch(uid):
         dm.maxdeviation = linematch_options.maxdeviation
         db.session.add(dm)
         db.session.commit()
-        return Response(devfinder.linematch_datasets(linematch_options), mimetype='text/html')
+        #: The tiles of the harmonization are used for the linematching too
+        linematch_options.tiles = dm.tiles or 1
+        linematch_options.workers = dm.workers if dm.workers is not None else 4
+        devfinder.handle = RunHandle(connectioninfo)
+        job_id = jobs.submit(uid, 'linematch', devfinder.linematch_datasets(linematch_options), 4, devfinder.handle)
+        return Response(stream_with_context(stream_job(job_id)), mimetype='text/html',
+                        headers={'X-Job-Id': str(job_id)})
 
     return render_template('linematch.html', uid=uid, dm=dm)
 
 
+#: The limits and weights of the linematching, which can be tuned on the cached matching parameters. The candidate
+#: parameters (eg. maxlengthdiffratio) decide which pairs are cached, they are part of the key of the cache.
+tuning_parameters = ['maxazimuthdiff', 'maxmeanposdevtolength', 'minmeanposdevtolength', 'maxabsolutmeanposdev',
+                     'lengthdiffweight', 'directiondiffweight', 'meanposdevweight', 'hausdorffweight']
+
+
+def tuned_options(uid, dm):
+    """Returns the LinematchOptions of the last linematching of a deviation map with the limits and weights of the
+    request (json or form values) applied, or None if a value isn't a number"""
+    linematch_options = LinematchOptions(uid)
+    linematch_options.keepcolumns_t2 = {'osm_id': 'varchar'}
+    for name in ('minmatchingfeatlen', 'maxlengthdiffratio', 'maxanglediff', 'maxpotentialmatches',
+                 'posdiffsegmentlength', 'hausdorffsegmentlength', 'maxazimuthdiff', 'maxmeanposdevtolength',
+                 'minmeanposdevtolength', 'maxabsolutmeanposdev', 'maxdeviation', 'posdevengine', 'posdevsampling',
+                 'posdevmaxpoints', 'lengthdiffweight', 'directiondiffweight', 'meanposdevweight', 'hausdorffweight'):
+        if getattr(dm, name) is not None:
+            setattr(linematch_options, name, getattr(dm, name))
+    if dm.searchradius2 is not None:
+        linematch_options.searchradius = dm.searchradius2
+    values = request.get_json(silent=True) or request.form
+    for name in tuning_parameters:
+        if name in values:
+            try:
+                setattr(linematch_options, name, float(values[name]))
+            except (TypeError, ValueError):
+                return None
+    linematch_options.tuning = True
+    #: Tuning runs are untiled, see LinematchOptions
+    linematch_options.tiles = 1
+    linematch_options.workers = dm.workers if dm.workers is not None else 4
+    return linematch_options
+
+
+@devmap.route('/<uid>/linematch/tuning/', methods=['POST'])
+def linematch_tuning(uid):
+    """Evaluates the limits and weights of the request (see tuning_parameters) on the matching parameters cached by
+    the last linematching with tuning enabled and returns the number of matches, the length of the unmatched
+    reference lines and the mean deviation as json, see OSMDeviationfinder.evaluate_matching.
+    """
+    uid = uid.encode('ISO-8859-1')
+    dm = DevMap.query.filter_by(uid=uid).first()
+    if dm is None:
+        abort(404)
+    linematch_options = tuned_options(uid, dm)
+    if linematch_options is None:
+        return make_response(jsonify(error='The limits and weights have to be numbers'), 400)
+    result = OSMDeviationfinder(connectioninfo).evaluate_matching(linematch_options)
+    if result is None:
+        return make_response(jsonify(error='Run the linematching with tuning enabled first, the cached matching '
+                                           'parameters are missing or out of date'), 409)
+    return jsonify(**result)
+
+
+@devmap.route('/<uid>/linematch/tuning/commit/', methods=['POST'])
+def linematch_tuning_commit(uid):
+    """Stores the limits and weights of the request as the linematching options of the deviation map and runs the
+    linematching with them as a job, which reuses the cached matching parameters. Returns the id of the job as json.
+    """
+    uid = uid.encode('ISO-8859-1')
+    dm = DevMap.query.filter_by(uid=uid).first()
+    if dm is None:
+        abort(404)
+    linematch_options = tuned_options(uid, dm)
+    if linematch_options is None:
+        return make_response(jsonify(error='The limits and weights have to be numbers'), 400)
+    for name in tuning_parameters:
+        setattr(dm, name, getattr(linematch_options, name))
+    dm.matchtuning = True
+    db.session.add(dm)
+    db.session.commit()
+    devfinder = OSMDeviationfinder(connectioninfo)
+    devfinder.handle = RunHandle(connectioninfo)
+    job_id = jobs.submit(uid, 'linematch', devfinder.linematch_datasets(linematch_options), 4, devfinder.handle)
+    return jsonify(job=job_id)
+
+
 @devmap.route('/<uid>/finished/', methods=['GET', 'POST'])
 def finished(uid):
     uid = uid.encode('ISO-8859-1')
@@ -452,7 +642,10 @@ def results(uid):
 
             db.session.add(dm)
             db.session.commit()
-        return Response(devfinder.create_results(result_options), mimetype='text/html')
+        devfinder.handle = RunHandle(connectioninfo)
+        job_id = jobs.submit(uid, 'results', devfinder.create_results(result_options), 5, devfinder.handle)
+        return Response(stream_with_context(stream_job(job_id)),
+                        mimetype='text/html', headers={'X-Job-Id': str(job_id)})
     else:
         return render_template('results.html', uid=uid)
 
@@ -796,6 +989,14 @@ def delete(uid):
                 folder = secure_filename(uid)
                 folder = os.path.join(app.config['UPLOAD_FOLDER'], folder)
                 shutil.rmtree(folder, True)
+                #: Published tables are views of their versions (<table>_v<n>), drop the views and all versions
+                for row in db.engine.execute('select table_name from information_schema.views '
+                                             'where table_schema = \'public\' and table_name like \'odf_' + uid + '%\''):
+                    db.engine.execute('drop view if exists ' + row[0])
+                for row in db.engine.execute('select table_name from information_schema.tables '
+                                             'where table_schema = \'public\' '
+                                             'and table_name ~ \'^odf_' + uid + '_.*_v[0-9]+$\''):
+                    db.engine.execute('drop table if exists ' + row[0])
                 db.engine.execute('drop table if exists odf_' + uid + '_ref')
                 db.engine.execute('drop table if exists odf_' + uid + '_ref_presplitted')
                 db.engine.execute('drop table if exists odf_' + uid + '_ref_splitted')
@@ -820,26 +1021,48 @@ def delete(uid):
                 db.engine.execute('drop table if exists odf_' + uid + '_matchingrategrid;')
                 db.engine.execute('drop table if exists odf_' + uid + '_deviationlines')
                 db.engine.execute('drop table if exists odf_' + uid + '_junction_deviationlines')
-
-                if DEBUG:
-                    db.engine.execute('drop table if exists odf_' + uid + '_osm_presplitted_cutcheckpoints')
-                    db.engine.execute('drop table if exists odf_' + uid + '_osm_presplitted_cutpoints')
-                    db.engine.execute('drop table if exists odf_' + uid + '_osm_presplitted_junctions')
-                    db.engine.execute('drop table if exists odf_' + uid + '_osm_presplitted_points')
-                    db.engine.execute('drop table if exists odf_' + uid + '_ref_corrected')
-                    db.engine.execute('drop table if exists odf_' + uid + '_ref_corrected_presplitted')
-                    db.engine.execute('drop table if exists odf_' + uid + '_ref_corrected_presplitted_cutcheckpoints')
-                    db.engine.execute('drop table if exists odf_' + uid + '_ref_corrected_presplitted_cutpoints')
-                    db.engine.execute('drop table if exists odf_' + uid + '_ref_corrected_presplitted_junction_devvec')
-                    db.engine.execute('drop table if exists odf_' + uid + '_ref_corrected_presplitted_junctions')
-                    db.engine.execute('drop table if exists odf_' + uid + '_ref_corrected_presplitted_points')
-                    db.engine.execute('drop table if exists odf_' + uid + '_result')
+                if db.engine.has_table('odf_topology'):
+                    for row in db.engine.execute('select tablename from odf_topology '
+                                                 'where tablename like \'odf_' + uid + '%\''):
+                        db.engine.execute('drop table if exists ' + row[0] + '_nodes')
+                        db.engine.execute('drop table if exists ' + row[0] + '_edges')
+                        db.engine.execute('drop table if exists ' + row[0] + '_crossings')
+                    db.engine.execute('delete from odf_topology where tablename like \'odf_' + uid + '%\'')
+                if db.engine.has_table('odf_stage_runs'):
+                    db.engine.execute('delete from odf_stage_runs where stage like \'%odf_' + uid + '%\'')
+                if db.engine.has_table('odf_intermediates'):
+                    for row in db.engine.execute('select tablename from odf_intermediates '
+                                                 'where tablename like \'odf_' + uid + '%\''):
+                        db.engine.execute('drop table if exists ' + row[0])
+                    db.engine.execute('delete from odf_intermediates where tablename like \'odf_' + uid + '%\'')
+                db.engine.execute('drop table if exists odf_' + uid + '_matchcache')
+                if db.engine.has_table('odf_match_cache'):
+                    db.engine.execute('delete from odf_match_cache where basetable = \'odf_' + uid + '\'')
+                if db.engine.has_table('odf_tasks'):
+                    #: Tasks claimed by a worker are locked, they are left to it
+                    db.engine.execute('delete from odf_tasks where id in (select id from odf_tasks '
+                                      'where run = \'odf_' + uid + '\' for update skip locked)')
+
+                #: Intermediate tables of the harmonization stages
+                db.engine.execute('drop table if exists odf_' + uid + '_osm_presplitted_cutcheckpoints')
+                db.engine.execute('drop table if exists odf_' + uid + '_osm_presplitted_cutpoints')
+                db.engine.execute('drop table if exists odf_' + uid + '_osm_presplitted_junctions')
+                db.engine.execute('drop table if exists odf_' + uid + '_osm_presplitted_points')
+                db.engine.execute('drop table if exists odf_' + uid + '_ref_corrected')
+                db.engine.execute('drop table if exists odf_' + uid + '_ref_corrected_presplitted')
+                db.engine.execute('drop table if exists odf_' + uid + '_ref_corrected_presplitted_cutcheckpoints')
+                db.engine.execute('drop table if exists odf_' + uid + '_ref_corrected_presplitted_cutpoints')
+                db.engine.execute('drop table if exists odf_' + uid + '_ref_corrected_presplitted_junction_devvec')
+                db.engine.execute('drop table if exists odf_' + uid + '_ref_corrected_presplitted_junctions')
+                db.engine.execute('drop table if exists odf_' + uid + '_ref_corrected_presplitted_points')
+                db.engine.execute('drop table if exists odf_' + uid + '_result')
 
             if 'deleteall' not in request.form:
                 db.session.add(dm)
                 db.session.commit()
                 return render_template('delete.html', uid=uid, dm=dm, error=None)
             else:
+                Job.query.filter_by(uid=uid).delete()
                 db.session.delete(dm)
                 db.session.commit()
                 return redirect(url_for('basic.index'))
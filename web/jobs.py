@@ -0,0 +1,279 @@
+#  -*- coding: utf-8 -*-
+"""
+    OSM Deviation Finder - Web Interface
+    ~~~~~~~~~~~~~~~~~~~~
+
+    Implementation of a web interface for the OSM Deviation Finder library.
+    It uses the flask microframework by Armin Ronacher
+    For more information see https://github.com/mitsuhiko/flask/
+
+    To interact with the GeoServer REST API, the GeoServer configuration client library by boundlessgeo is used, see:
+    https://github.com/boundlessgeo/gsconfig
+
+     On the client side it uses jquery.js, leaflet.js, nprogress.js, DataTables and the UIKit framework,
+     for further information see the README.md file.
+
+    :copyright: (c) 2015 by Martin Hochenwarter
+    :license:  MIT
+"""
+
+import time
+import json
+import Queue
+import threading
+from datetime import datetime, timedelta
+from web import app, db
+from models import DevMap, Job
+
+
+class JobPool(object):
+    """A local pool of worker threads, which run the processing steps of the deviation maps as jobs. The state and the
+    progress messages of a job are stored in the job table, so the web routes only enqueue a job and then stream or
+    poll its progress, a lost connection to the client doesn't stop the job. The messages of a job are buffered
+    and stored every flush_messages messages or flush_interval seconds, so a chatty job doesn't rewrite its
+    events after every message.
+
+    Several processes (eg. the processes of a WSGI server) can run a pool on the same job table, each pool keeps
+    the heartbeat of its own queued and running jobs, see beat.
+    :param workers: the number of worker threads
+    :param flush_messages: the max. number of buffered messages
+    :param flush_interval: the max. seconds between two stores of the buffered messages
+    :param heartbeat_interval: the seconds between two heartbeats of the jobs of the pool
+    :param stale_after: the seconds without a heartbeat, after which a queued or running job is failed
+    """
+    def __init__(self, workers=2, flush_messages=20, flush_interval=1.0, heartbeat_interval=30.0, stale_after=120.0):
+        self.workers = workers
+        self.flush_messages = flush_messages
+        self.flush_interval = flush_interval
+        self.heartbeat_interval = heartbeat_interval
+        self.stale_after = stale_after
+        self.tasks = Queue.Queue()
+        self.threads = []
+        self.handles = {}
+        #: The ids of the queued and running jobs of the pool
+        self.active = set()
+        self.lock = threading.Lock()
+
+    def start(self):
+        """Starts the worker threads and the heartbeat thread, if they aren't running yet"""
+        with self.lock:
+            if self.threads:
+                return
+            for target in [self.work] * self.workers + [self.beat]:
+                thread = threading.Thread(target=target)
+                thread.daemon = True
+                thread.start()
+                self.threads.append(thread)
+
+    def beat(self):
+        """Updates the heartbeat of the queued and running jobs of the pool and fails the jobs of stopped pools,
+        see reconcile"""
+        while True:
+            with app.app_context():
+                try:
+                    with self.lock:
+                        ids = list(self.active)
+                    if ids:
+                        Job.query.filter(Job.id.in_(ids)).update({'heartbeat': datetime.now()},
+                                                                 synchronize_session=False)
+                        db.session.commit()
+                    self.reconcile()
+                except Exception:
+                    db.session.rollback()
+                finally:
+                    db.session.remove()
+            time.sleep(self.heartbeat_interval)
+
+    def reconcile(self):
+        """Marks the queued and running jobs of other pools as failed, whose heartbeat is older than stale_after
+        seconds: their process stopped (eg. by a restart of the server), nothing will ever run or finish them. The
+        jobs of live pools, also in other processes, are left alone.
+        """
+        limit = datetime.now() - timedelta(seconds=self.stale_after)
+        query = Job.query.filter(Job.state.in_(['queued', 'running']), Job.heartbeat < limit)
+        with self.lock:
+            ids = list(self.active)
+        if ids:
+            query = query.filter(~Job.id.in_(ids))
+        for job in query.all():
+            job.state = 'failed'
+            job.events += json.dumps(event_dict('Error: The job was interrupted by a restart of the server')) + '\n'
+            job.finished_at = datetime.now()
+            db.session.add(job)
+        db.session.commit()
+
+    def submit(self, uid, kind, progress, state=None, handle=None):
+        """Enqueues a job and returns its id.
+
+        :param uid: the uid of the deviation map
+        :param kind: the kind of the job eg. 'harmonize'
+        :param progress: the generator of the processing step, yielding its progress messages
+        :param state: the state of the deviation map, which is set if the job finished without an error message
+        :param handle: the RunHandle of the processing step, used to cancel the job
+        """
+        self.start()
+        job = Job(uid, kind)
+        db.session.add(job)
+        db.session.commit()
+        with self.lock:
+            self.active.add(job.id)
+            if handle is not None:
+                self.handles[job.id] = handle
+        self.tasks.put((job.id, progress, state))
+        return job.id
+
+    def cancel(self, job_id):
+        """Cancels a job: a queued job is not started, the queries of a running job are cancelled
+
+        :param job_id: the id of the job
+        """
+        with self.lock:
+            handle = self.handles.get(job_id)
+        if handle is not None:
+            handle.cancel()
+        job = Job.query.get(job_id)
+        if job is not None and job.state == 'queued':
+            job.state = 'cancelled'
+            job.finished_at = datetime.now()
+            db.session.add(job)
+            db.session.commit()
+
+    def work(self):
+        while True:
+            job_id, progress, state = self.tasks.get()
+            with app.app_context():
+                try:
+                    self.run(job_id, progress, state)
+                finally:
+                    db.session.remove()
+                    with self.lock:
+                        self.handles.pop(job_id, None)
+                        self.active.discard(job_id)
+
+    def run(self, job_id, progress, state):
+        """Runs a job and stores its progress messages and events. Plain progress messages are stored as events with
+        only a message.
+
+        :param job_id: the id of the job
+        :param progress: the generator of the processing step
+        :param state: the state of the deviation map, which is set if the job finished without an error message
+        """
+        job = Job.query.get(job_id)
+        if job.state != 'queued':
+            progress.close()
+            return
+        job.state = 'running'
+        job.started_at = datetime.now()
+        db.session.add(job)
+        db.session.commit()
+
+        failed = False
+        buffered = []
+        flushed = time.time()
+        try:
+            for message in progress:
+                if message.startswith('Error'):
+                    failed = True
+                buffered.append(message)
+                if len(buffered) >= self.flush_messages or time.time()-flushed >= self.flush_interval:
+                    self.store(job, buffered)
+                    db.session.commit()
+                    buffered = []
+                    flushed = time.time()
+        except Exception as e:
+            db.session.rollback()
+            failed = True
+            buffered.append('Error: ' + str(e))
+        self.store(job, buffered)
+
+        with self.lock:
+            handle = self.handles.get(job_id)
+        if handle is not None and handle.cancelled():
+            job.state = 'cancelled'
+        elif failed:
+            job.state = 'failed'
+        else:
+            job.state = 'finished'
+            if state is not None:
+                dm = DevMap.query.filter_by(uid=job.uid).first()
+                dm.state = state
+                db.session.add(dm)
+        job.finished_at = datetime.now()
+        db.session.add(job)
+        db.session.commit()
+
+    def store(self, job, messages):
+        """Appends buffered progress messages and events to the events of a job, the caller commits them. The
+        messages are only stored as part of their events, see Job.messages.
+
+        :param job: the job
+        :param messages: the progress messages or events
+        """
+        if messages:
+            job.events += ''.join(json.dumps(event_dict(message)) + '\n' for message in messages)
+            db.session.add(job)
+
+
+def event_dict(message):
+    """Returns a progress message or event as a dictionary, see osmdeviationfinder.ProgressEvent"""
+    if hasattr(message, 'to_dict'):
+        return message.to_dict()
+    return {'message': message, 'stage': None, 'step': None, 'steps': None, 'rows': None, 'elapsed': None,
+            'done': False}
+
+
+def stream_job(job_id, interval=0.5):
+    """Streams the progress messages of a job by polling the job table until the job is done. The stream can be
+    (re)opened at any time, it always starts with the first message of the job.
+
+    :param job_id: the id of the job
+    :param interval: the polling interval in seconds
+    """
+    sent = 0
+    while True:
+        #: End the transaction, so the next query sees the progress committed by the worker
+        db.session.commit()
+        job = Job.query.get(job_id)
+        if job is None:
+            return
+        messages = job.messages()
+        if len(messages) > sent:
+            yield ''.join(message + '\n' for message in messages[sent:])
+            sent = len(messages)
+        if job.done():
+            return
+        time.sleep(interval)
+
+
+def stream_events(job_id, last=0, interval=0.5):
+    """Streams the progress events of a job as Server-Sent Events by polling the job table until the job is done.
+    The id of an event is its number, so a reconnecting client (sending the Last-Event-ID header) continues after
+    the last received event. Every observer polls the job table on its own, the job runs only once. The stream
+    ends with an 'end' event containing the final state of the job.
+
+    :param job_id: the id of the job
+    :param last: the number of the last event received by the client
+    :param interval: the polling interval in seconds
+    """
+    sent = last
+    idle = 0
+    while True:
+        #: End the transaction, so the next query sees the events committed by the worker
+        db.session.commit()
+        job = Job.query.get(job_id)
+        if job is None:
+            return
+        events = job.events.splitlines()
+        for event in events[sent:]:
+            sent += 1
+            idle = 0
+            yield 'id: %d\ndata: %s\n\n' % (sent, event)
+        if job.done():
+            yield 'event: end\ndata: %s\n\n' % json.dumps({'state': job.state})
+            return
+        #: A comment every 15 seconds keeps proxies from closing an idle stream
+        idle += interval
+        if idle >= 15:
+            idle = 0
+            yield ': keepalive\n\n'
+        time.sleep(interval)
@@ -18,6 +18,7 @@
 """
 
 
+import json
 from web import db
 from datetime import datetime
 from werkzeug.security import generate_password_hash, check_password_hash
@@ -131,6 +132,13 @@ class DevMap(db.Model):
     max_roads_countdiff = db.Column(db.DECIMAL)
     max_azdiff = db.Column(db.DECIMAL)
     max_distancediff = db.Column(db.DECIMAL)
+    junctionmatchingengine = db.Column(db.String(16))
+    cutpointengine = db.Column(db.String(16))
+    tiles = db.Column(db.Integer)
+    workers = db.Column(db.Integer)
+    retention = db.Column(db.String(16))
+    statement_timeout = db.Column(db.DECIMAL)
+    work_mem_profile = db.Column(db.String(16))
 
     searchradius2 = db.Column(db.DECIMAL)
     minmatchingfeatlen = db.Column(db.DECIMAL)
@@ -139,6 +147,14 @@ class DevMap(db.Model):
     maxpotentialmatches = db.Column(db.INTEGER)
     posdiffsegmentlength = db.Column(db.DECIMAL)
     hausdorffsegmentlength = db.Column(db.DECIMAL)
+    posdevengine = db.Column(db.String(16))
+    posdevsampling = db.Column(db.String(16))
+    posdevmaxpoints = db.Column(db.INTEGER)
+    matchtuning = db.Column(db.Boolean, default=False)
+    lengthdiffweight = db.Column(db.DECIMAL)
+    directiondiffweight = db.Column(db.DECIMAL)
+    meanposdevweight = db.Column(db.DECIMAL)
+    hausdorffweight = db.Column(db.DECIMAL)
     maxazimuthdiff = db.Column(db.DECIMAL)
     maxmeanposdevtolength = db.Column(db.DECIMAL)
     minmeanposdevtolength = db.Column(db.DECIMAL)
@@ -171,7 +187,8 @@ class DevMap(db.Model):
         self.owner = owner
         self.created_at = datetime.now()
         self.last_change = datetime.now()
-        #: State is not yet implemeneted! It's used as a statemachine to keep track of deviation map creation
+        #: State is used as a statemachine to keep track of deviation map creation, it's set when a processing step
+        #: finished. The state of the single harmonization stages is kept by the library (odf_stage_runs)
         self.state = 0  #: 0=created, 1=imported, 2=osmdownloaded, 3=splitted, 4=linematched, 5=results, 6=exported
         self.title = None
         self.source = None
@@ -225,6 +242,13 @@ class DevMap(db.Model):
         self.max_roads_countdiff = 3
         self.max_azdiff = 0.0
         self.max_distancediff = 0.0
+        self.junctionmatchingengine = 'sql'
+        self.cutpointengine = 'sql'
+        self.tiles = 1
+        self.workers = 4
+        self.retention = 'keep'
+        self.statement_timeout = 0
+        self.work_mem_profile = 'default'
 
         self.searchradius2 = 0.0005
         self.maxlengthdiffratio = 2.0
@@ -233,6 +257,14 @@ class DevMap(db.Model):
         self.maxpotentialmatches = 10
         self.posdiffsegmentlength = 0.001
         self.hausdorffsegmentlength = 0.005
+        self.posdevengine = 'sql'
+        self.posdevsampling = 'fixed'
+        self.posdevmaxpoints = 32
+        self.matchtuning = False
+        self.lengthdiffweight = 2.0
+        self.directiondiffweight = 1.0
+        self.meanposdevweight = 4.0
+        self.hausdorffweight = 2.0
         self.maxazimuthdiff = 1.0472
         self.maxmeanposdevtolength = 0.6
         self.minmeanposdevtolength = 0.0001
@@ -260,4 +292,38 @@ class DevMap(db.Model):
 
 
     def __repr__(self):
-        return '<Map UID: %r>' % self.uid
\ No newline at end of file
+        return '<Map UID: %r>' % self.uid
+
+class Job(db.Model):
+    """A processing step of a deviation map (harmonization, linematching, ...) which runs in the background, see
+    web.jobs. The progress events of the step (see osmdeviationfinder.ProgressEvent) are appended to events as
+    json, one per line, the progress messages are derived from them, see messages.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    uid = db.Column(db.String(140), index=True)
+    kind = db.Column(db.String(32))
+    state = db.Column(db.String(16))
+    events = db.Column(db.Text)
+    created_at = db.Column(db.DateTime)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    #: Updated by the job pool running the job, see web.jobs.JobPool.beat
+    heartbeat = db.Column(db.DateTime)
+
+    def __init__(self, uid, kind):
+        self.uid = uid
+        self.kind = kind
+        self.state = 'queued'
+        self.events = ''
+        self.created_at = datetime.now()
+        self.heartbeat = self.created_at
+
+    def done(self):
+        return self.state in ('finished', 'failed', 'cancelled')
+
+    def messages(self):
+        """Returns the list of the progress messages of the job, taken from its events"""
+        return [json.loads(event)['message'] for event in self.events.splitlines()]
+
+    def __repr__(self):
+        return '<Job ID: %r>' % self.id
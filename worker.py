@@ -0,0 +1,57 @@
+#  -*- coding: utf-8 -*-
+"""
+    OSM Deviation Finder - Worker
+    ~~~~~~~~~~~~~~~~~~~~
+
+    A standalone worker process, which claims the tile tasks of tiled harmonizations and linematchings from the task
+    queue in the database (see OSMDeviationfinder.run_tasks) and runs them. Any number of workers can run on any
+    number of machines with access to the database, several workers on one machine are enough to test the
+    distributed processing locally. Set the number of local workers of a deviation map to 0, to leave all tiles to
+    the worker processes.
+
+    Usage:
+        python worker.py "dbname=odf host=localhost user=odf password=odf"
+        python worker.py "dbname=odf host=localhost user=odf password=odf" --name box1-a --kind linematch
+
+    :copyright: (c) 2015 by Martin Hochenwarter
+    :license:  MIT
+"""
+
+__author__ = 'Martin Hochenwarter'
+__version__ = '0.1'
+
+import os
+import time
+import socket
+import argparse
+from osmdeviationfinder import OSMDeviationfinder
+
+
+def work(dbconnectioninfo, name, kind=None, interval=2.0, once=False):
+    """Runs the pending tasks of the queue, then waits for new tasks
+
+    :param dbconnectioninfo: the connection string for the database
+    :param name: the name of the worker, stored with the results of its tasks
+    :param kind: only run tasks of this kind ('harmonize' or 'linematch')
+    :param interval: the seconds to wait, if there are no pending tasks
+    :param once: stop if there are no pending tasks
+    """
+    odf = OSMDeviationfinder(dbconnectioninfo)
+    while True:
+        count = odf.work_tasks(name, kind=kind)
+        if count:
+            print '%s: finished %d tasks' % (name, count)
+        if once:
+            return
+        time.sleep(interval)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Worker for the tile tasks of the OSM Deviation Finder')
+    parser.add_argument('dbconnectioninfo', help='the connection string for the database')
+    parser.add_argument('--name', default=socket.gethostname()+'-'+str(os.getpid()),
+                        help='the name of the worker, defaults to host and process id')
+    parser.add_argument('--kind', choices=['harmonize', 'linematch'], help='only run tasks of this kind')
+    parser.add_argument('--interval', type=float, default=2.0)
+    parser.add_argument('--once', action='store_true', help='stop if there are no pending tasks')
+    args = parser.parse_args()
+    work(args.dbconnectioninfo, args.name, args.kind, args.interval, args.once)